@@ -0,0 +1,63 @@
+'''
+Compares `WCONWormTracksCreator.fill_in` with and without bulk mode on a synthetic WCON
+sample
+
+    python benchmarks/fill_in_benchmark.py --records 10000
+'''
+import argparse
+import random
+import time
+
+from owmeta_core.context import Context
+from owmeta_movement import WormTracks, WCONWormTracksCreator, WCON_SCHEMA_2020_07
+
+
+def synthetic_wcon(n_records, n_frames, n_points):
+    rand = random.Random(0)
+
+    def skeletons():
+        return [[rand.random() for _ in range(n_points)] for _ in range(n_frames)]
+
+    return {
+        'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+        'data': [{'id': str(i),
+                  't': [i + f / 30 for f in range(n_frames)],
+                  'x': skeletons(),
+                  'y': skeletons()}
+                 for i in range(n_records)]}
+
+
+def fill_in(wcon, bulk):
+    ctx = Context('http://example.org/benchmark')
+    tracks = ctx(WormTracks)(ident='http://example.org/benchmark/tracks')
+    creator = WCONWormTracksCreator(WCON_SCHEMA_2020_07, bulk=bulk)
+    start = time.perf_counter()
+    creator.fill_in(tracks, wcon, context=ctx)
+    return time.perf_counter() - start, ctx
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=10000,
+            help='Number of data records')
+    parser.add_argument('--frames', type=int, default=1,
+            help='Number of frames in each record')
+    parser.add_argument('--points', type=int, default=20,
+            help='Number of skeleton points in each frame')
+    args = parser.parse_args()
+
+    wcon = synthetic_wcon(args.records, args.frames, args.points)
+
+    bulk_time, bulk_ctx = fill_in(wcon, True)
+    print(f'bulk:    {bulk_time:8.3f} s')
+    regular_time, regular_ctx = fill_in(wcon, False)
+    print(f'regular: {regular_time:8.3f} s')
+    print(f'speed-up: {regular_time / bulk_time:.1f}x')
+
+    if set(bulk_ctx.contents_triples()) != set(regular_ctx.contents_triples()):
+        raise SystemExit('Bulk and regular modes produced different triples')
+
+
+if __name__ == '__main__':
+    main()
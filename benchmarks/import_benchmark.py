@@ -0,0 +1,55 @@
+'''
+Measures the time spent importing owmeta_movement's own modules, not counting their
+dependencies, and checks it against a budget
+
+    python benchmarks/import_benchmark.py --module owmeta_movement.command --budget 50
+
+Each import is done in a fresh interpreter with ``-X importtime``. The median over the
+runs is compared with the budget, in milliseconds. The exit status is non-zero if it's
+over budget.
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+def own_import_time(module):
+    '''
+    Returns the total "self" import time, in microseconds, of owmeta_movement modules
+    when `module` is imported
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total = 0
+    for line in proc.stderr.splitlines():
+        # Like "import time:      8451 |     463537 |   owmeta_movement"
+        if not line.startswith('import time:'):
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        if name.strip().split('.')[0] == 'owmeta_movement':
+            total += int(self_us)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='owmeta_movement',
+            help='Module to import')
+    parser.add_argument('--runs', type=int, default=5,
+            help='Number of times to import the module')
+    parser.add_argument('--budget', type=float, default=50,
+            help='Budget for the median import time, in milliseconds')
+    args = parser.parse_args()
+
+    times = [own_import_time(args.module) / 1000 for _ in range(args.runs)]
+    median = statistics.median(times)
+    print(f'{args.module}: median {median:.1f} ms over {args.runs} runs'
+          f' (min {min(times):.1f} ms, max {max(times):.1f} ms)')
+    if median > args.budget:
+        raise SystemExit(f'Over the budget of {args.budget:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Times drawing skeleton records with `~owmeta_movement.plotting.RecordPlotter` on the Agg
+backend
+
+    python benchmarks/plot_benchmark.py --skeletons 100000
+
+With ``--line-per-frame``, also times drawing each frame's skeleton as its own line, as
+`owm movement plot` used to.
+'''
+import argparse
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from owmeta_movement.plotting import RecordPlotter
+
+
+class SyntheticRecord:
+    def __init__(self, n_skeletons, n_points):
+        rng = np.random.default_rng(0)
+        t = np.linspace(0, 1, n_points)
+        offsets = rng.random((n_skeletons, 2)) * 10
+        self._x = offsets[:, :1] + t
+        self._y = offsets[:, 1:] + np.sin(t * np.pi)
+
+    def x(self):
+        return self._x
+
+    def y(self):
+        return self._y
+
+    def px(self):
+        return None
+
+    def py(self):
+        return None
+
+
+def axes():
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig.add_subplot()
+
+
+def draw(ax):
+    start = time.perf_counter()
+    ax.figure.canvas.draw()
+    return time.perf_counter() - start
+
+
+def time_collection(record, frame_stride):
+    ax = axes()
+    start = time.perf_counter()
+    RecordPlotter(ax, downsample=False, frame_stride=frame_stride).plot(record)
+    return time.perf_counter() - start, draw(ax)
+
+
+def time_line_per_frame(record):
+    ax = axes()
+    start = time.perf_counter()
+    for ske_x, ske_y in zip(record.x(), record.y()):
+        ax.plot(ske_x, ske_y)
+    return time.perf_counter() - start, draw(ax)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--skeletons', type=int, default=100000,
+            help='Number of skeletons (frames) in the record')
+    parser.add_argument('--points', type=int, default=49,
+            help='Number of points in each skeleton')
+    parser.add_argument('--frame-stride', type=int, default=1,
+            help='Draw only every n-th skeleton')
+    parser.add_argument('--line-per-frame', action='store_true',
+            help='Also time drawing a line for each skeleton')
+    args = parser.parse_args()
+
+    record = SyntheticRecord(args.skeletons, args.points)
+
+    build, render = time_collection(record, args.frame_stride)
+    print(f'collection:     build {build:8.3f} s  render {render:8.3f} s')
+    if args.line_per_frame:
+        build, render = time_line_per_frame(record)
+        print(f'line per frame: build {build:8.3f} s  render {render:8.3f} s')
+
+
+if __name__ == '__main__':
+    main()
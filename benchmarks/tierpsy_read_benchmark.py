@@ -0,0 +1,112 @@
+'''
+Compares `owmeta_movement.tierpsy.export_wcon.readData` with reading each worm's
+coordinates with its own fancy-indexed reads, on a synthetic Tierpsy features file
+
+    python benchmarks/tierpsy_read_benchmark.py --worms 500 --frames 5000
+
+Rows in the synthetic file are ordered by frame, as Tierpsy writes them, so each worm's
+rows are spread through the coordinate arrays.
+'''
+import argparse
+from collections import OrderedDict
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import tables
+
+from owmeta_movement.tierpsy.export_wcon import readData
+
+
+def write_features_file(path, n_worms, n_frames, n_points, seed=0):
+    rng = np.random.default_rng(seed)
+    # Each worm is tracked for a random span of frames
+    starts = rng.integers(0, n_frames, n_worms)
+    lengths = rng.integers(1, max(n_frames // 10, 2), n_worms)
+    worm_index = np.repeat(np.arange(n_worms), lengths)
+    timestamp = np.concatenate([np.arange(s, s + n) for s, n in zip(starts, lengths)])
+    by_frame = np.lexsort((worm_index, timestamp))
+    worm_index = worm_index[by_frame]
+    timestamp = timestamp[by_frame]
+    n_rows = len(worm_index)
+
+    features = pd.DataFrame({'worm_index': worm_index,
+                             'timestamp': timestamp,
+                             'length': rng.random(n_rows)})
+    with pd.HDFStore(path, 'w') as store:
+        store.put('features_timeseries', features, format='table')
+
+    filters = tables.Filters(complevel=1, complib='zlib')
+    with tables.File(path, 'a') as fid:
+        for name in ('skeletons', 'dorsal_contours', 'ventral_contours'):
+            fid.create_carray('/coordinates', name,
+                    obj=rng.random((n_rows, n_points, 2), dtype=np.float32),
+                    filters=filters, createparents=True)
+    return n_rows
+
+
+def read_per_worm(features_file):
+    '''
+    Reads the coordinates the way `readData` did before: three fancy-indexed reads for
+    each worm
+    '''
+    with pd.HDFStore(features_file, 'r') as fid:
+        features_timeseries = fid['/features_timeseries']
+    with tables.File(features_file, 'r') as fid:
+        skeletons = fid.get_node('/coordinates/skeletons')
+        dorsal_contours = fid.get_node('/coordinates/dorsal_contours')
+        ventral_contours = fid.get_node('/coordinates/ventral_contours')
+        for worm_id, worm_feat_time in features_timeseries.groupby('worm_index'):
+            worm_skel = skeletons[worm_feat_time.index]
+            worm_dor_cnt = dorsal_contours[worm_feat_time.index]
+            worm_ven_cnt = ventral_contours[worm_feat_time.index]
+            contour = np.hstack((worm_ven_cnt, worm_dor_cnt[:, ::-1, :]))
+            worm = OrderedDict()
+            worm['id'] = str(int(worm_id))
+            worm['x'] = worm_skel[:, :, 0]
+            worm['y'] = worm_skel[:, :, 1]
+            worm['px'] = contour[:, :, 0]
+            worm['py'] = contour[:, :, 1]
+            yield worm
+
+
+def timed(records):
+    start = time.perf_counter()
+    records = list(records)
+    return time.perf_counter() - start, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worms', type=int, default=500,
+            help='Number of worms')
+    parser.add_argument('--frames', type=int, default=5000,
+            help='Number of frames in the recording')
+    parser.add_argument('--points', type=int, default=49,
+            help='Number of points in each skeleton and contour side')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic_features.hdf5')
+        n_rows = write_features_file(path, args.worms, args.frames, args.points)
+        print(f'{n_rows} rows for {args.worms} worms')
+
+        block_time, block_records = timed(readData(path, IS_FOR_WCON=False))
+        print(f'readData: {block_time:8.3f} s')
+        per_worm_time, per_worm_records = timed(read_per_worm(path))
+        print(f'per worm: {per_worm_time:8.3f} s')
+        print(f'speed-up: {per_worm_time / block_time:.1f}x')
+
+    for new, old in zip(block_records, per_worm_records):
+        if new['id'] != old['id'] or not all(np.array_equal(new[k], old[k])
+                                              for k in ('x', 'y', 'px', 'py')):
+            raise SystemExit(f'Coordinates differ for worm {old["id"]}')
+    if len(block_records) != len(per_worm_records):
+        raise SystemExit('Different numbers of worms read')
+
+
+if __name__ == '__main__':
+    main()
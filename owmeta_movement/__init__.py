@@ -2,30 +2,126 @@
 This example uses the WCON JSON-schema to build a DataSource type and then creates a new
 DataSource with the values from an instance conforming to the schema
 '''
-from pkg_resources import resource_stream
+from base64 import b64encode
+from collections import namedtuple
+import hashlib
 import json
 import importlib
+import logging
+import os
+from os.path import expanduser, isfile, join as p, split
+import pkgutil
+import re
+import threading
 
 from owmeta_core.collections import Seq
 from owmeta_core.context import ClassContext
+from owmeta_core.dataobject import (DataObject, DatatypeProperty, ObjectProperty,
+                                    UnionProperty)
+import owmeta_core
 from owmeta_core import BASE_CONTEXT
 from owmeta_core.json_schema import (DataObjectTypeCreator,
-                                     DataObjectCreator)
+                                     DataObjectCreator,
+                                     resolve_fragment)
+from persistent import Persistent
 from pow_zodb.ZODB import register_id_series
-from rdflib.namespace import Namespace
-from rdflib.term import Literal
+from rdflib.namespace import Namespace, RDF, RDFS
+from rdflib.term import Literal, URIRef
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 BASE_SCHEMA_URL = 'http://schema.openworm.org/2020/07/sci/bio/movement'
 BASE_DATA_URL = 'http://data.openworm.org/sci/bio/movement'
 
+L = logging.getLogger(__name__)
+
 
 CONTEXT = ClassContext(imported=(BASE_CONTEXT,),
                       ident=BASE_SCHEMA_URL,
                       base_namespace=BASE_SCHEMA_URL + '#')
 
+DEFAULT_CHUNK_ROWS = 1024
+'''
+Default number of rows (i.e., frames) in each chunk of a `ChunkedArrayLiteral`
+'''
+
+
+class DataRecordMixin:
+    '''
+    Methods for `DataRecord`
+    '''
+
+    def window(self, name, t_start=None, t_end=None):
+        '''
+        Get the values of a field for frames with times between `t_start` and `t_end`,
+        inclusive.
+
+        For fields stored as a `ChunkedArrayLiteral`, only the chunks that hold frames in
+        the window are loaded.
+
+        Parameters
+        ----------
+        name : str
+            The name of the field (e.g., "x" or "y")
+        t_start : float, optional
+            Start of the window. If not given, the window is open at the start
+        t_end : float, optional
+            End of the window. If not given, the window is open at the end
+
+        Returns
+        -------
+        numpy.ndarray or list
+            Values of the field for frames in the window. A list is returned if the
+            field isn't stored as an `ArrayLiteral`
+        '''
+        t = self.data_term('t')
+        field = t if name == 't' else self.data_term(name)
+        if field is None:
+            raise AttributeError(f'No value for {name!r} on {self}')
+        if isinstance(t, ArrayLiteral) and isinstance(field, ArrayLiteral):
+            return field.take_rows(t.find_rows(t_start, t_end))
+
+        t = t.toPython()
+        field = field.toPython()
+        return [field[i] for i, ti in enumerate(t)
+                if ti is not None and
+                (t_start is None or ti >= t_start) and
+                (t_end is None or ti <= t_end)]
+
+    def data_term(self, name):
+        '''
+        Get the stored value of a field as an RDF term, without converting it to a Python
+        value
+
+        For a `ChunkedArrayLiteral`, this doesn't load any of the chunks
+
+        Parameters
+        ----------
+        name : str
+            The name of the field (e.g., "x" or "y")
+
+        Returns
+        -------
+        rdflib.term.Identifier or None
+            The value of the field, or `None` if it doesn't have one
+        '''
+        for term in getattr(self, name).get_terms():
+            return term
+        return None
+
 
 class WormTracksTypeCreator(DataObjectTypeCreator):
+    '''
+    Creates `WormTracks` and related types from the WCON schema
+
+    Besides creating the types, records a JSON-serializable description of them (see
+    `describe`) from which the same types can be made again with `rebuild`, without
+    walking the schema.
+    '''
 
     def __init__(self, name, schema, **kwargs):
         super().__init__(name,
@@ -33,17 +129,85 @@ class WormTracksTypeCreator(DataObjectTypeCreator):
                 module=__name__,
                 context=CONTEXT,
                 **kwargs)
+        self._property_types = dict()
+        self._type_descriptions = []
+
+    def proc_prop(self, path, k, v):
+        super().proc_prop(path, k, v)
+        self._property_types.setdefault(path, {})[k] = self.determine_property_type(path,
+                k, v)
 
     def create_type(self, path, schema):
         cdict = self.cdict.setdefault(path, {})
-        cdict['base_namespace'] = Namespace(BASE_SCHEMA_URL + '/')
-        cdict['base_data_namespace'] = Namespace(BASE_DATA_URL + '/')
+        cdict.setdefault('base_namespace', Namespace(BASE_SCHEMA_URL + '/'))
+        cdict.setdefault('base_data_namespace', Namespace(BASE_DATA_URL + '/'))
         res = super().create_type(path, schema)
         mod = importlib.import_module(__name__)
         setattr(mod, res.__name__, res)
         res.register_on_module(mod)
+        self._type_descriptions.append({
+            'path': list(path),
+            'name': res.__name__,
+            'doc': res.__doc__,
+            'base_namespace': str(cdict['base_namespace']),
+            'base_data_namespace': str(cdict['base_data_namespace']),
+            'properties': self._property_types.get(path, {})})
         return res
 
+    def select_base_types(self, path, schema):
+        if path == ('definitions', 'data_record'):
+            return (DataRecordMixin, DataObject)
+        return super().select_base_types(path, schema)
+
+    def describe(self, annotated_schema):
+        '''
+        Describe the types created for an annotated schema
+
+        Parameters
+        ----------
+        annotated_schema : dict
+            The schema returned from `annotate`
+
+        Returns
+        -------
+        dict
+            A JSON-serializable description of the types, in the order they were
+            created, and the annotated schema with indexes into the list of types in
+            place of the types themselves
+        '''
+        type_indexes = {d['name']: i for i, d in enumerate(self._type_descriptions)}
+        return {'types': self._type_descriptions,
+                'schema': _map_owm_types(annotated_schema,
+                    lambda typ: type_indexes[typ.__name__])}
+
+    def rebuild(self, description):
+        '''
+        Create the types in a description from `describe`
+
+        Parameters
+        ----------
+        description : dict
+            The description of the types
+
+        Returns
+        -------
+        dict
+            The annotated schema, as would be returned from `annotate`
+        '''
+        types = []
+        for type_description in description['types']:
+            path = tuple(type_description['path'])
+            cdict = self.cdict.setdefault(path, {})
+            for k, property_type in type_description['properties'].items():
+                cdict[k] = _PROPERTY_TYPES[property_type]()
+            self._property_types[path] = type_description['properties']
+            cdict['__doc__'] = type_description['doc']
+            cdict['base_namespace'] = Namespace(type_description['base_namespace'])
+            cdict['base_data_namespace'] = Namespace(
+                    type_description['base_data_namespace'])
+            types.append(self.create_type(path, {}))
+        return _map_owm_types(description['schema'], types.__getitem__)
+
 
 class WCONWormTracksCreator(DataObjectCreator):
     '''
@@ -52,9 +216,129 @@ class WCONWormTracksCreator(DataObjectCreator):
     # XXX: This class might end up being a WCONDataObjectCreator instead... we massage the
     # WCON into the right format in the DataTranslator for each type, but the mapping from
     # well-formed WCON to WormTracks can be shared.
+
+    ARRAY_FIELDS = ('t', 'x', 'y', 'px', 'py', 'ox', 'oy', 'cx', 'cy')
+    '''
+    Data record fields stored as `ArrayLiteral` if they are numeric. Custom features (those
+    starting with "@") are also stored this way if all of their values are numeric.
+    '''
+
+    BULK_EXCLUDED_FIELDS = ('walk',)
+    '''
+    Data record fields that hold objects rather than literal values. Records with these
+    fields are always created through the regular, per-element path
+    '''
+
+    def __init__(self, schema, array_storage=True, float32=False,
+            chunk_rows=DEFAULT_CHUNK_ROWS, bulk=False):
+        '''
+        Parameters
+        ----------
+        schema : dict
+            The annotated schema
+        array_storage : bool, optional
+            If `True` and NumPy is available, numeric fields in data records are stored as
+            `ArrayLiteral` rather than `DataLiteral`
+        float32 : bool, optional
+            If `True`, floating-point fields other than ``t`` are stored with single
+            precision. Time is kept at double precision since long recordings would
+            otherwise lose resolution
+        chunk_rows : int, optional
+            Arrays with more rows (frames) than this are stored as a `ChunkedArrayLiteral`
+            with chunks of this many rows. If `None`, arrays are never chunked
+        bulk : bool, optional
+            If `True`, triples for data records are generated directly and added to the
+            context in a batch rather than by creating a `DataRecord` and walking the
+            schema for every value in the record. The resulting triples are the same.
+            Values are checked against the types in the data record schema before taking
+            the bulk path; records which don't match, or which can't be handled this way
+            (e.g., ones with a "walk" or with null values), are created as usual, so
+            invalid records are rejected the same way in either mode. Bulk mode is only
+            used when there's a context and an identifier for the target. Off by default;
+            translators that convert large amounts of WCON turn it on
+        '''
+        super().__init__(schema)
+        self.array_storage = array_storage
+        self.float32 = float32
+        self.chunk_rows = chunk_rows
+        self.bulk = bulk
+        self._bulk_triples = None
+        self._bulk_checks = {}
+
+        self._data_array_schema = None
+        self._data_record_schema = None
+        self._data_record_type = None
+        for opt in schema['properties']['data'].get('oneOf', ()):
+            if opt.get('type') == 'array':
+                self._data_array_schema = opt
+                item_schema = opt.get('items', {})
+                if '$ref' in item_schema:
+                    item_schema = resolve_fragment(schema, item_schema['$ref'])
+                self._data_record_schema = item_schema
+                self._data_record_type = item_schema.get('_owm_type')
+                break
+
+    def _create(self, instance, schema=None, ident=None, target=None):
+        if (self._bulk_triples is not None and
+                schema is not None and
+                schema is self._data_array_schema['items'] and
+                self._bulk_record_ok(instance)):
+            return self._bulk_record(instance)
+        return super()._create(instance, schema, ident, target)
+
+    def _bulk_record_ok(self, record):
+        if not isinstance(record, dict) or not isinstance(record.get('id'), str):
+            return False
+        for k, v in record.items():
+            if v is None or k in self.BULK_EXCLUDED_FIELDS:
+                return False
+            if not self._bulk_check(k)(v):
+                return False
+        return True
+
+    def _bulk_check(self, key):
+        check = self._bulk_checks.get(key)
+        if check is None:
+            record_schema = self._data_record_schema
+            sub_schema = record_schema.get('properties', {}).get(key)
+            if sub_schema is None:
+                for pattern, pattern_schema in record_schema.get(
+                        'patternProperties', {}).items():
+                    if re.match(pattern, key):
+                        sub_schema = pattern_schema
+                        break
+                else:
+                    sub_schema = record_schema.get('additionalProperties', True)
+            _, check = _value_check(self.schema, sub_schema)
+            self._bulk_checks[key] = check
+        return check
+
+    def _bulk_record(self, record):
+        ident = URIRef(self.gen_ident())
+        typ = self._data_record_type
+        ns = typ.schema_namespace
+        triples = self._bulk_triples
+        triples.append((ident, RDF.type, typ.rdf_type))
+        for k, v in record.items():
+            if isinstance(v, (dict, list)):
+                v = self._data_literal(k, v)
+            else:
+                v = Literal(v)
+            triples.append((ident, ns[k], v))
+        return ident
+
+    def _flush_bulk_triples(self):
+        triples = self._bulk_triples
+        self._bulk_triples = None
+        if triples:
+            add_triples(self.context, triples)
+
     def begin_sequence(self, schema):
         path = self.path_stack
         if len(path) == 1 and path[0] == 'data':
+            if (self.bulk and self.context is not None and self._root_identifier and
+                    self._data_record_type is not None):
+                self._bulk_triples = []
             return Seq.contextualize(self.context)(ident=self.gen_ident())
         return super().begin_sequence(schema)
 
@@ -63,6 +347,13 @@ class WCONWormTracksCreator(DataObjectCreator):
         if isinstance(sequence, Seq) and len(path) == 2 and path[0] == 'data':
             if item is None:
                 return sequence
+            if isinstance(item, URIRef):
+                # Created by _bulk_record
+                # rdf:Seq is one-indexed
+                member = RDF[f'_{idx + 1}']
+                self._bulk_triples.append((sequence.identifier, member, item))
+                self._bulk_triples.append((member, RDF.type, RDFS.ContainerMembershipProperty))
+                return sequence
             # rdf:Seq is one-indexed
             sequence[idx + 1] = item
             return sequence
@@ -70,27 +361,327 @@ class WCONWormTracksCreator(DataObjectCreator):
 
     def assign(self, obj, key, val):
         path = self.path_stack
+        if len(path) == 0 and key == 'data' and self._bulk_triples is not None:
+            self._flush_bulk_triples()
         if len(path) == 2 and path[0] == 'data' and isinstance(val, (dict, list)):
-            val = DataLiteral(val)
+            val = self._data_literal(key, val)
         super().assign(obj, key, val)
 
+    def _data_literal(self, key, val):
+        if (self.array_storage and numpy is not None and
+                (key in self.ARRAY_FIELDS or key.startswith('@'))):
+            float32 = self.float32 and key != 't'
+            try:
+                if (self.chunk_rows and isinstance(val, list) and
+                        len(val) > self.chunk_rows):
+                    return ChunkedArrayLiteral(val, float32=float32,
+                            chunk_rows=self.chunk_rows)
+                return ArrayLiteral(val, float32=float32)
+            except (ValueError, TypeError):
+                L.debug('Could not store %s as an array. Falling back to DataLiteral',
+                        key, exc_info=True)
+        return DataLiteral(val)
+
+    def fill_in_stream(self, target, items, context=None, ident=None):
+        '''
+        "Fill-in" the target from the members of a WCON top-level object, like those
+        produced by `~owmeta_movement.wcon_stream.wcon_items`.
+
+        Unlike with `fill_in`, the value for "data" may be an iterator of data records.
+        The records are converted one at a time, so only one needs to be held in memory.
+
+        Parameters
+        ----------
+        target : WormTracks
+            The object to fill in
+        items : iterable of tuple
+            ``(key, value)`` pairs for members of the top-level WCON object
+        context : owmeta_core.context.Context, optional
+            The context in which objects should be created. Defaults to the context of
+            `target`
+        ident : str, optional
+            The base identifier for created objects. Defaults to the identifier of
+            `target`
+        '''
+        if ident is None and target.defined:
+            ident = target.identifier
+
+        if context is None:
+            context = target.context
+        self.context = context
+        try:
+            for key, value in items:
+                if key == 'data' and not isinstance(value, (dict, list)):
+                    self._fill_in_data_stream(target, value, ident)
+                else:
+                    self._create({key: value}, ident=ident, target=target)
+        finally:
+            del self.path_stack[:]
+            self._root_identifier = None
+            self._bulk_triples = None
+            self.context = None
+
+    def fill_in(self, target, instance, context=None, ident=None):
+        try:
+            return super().fill_in(target, instance, context=context, ident=ident)
+        finally:
+            self._bulk_triples = None
+
+    def _fill_in_data_stream(self, target, records, ident):
+        self._root_identifier = ident
+        array_schema = self._data_array_schema
+        if array_schema is None:
+            raise Exception('Expected an array option for "data" in the WCON schema')
+        record_schema = array_schema['items']
+
+        with self._pushing('data'):
+            sequence = self.begin_sequence(array_schema)
+            for idx, record in enumerate(records):
+                with self._pushing(idx):
+                    sequence = self.add_to_sequence(array_schema, sequence, idx,
+                            self._create(record, record_schema))
+        self.assign(target, 'data', sequence)
+
+
+_JSON_TYPES = {'string': (str,),
+               'boolean': (bool,),
+               'integer': (int,),
+               'number': (int, float),
+               'null': ()}
+
+
+def _value_check(root, schema):
+    '''
+    Make a function that tells whether `Creator` would accept a value for a schema
+
+    Only plain JSON values are accepted: objects would have to be created, so they're
+    rejected. Returns a pair of the exact Python types accepted, or `None` if the schema
+    isn't for a single value, and the check function
+    '''
+    while isinstance(schema, dict) and '$ref' in schema:
+        schema = resolve_fragment(root, schema['$ref'])
+
+    if schema is True:
+        return None, _accept
+    if schema is False:
+        return frozenset(), _reject
+
+    one_of = schema.get('oneOf')
+    if one_of:
+        options = [_value_check(root, opt) for opt in one_of]
+        if all(types is not None for types, _ in options):
+            return _types_check(frozenset().union(*(types for types, _ in options)))
+        checks = [check for _, check in options]
+        return None, lambda v: any(check(v) for check in checks)
+
+    typ = schema.get('type')
+    if typ is None:
+        return None, _accept
+    if typ == 'array':
+        items = schema.get('items')
+        if not items:
+            return _types_check(frozenset((list, type(None))))
+        item_types, item_check = _value_check(root, items)
+        if item_types is not None:
+            return None, lambda v: v is None or (type(v) is list and
+                                                 all(type(i) in item_types for i in v))
+        return None, lambda v: v is None or (type(v) is list and all(map(item_check, v)))
+    if typ == 'object':
+        return None, _is_none
+    return _types_check(frozenset(_JSON_TYPES.get(typ, ()) + (type(None),)))
+
+
+def _types_check(types):
+    return types, lambda v: type(v) in types
+
+
+def _accept(v):
+    return True
+
+
+def _reject(v):
+    return False
+
+
+def _is_none(v):
+    return v is None
+
+
+def add_triples(context, triples):
+    '''
+    Add triples to a context without making objects for them
+
+    The triples are saved along with other statements in the context
+
+    Parameters
+    ----------
+    context : owmeta_core.context.Context
+        The context to add the triples to
+    triples : iterable of tuple
+        The triples to add
+    '''
+    for triple in triples:
+        context.add_statement(_TripleStatement(triple, context))
+
+
+class _TripleStatement(namedtuple('_TripleStatement', ('triple', 'context'))):
+    '''
+    Stands in for a `~owmeta_core.statement.Statement` for triples added with
+    `add_triples`
+    '''
+    __slots__ = ()
+
+    def to_triple(self):
+        return self.triple
+
+    def to_quad(self):
+        return self.triple + (self.context.identifier,)
+
+
+SCHEMA_CACHE_ENV_VAR = 'OWMETA_MOVEMENT_SCHEMA_CACHE'
+'''
+Environment variable for the directory where the types created from the WCON schema are
+described, so that they can be made again without walking the schema. Set to an empty
+string to turn off caching. Defaults to ``owmeta_movement`` in the user's cache directory
+'''
+
+_SCHEMA_CACHE_VERSION = 1
+
+_PROPERTY_TYPES = {'DatatypeProperty': DatatypeProperty,
+                   'ObjectProperty': ObjectProperty,
+                   'UnionProperty': UnionProperty}
+
+_schema_types_lock = threading.RLock()
+_schema_types_created = False
+
+
+def _create_schema_types():
+    '''
+    Create `WormTracks`, `DataRecord`, and the other types from the WCON schema, and
+    `WCON_SCHEMA_2020_07` and `WCONWormTracksCreator_2020_07`
+    '''
+    global WCON_SCHEMA_2020_07, WormTracks, WCONWormTracksCreator_2020_07
+    global _schema_types_created
+    with _schema_types_lock:
+        if _schema_types_created:
+            return
+
+        # If we later get another version of the schema or change how this data source
+        # is implemented, we can add on here. The dates are for the owmeta_movement
+        # schema version rather than the WCON schema version
+        WCON_SCHEMA_2020_07 = _annotate_schema('WormTracks', 'wcon_schema_2017_06.json')
+
+        WormTracks = WormTracksTypeCreator.retrieve_type(WCON_SCHEMA_2020_07)
+
+        WCONWormTracksCreator_2020_07 = WCONWormTracksCreator(WCON_SCHEMA_2020_07)
+        _schema_types_created = True
+
+
+def _annotate_schema(name, schema_file_name):
+    '''
+    Create the types for a schema in this package, rebuilding them from the cache if the
+    schema and this module haven't changed since they were cached
+    '''
+    schema_data = pkgutil.get_data(__name__, schema_file_name)
+    creator = WormTracksTypeCreator(name, json.loads(schema_data))
+    cache_file = _schema_cache_file(name, schema_data)
+    if cache_file is None:
+        return creator.annotate()
+
+    description = _read_schema_cache(cache_file)
+    if description is not None:
+        return creator.rebuild(description)
+
+    annotated = creator.annotate()
+    description = dict(creator.describe(annotated), version=_SCHEMA_CACHE_VERSION)
+    try:
+        _write_schema_cache(cache_file, description)
+    except OSError:
+        L.debug('Unable to write schema type cache %s', cache_file, exc_info=True)
+    return annotated
 
-_wcon_schema = resource_stream('owmeta_movement', 'wcon_schema_2017_06.json')
-with _wcon_schema:
-    _schema = json.load(_wcon_schema)
 
-# If we later get another version of the schema or change how this data source is
-# implemented, we can add on here. The dates are for the owmeta_movement schema version
-# rather than the WCON schema version
-WCON_SCHEMA_2020_07 = WormTracksTypeCreator('WormTracks', _schema).annotate()
+def _schema_cache_file(name, schema_data):
+    cache_directory = os.environ.get(SCHEMA_CACHE_ENV_VAR)
+    if cache_directory is None:
+        cache_directory = p(os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache'),
+                'owmeta_movement')
+    if not cache_directory:
+        return None
+    # The types depend on how they're created as well as the schema, so this module and
+    # the version of owmeta_core, which does the creating, are part of the key
+    key = hashlib.sha256(schema_data)
+    key.update(f'\0{_SCHEMA_CACHE_VERSION}\0{owmeta_core.__version__}\0'.encode('utf-8'))
+    try:
+        with open(__file__, 'rb') as f:
+            key.update(f.read())
+    except OSError:
+        return None
+    return p(cache_directory, f'{name}-{key.hexdigest()[:32]}.json')
 
-del _wcon_schema
-del _schema
 
+def _read_schema_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            description = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if description.get('version') != _SCHEMA_CACHE_VERSION:
+        return None
+    return description
 
-WormTracks = WormTracksTypeCreator.retrieve_type(WCON_SCHEMA_2020_07)
 
-WCONWormTracksCreator_2020_07 = WCONWormTracksCreator(WCON_SCHEMA_2020_07)
+def _write_schema_cache(cache_file, description):
+    cache_directory, file_name = split(cache_file)
+    os.makedirs(cache_directory, exist_ok=True)
+    tmp = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(description, f)
+        os.replace(tmp, cache_file)
+    finally:
+        if isfile(tmp):
+            os.unlink(tmp)
+
+    # Descriptions for earlier versions of the schema or this module won't be used again
+    prefix = file_name.split('-')[0] + '-'
+    for other in os.listdir(cache_directory):
+        if other.startswith(prefix) and other.endswith('.json') and other != file_name:
+            try:
+                os.unlink(p(cache_directory, other))
+            except OSError:
+                pass
+
+
+def _map_owm_types(annotated_schema, func):
+    '''
+    Copy an annotated schema, replacing the ``_owm_type`` values with the result of
+    calling `func` with them
+    '''
+    if isinstance(annotated_schema, dict):
+        return {k: func(v) if k == '_owm_type' else _map_owm_types(v, func)
+                for k, v in annotated_schema.items()}
+    if isinstance(annotated_schema, list):
+        return [_map_owm_types(v, func) for v in annotated_schema]
+    return annotated_schema
+
+
+def __getattr__(name):
+    # The schema types are only created when one of them is first asked for, so that
+    # importing this package (e.g., for every ``owm`` command) doesn't pay for them
+    if name.startswith('_') or _schema_types_created:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    _create_schema_types()
+    try:
+        return globals()[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+
+
+def __dir__():
+    _create_schema_types()
+    return list(globals())
+
 
 DATA_LITERAL_SERIES = __name__ + '.DataLiteral'
 register_id_series(DATA_LITERAL_SERIES)
@@ -98,3 +689,287 @@ register_id_series(DATA_LITERAL_SERIES)
 
 class DataLiteral(Literal):
     zodb_id_series = DATA_LITERAL_SERIES
+
+
+ARRAY_DATATYPE = URIRef(BASE_SCHEMA_URL + '/datatype/ndarray')
+'''
+Datatype for an `ArrayLiteral` holding a single array
+'''
+
+ARRAY_MAP_DATATYPE = URIRef(BASE_SCHEMA_URL + '/datatype/ndarray_map')
+'''
+Datatype for an `ArrayLiteral` holding a mapping from names to arrays
+'''
+
+
+class ArrayLiteral(Literal):
+    '''
+    A `~rdflib.term.Literal` holding a NumPy array, or a `dict` of them, for numeric fields
+    in data records.
+
+    The array is kept as its dtype, shape, and a little-endian buffer. That buffer is what
+    gets pickled (e.g., into a ZODB store) and the value is recovered with
+    `numpy.frombuffer`, so there's no conversion per element. The lexical form is
+    ``<dtype>;<shape>;<base64 buffer>`` for a single array or a JSON object of those for a
+    `dict`. Arrays returned by `toPython` are read-only.
+
+    `find_rows` and `take_rows` are only supported for a single array.
+    '''
+    zodb_id_series = DATA_LITERAL_SERIES
+
+    def __new__(cls, value, float32=False):
+        '''
+        Parameters
+        ----------
+        value : array_like or dict
+            The numeric array or a `dict` from names to numeric arrays. ``None`` in the
+            input becomes NaN
+        float32 : bool, optional
+            If `True`, floating-point arrays are stored with single precision
+
+        Raises
+        ------
+        ValueError
+            Raised if `value` cannot be converted to a numeric array (e.g., if it's
+            ragged)
+        TypeError
+            Raised if `value` cannot be converted to a numeric array (e.g., if it contains
+            non-numeric objects)
+        '''
+        if isinstance(value, dict):
+            packed = {k: _pack_array(_numeric_array(v, float32)) for k, v in value.items()}
+        else:
+            packed = _pack_array(_numeric_array(value, float32))
+        return cls._from_packed(packed)
+
+    @classmethod
+    def _from_packed(cls, packed):
+        if isinstance(packed, dict):
+            lexical = json.dumps({k: _array_lexical(*v) for k, v in packed.items()},
+                    sort_keys=True)
+            value = {k: _unpack_array(*v) for k, v in packed.items()}
+            datatype = ARRAY_MAP_DATATYPE
+        else:
+            lexical = _array_lexical(*packed)
+            value = _unpack_array(*packed)
+            datatype = ARRAY_DATATYPE
+        # The datatypes aren't bound with rdflib, so the value is set here instead
+        res = super().__new__(cls, lexical, datatype=datatype)
+        res._value = value
+        res._packed = packed
+        return res
+
+    def __reduce__(self):
+        return (_array_literal_from_packed, (type(self), self._packed))
+
+    def find_rows(self, low=None, high=None):
+        '''
+        Find the indices of elements of a one-dimensional array between `low` and `high`,
+        inclusive
+
+        Parameters
+        ----------
+        low : float, optional
+            Lower bound. If not given, there's no lower bound
+        high : float, optional
+            Upper bound. If not given, there's no upper bound
+
+        Returns
+        -------
+        numpy.ndarray
+            The indices in ascending order
+        '''
+        return _find_rows(self.value, low, high)
+
+    def take_rows(self, rows):
+        '''
+        Select rows, indexes along the first axis, of the array
+
+        Parameters
+        ----------
+        rows : array_like of int
+            Row indices
+
+        Returns
+        -------
+        numpy.ndarray
+            The selected rows
+        '''
+        return self.value[rows]
+
+    def __gt__(self, other):
+        if isinstance(other, Literal) and self.datatype == other.datatype:
+            # Arrays have no total order, so we order by the lexical form
+            return str(self) > str(other)
+        return super().__gt__(other)
+
+    def eq(self, other):
+        if isinstance(other, Literal) and self.datatype == other.datatype:
+            return str(self) == str(other)
+        return super().eq(other)
+
+
+ARRAY_CHUNKED_DATATYPE = URIRef(BASE_SCHEMA_URL + '/datatype/ndarray_chunked')
+'''
+Datatype for a `ChunkedArrayLiteral`
+'''
+
+
+class ArrayChunk(Persistent):
+    '''
+    A block of rows from a `ChunkedArrayLiteral`.
+
+    As a `~persistent.Persistent` object, each chunk gets its own record in a ZODB store
+    and is only loaded when its rows are read.
+    '''
+
+    def __init__(self, buf):
+        self.buf = buf
+
+
+class ChunkedArrayLiteral(ArrayLiteral):
+    '''
+    An `ArrayLiteral` with its array split along the first axis into chunks of a fixed
+    number of rows, each stored in an `ArrayChunk`.
+
+    Chunks are only loaded when needed by `take_rows` or `find_rows` or when the whole
+    value is requested with `toPython`. For one-dimensional arrays (e.g., ``t``), the
+    minimum and maximum of each chunk are kept with the literal so `find_rows` can skip
+    chunks which can't match.
+
+    Since the array isn't kept in memory, the lexical form is
+    ``<dtype>;<shape>;<chunk rows>;sha256=<digest>`` with a digest of the array's buffer
+    rather than the array itself.
+    '''
+
+    def __new__(cls, value, float32=False, chunk_rows=DEFAULT_CHUNK_ROWS):
+        '''
+        Parameters
+        ----------
+        value : array_like
+            The numeric array. ``None`` in the input becomes NaN
+        float32 : bool, optional
+            If `True`, floating-point arrays are stored with single precision
+        chunk_rows : int, optional
+            Number of rows in each chunk
+
+        Raises
+        ------
+        ValueError
+            Raised if `value` cannot be converted to a numeric array of at least one
+            dimension
+        TypeError
+            Raised if `value` cannot be converted to a numeric array
+        '''
+        arr = _numeric_array(value, float32)
+        if arr.ndim == 0:
+            raise ValueError('Cannot split a zero-dimensional array into chunks')
+        arr = numpy.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+
+        chunks = []
+        bounds = [] if arr.ndim == 1 else None
+        for start in range(0, len(arr), chunk_rows):
+            part = arr[start:start + chunk_rows]
+            chunks.append(ArrayChunk(part.tobytes()))
+            if bounds is not None:
+                bounds.append(_bounds(part))
+        digest = hashlib.sha256(arr.data).hexdigest()
+        return cls._from_packed((arr.dtype.str, arr.shape, chunk_rows, chunks, bounds,
+            digest))
+
+    @classmethod
+    def _from_packed(cls, packed):
+        dtype, shape, chunk_rows, _, _, digest = packed
+        lexical = '{};{};{};sha256={}'.format(dtype, ','.join(str(d) for d in shape),
+                chunk_rows, digest)
+        res = Literal.__new__(cls, lexical, datatype=ARRAY_CHUNKED_DATATYPE)
+        res._packed = packed
+        return res
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = self.take_rows(numpy.arange(self._packed[1][0]))
+            self._value.flags.writeable = False
+        return self._value
+
+    def find_rows(self, low=None, high=None):
+        _, shape, chunk_rows, chunks, bounds, _ = self._packed
+        if bounds is None:
+            raise ValueError('find_rows is only supported for one-dimensional arrays')
+        parts = []
+        for idx, chunk_bounds in enumerate(bounds):
+            if chunk_bounds is None:
+                continue
+            chunk_min, chunk_max = chunk_bounds
+            if ((low is not None and chunk_max < low) or
+                    (high is not None and chunk_min > high)):
+                continue
+            parts.append(_find_rows(self._chunk_array(idx), low, high) + idx * chunk_rows)
+        if not parts:
+            return numpy.empty(0, dtype=numpy.intp)
+        return numpy.concatenate(parts)
+
+    def take_rows(self, rows):
+        if self._value is not None:
+            return self._value[rows]
+        dtype, shape, chunk_rows, _, _, _ = self._packed
+        rows = numpy.asarray(rows, dtype=numpy.intp)
+        res = numpy.empty(rows.shape + tuple(shape[1:]), dtype=dtype)
+        chunk_indices = rows // chunk_rows
+        for idx in numpy.unique(chunk_indices):
+            selected = chunk_indices == idx
+            res[selected] = self._chunk_array(idx)[rows[selected] - idx * chunk_rows]
+        return res
+
+    def _chunk_array(self, idx):
+        dtype, shape, _, chunks, _, _ = self._packed
+        return numpy.frombuffer(chunks[idx].buf, dtype=dtype).reshape(
+                (-1,) + tuple(shape[1:]))
+
+
+def _array_literal_from_packed(cls, packed):
+    return cls._from_packed(packed)
+
+
+def _bounds(arr):
+    if arr.dtype.kind == 'f':
+        arr = arr[~numpy.isnan(arr)]
+    if arr.size == 0:
+        return None
+    return (arr.min().item(), arr.max().item())
+
+
+def _find_rows(arr, low, high):
+    if arr.ndim != 1:
+        raise ValueError('find_rows is only supported for one-dimensional arrays')
+    mask = numpy.ones(arr.shape, dtype=bool)
+    if low is not None:
+        mask &= arr >= low
+    if high is not None:
+        mask &= arr <= high
+    return numpy.flatnonzero(mask)
+
+
+def _numeric_array(value, float32):
+    arr = numpy.asarray(value)
+    if arr.dtype.kind not in 'biuf':
+        # e.g., nulls in the input. Raises if the input is ragged or non-numeric
+        arr = numpy.asarray(value, dtype=numpy.float64)
+    if float32 and arr.dtype.kind == 'f':
+        arr = arr.astype(numpy.float32)
+    return arr
+
+
+def _pack_array(arr):
+    arr = numpy.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+    return (arr.dtype.str, arr.shape, arr.tobytes())
+
+
+def _unpack_array(dtype, shape, buf):
+    return numpy.frombuffer(buf, dtype=dtype).reshape(shape)
+
+
+def _array_lexical(dtype, shape, buf):
+    return '{};{};{}'.format(dtype, ','.join(str(d) for d in shape),
+            b64encode(buf).decode('ascii'))
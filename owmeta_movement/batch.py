@@ -0,0 +1,209 @@
+'''
+Translation of many data sources at once.
+
+Most of the time in translating a WCON data source is spent parsing the WCON and making
+triples for the `~owmeta_movement.WormTracks`, and, for CeMEE sources, extracting the
+sample from its archive. Those steps don't need the database, so they're done in a pool
+of worker processes. The outputs are then made, and saved, one at a
+time in the calling process with the same translators used for single sources.
+'''
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+import logging
+import multiprocessing
+from os.path import join as p
+import tempfile
+import zipfile
+
+from owmeta_core.context import Context
+from owmeta_core.datasource import transform
+
+from .cemee import (CeMEEWCONDataSource, CeMEEDataTranslator,
+                    CeMEEToWCON202007DataTranslator, compress_wcon, extract_sample_zip,
+                    fix_up_wcon_stream, open_sample_zip, open_wcon_output)
+from .tar_index import index_archive
+from .wcon_ds import (WCONDataSource, WCONDataTranslator, PreparedWCON,
+                      PREPARED_TRACKS_IDENT, prepared_wcon)
+from .wcon_stream import wcon_items
+
+L = logging.getLogger(__name__)
+
+
+_Job = namedtuple('_Job', ('kind', 'location', 'zip_path', 'member_name',
+    'output_path', 'bulk'))
+
+
+def translate_many(context, sources, jobs=None, transaction_manager=None, work_dir=None):
+    '''
+    Translate many WCON or CeMEE data sources
+
+    Sources are parsed and converted in `jobs` worker processes. Outputs are made and
+    saved in this process, one at a time, in the order that the workers finish. If
+    preparing a source fails, the error is logged and the other sources are still
+    translated; a `TranslateManyError` listing the failures is raised at the end.
+
+    Parameters
+    ----------
+    context : owmeta_core.context.Context
+        The context for the translators. Outputs are saved with ``context.save()``
+    sources : list of owmeta_core.datasource.DataSource
+        The sources to translate. Each must be either a
+        `~owmeta_movement.wcon_ds.WCONDataSource` or a
+        `~owmeta_movement.cemee.CeMEEWCONDataSource`
+    jobs : int, optional
+        Number of worker processes. If 1, then everything is done in this process.
+        Defaults to the number of CPUs
+    transaction_manager : transaction.TransactionManager, optional
+        If provided, each output is saved in its own transaction from this manager
+    work_dir : str, optional
+        Directory for intermediate files. A temporary directory is used by default
+
+    Yields
+    ------
+    tuple
+        Each source paired with its output, a
+        `~owmeta.data_trans.data_with_evidence_ds.DataWithEvidenceDataSource`
+
+    Raises
+    ------
+    TypeError
+        Raised if one of the sources is not a supported type
+    TranslateManyError
+        Raised after all of the other outputs have been yielded if any of the sources
+        couldn't be translated
+    '''
+    sources = list(sources)
+    for source in sources:
+        _translator_type(source)
+
+    with ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        suffix = '.wcon'
+        if compress_wcon(context.conf, CeMEEToWCON202007DataTranslator.compress_output):
+            suffix += '.gz'
+        source_jobs = []
+        for idx, source in enumerate(sources):
+            source_jobs.append(_make_job(stack, source, p(work_dir, f'{idx}{suffix}')))
+
+        # Samples are extracted in the workers. The archives holding them are indexed
+        # first, once each, so the workers don't all index the same archive at once
+        for archive in {(job.location.archive_path, job.location.index_directory)
+                        for job in source_jobs if job.kind == 'cemee'}:
+            index_archive(*archive)
+
+        if jobs == 1:
+            results = _prepare_serially(sources, source_jobs)
+        else:
+            # Spawn rather than fork: the parent may have open database connections
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs,
+                    mp_context=multiprocessing.get_context('spawn')))
+            futures = {executor.submit(_prepare, job): source
+                       for source, job in zip(sources, source_jobs)}
+            results = ((futures[f], f) for f in as_completed(futures))
+
+        failures = []
+        for source, future in results:
+            error = future.exception()
+            if error is not None:
+                L.error('Failed to translate %s', source, exc_info=error)
+                failures.append((source, error))
+                continue
+            prepared = future.result()
+            L.debug('Saving prepared translation of %s', source)
+            translator = context(_translator_type(source))()
+            if transaction_manager is None:
+                yield source, _save_prepared(context, translator, source, prepared)
+            else:
+                with transaction_manager:
+                    output = _save_prepared(context, translator, source, prepared)
+                yield source, output
+
+        if failures:
+            raise TranslateManyError(failures)
+
+
+class TranslateManyError(Exception):
+    '''
+    Raised by `translate_many` when some of the sources couldn't be translated
+
+    Attributes
+    ----------
+    failures : list of tuple
+        Each source that failed paired with the exception raised for it
+    '''
+
+    def __init__(self, failures):
+        super().__init__(f'Failed to translate {len(failures)} source(s): ' +
+                ', '.join(str(source.identifier) for source, _ in failures))
+        self.failures = failures
+
+
+def _prepare_serially(sources, source_jobs):
+    for source, job in zip(sources, source_jobs):
+        future = Future()
+        try:
+            future.set_result(_prepare(job))
+        except Exception as e:
+            future.set_exception(e)
+        yield source, future
+
+
+def _save_prepared(context, translator, source, prepared):
+    with prepared_wcon(prepared):
+        output = transform(translator, data_sources=(source,))
+    context.save()
+    return output
+
+
+def _translator_type(source):
+    if isinstance(source, CeMEEWCONDataSource):
+        return CeMEEDataTranslator
+    if isinstance(source, WCONDataSource):
+        return WCONDataTranslator
+    raise TypeError(f'Cannot translate {source}: expected a {WCONDataSource.__name__}'
+            f' or a {CeMEEWCONDataSource.__name__}')
+
+
+def _make_job(stack, source, output_path):
+    if isinstance(source, CeMEEWCONDataSource):
+        if source._cache_sample_zips():
+            location, zip_path, member_name = stack.enter_context(
+                    source.cached_sample_zip_location())
+        else:
+            location, member_name = stack.enter_context(source.sample_zip_location())
+            zip_path = None
+        return _Job('cemee', location, zip_path, member_name, output_path,
+                WCONDataTranslator.bulk)
+    return _Job('wcon', source.full_path(), None, None, None, WCONDataTranslator.bulk)
+
+
+def _prepare(job):
+    '''
+    Does the parts of translation that don't need the database. Runs in a worker process
+    '''
+    from . import WormTracks, WCONWormTracksCreator, WCON_SCHEMA_2020_07
+
+    creator = WCONWormTracksCreator(WCON_SCHEMA_2020_07, bulk=job.bulk)
+    ctx = Context(PREPARED_TRACKS_IDENT + '#context')
+    tracks = ctx(WormTracks)(ident=PREPARED_TRACKS_IDENT)
+    if job.kind == 'cemee':
+        if job.zip_path is None:
+            zip_file = open_sample_zip(job.location)
+        else:
+            extract_sample_zip(job.location, job.zip_path)
+            zip_file = open(job.zip_path, 'rb')
+        with zip_file as f, zipfile.ZipFile(f) as zf, \
+                zf.open(job.member_name) as wcon, \
+                open_wcon_output(job.output_path, job.output_path.endswith('.gz')) as out:
+            creator.fill_in_stream(tracks,
+                    fix_up_wcon_stream(wcon, out), context=ctx)
+        wcon_file_path = job.output_path
+    else:
+        with open(job.location, 'rb') as wcon:
+            creator.fill_in_stream(tracks, wcon_items(wcon),
+                    context=ctx)
+        wcon_file_path = None
+    return PreparedWCON(wcon_file_path, list(ctx.contents_triples()))
@@ -1,13 +1,15 @@
-from os import makedirs
-from os.path import splitext, join as p, isfile, isdir
+from os import makedirs, rename, getpid, unlink
+from os.path import splitext, join as p, isfile, isdir, dirname
+import gzip
 import hashlib
 import io
 import json
 import logging
 import shutil
-import tarfile
 import tempfile
 import zipfile
+from collections import namedtuple
+from collections.abc import Iterator
 from contextlib import contextmanager
 
 from owmeta.data_trans.data_with_evidence_ds import DataWithEvidenceDataSource
@@ -24,7 +26,9 @@ from owmeta_core.data_trans.local_file_ds import CommitOp
 from owmeta_core.datasource import DataTranslator, Informational
 
 from . import CONTEXT as MOVEMENT_CONTEXT
-from .wcon_ds import WCONDataSource, WCONDataTranslator
+from .wcon_ds import WCONDataSource, WCONDataTranslator, current_prepared_wcon
+from .wcon_stream import ObjectItems, wcon_items
+from .tar_index import open_tar_member
 from .zenodo import CONTEXT as ZENODO_CONTEXT, ZenodoFileDataSource
 
 SCHEMA_URL = 'http://schema.openworm.org/2020/07/sci/bio/movement/CeMEEMWT'
@@ -36,6 +40,16 @@ CONTEXT = ClassContext(ident=SCHEMA_URL,
 
 L = logging.getLogger(__name__)
 
+CACHE_SAMPLE_ZIPS_CONF_KEY = 'owmeta_movement.cemee.cache_sample_zips'
+'''
+Configuration key for overriding `CeMEEWCONDataSource.cache_sample_zips`
+'''
+
+COMPRESS_WCON_CONF_KEY = 'owmeta_movement.cemee.compress_wcon'
+'''
+Configuration key for overriding `CeMEEToWCON202007DataTranslator.compress_output`
+'''
+
 
 class CeMEEWCONDataSource(LocalFileDataSource):
     '''
@@ -60,12 +74,103 @@ class CeMEEWCONDataSource(LocalFileDataSource):
         else:
             super().accept_capability_provider(cap, provider)
 
+    cache_sample_zips = True
+    '''
+    If `True`, the sample ZIP file is extracted from the archive into the cache directory
+    and read from there. Otherwise, it's read directly out of the archive and never
+    written to disk. Overridden by the configuration value for
+    `CACHE_SAMPLE_ZIPS_CONF_KEY` if there is one
+    '''
+
     @contextmanager
     def wcon_contents(self):
         '''
         Return the wcon file contents
         '''
+        with self.sample_zip() as (zip_file, sample_wcon_file_name), \
+                zipfile.ZipFile(zip_file) as zf, \
+                zf.open(sample_wcon_file_name) as wcon:
+            yield wcon
+
+    @contextmanager
+    def sample_zip(self):
+        '''
+        Open the sample ZIP file, extracting it to the cache directory first if
+        `cache_sample_zips` is set
+
+        Yields
+        ------
+        tuple
+            The ZIP file, as a path or a seekable file object, and the name of the WCON
+            file within it
+        '''
+        if self._cache_sample_zips():
+            with self.wcon_zip_file() as res:
+                yield res
+        else:
+            with self.sample_zip_location() as (location, sample_wcon_file_name), \
+                    open_sample_zip(location) as zip_file:
+                yield zip_file, sample_wcon_file_name
+
+    @contextmanager
+    def sample_zip_location(self):
+        '''
+        Locate the sample ZIP file in the archive without extracting it
+
+        Yields
+        ------
+        tuple
+            A `SampleZip` and the name of the WCON file within the ZIP. The `SampleZip`
+            may refer to a temporary directory, so it's only valid in the context
+        '''
+        sample_zip_file_name, sample_wcon_file_name = self._sample_file_names()
+        with self._cache_directory() as cache_directory:
+            yield (SampleZip(self.full_path(), sample_zip_file_name,
+                             p(cache_directory, 'tar-index')),
+                   sample_wcon_file_name)
 
+    @contextmanager
+    def wcon_zip_file(self):
+        '''
+        Extract the sample ZIP file from the archive, if it hasn't been extracted already
+
+        Yields
+        ------
+        tuple
+            The path to the ZIP file and the name of the WCON file within it
+        '''
+        with self.cached_sample_zip_location() as (location, wcon_zip_file_name,
+                sample_wcon_file_name):
+            extract_sample_zip(location, wcon_zip_file_name)
+            yield wcon_zip_file_name, sample_wcon_file_name
+
+    @contextmanager
+    def cached_sample_zip_location(self):
+        '''
+        Locate the sample ZIP file in the archive, and where it's extracted to in the cache
+        directory, without extracting it. See `extract_sample_zip`
+
+        Yields
+        ------
+        tuple
+            A `SampleZip`, the path for the extracted ZIP file, and the name of the WCON
+            file within the ZIP. Both locations may refer to a temporary directory, so
+            they're only valid in the context
+        '''
+        sample_zip_file_name, sample_wcon_file_name = self._sample_file_names()
+
+        with self._cache_directory() as cache_directory:
+            mycachedir = p(cache_directory,
+                    hashlib.sha224(self.identifier.encode('utf-8')).hexdigest())
+            yield (SampleZip(self.full_path(), sample_zip_file_name,
+                             p(cache_directory, 'tar-index')),
+                   p(mycachedir, sample_zip_file_name),
+                   sample_wcon_file_name)
+
+    def _cache_sample_zips(self):
+        return self.conf.get(CACHE_SAMPLE_ZIPS_CONF_KEY, self.cache_sample_zips)
+
+    def _sample_file_names(self):
         sample_zip_file_name = self.sample_zip_file_name.one()
         if not sample_zip_file_name:
             raise Exception('Missing `sample_zip_file_name`')
@@ -74,7 +179,10 @@ class CeMEEWCONDataSource(LocalFileDataSource):
 
         if ext != '.zip':
             raise Exception('Expected sample_zip_file_name to be a zip file name')
+        return sample_zip_file_name, sample_wcon_file_name
 
+    @contextmanager
+    def _cache_directory(self):
         cache_directory = None
         if self._cache_provider:
             cache_directory = self._cache_provider.cache_directory(FCN(type(self)))
@@ -83,35 +191,110 @@ class CeMEEWCONDataSource(LocalFileDataSource):
         if cache_directory is None:
             cache_directory = tempfile.mkdtemp()
             cleanup_dir = True
-        mycachedir = p(cache_directory,
-                hashlib.sha224(self.identifier.encode('utf-8')).hexdigest())
-        makedirs(mycachedir, exist_ok=True)
 
         try:
-            # May re-evaluate this for resilience -- as it is, we could fail part-way
-            # through and have to redo everything
-            cached_tar_file_name = self.full_path()
-
-            wcon_zip_file_name = p(mycachedir, sample_zip_file_name)
-            if isfile(wcon_zip_file_name):
-                # TODO: check the file is the one we expect
-                pass
-            else:
-                with tarfile.open(cached_tar_file_name) as tf:
-                    tf.extract(sample_zip_file_name, mycachedir)
-
-            with zipfile.ZipFile(wcon_zip_file_name) as zf, \
-                    zf.open(sample_wcon_file_name) as wcon:
-                yield wcon
+            yield cache_directory
         finally:
             if cleanup_dir:
                 shutil.rmtree(cache_directory)
 
 
+SampleZip = namedtuple('SampleZip', ('archive_path', 'zip_file_name', 'index_directory'))
+'''
+Location of a sample ZIP file within an archive. See `open_sample_zip`
+'''
+
+
+def open_sample_zip(location):
+    '''
+    Open a sample ZIP file directly from the archive holding it
+
+    Parameters
+    ----------
+    location : SampleZip
+        Where the ZIP file is
+
+    Returns
+    -------
+    contextmanager
+        Context manager for a seekable file object which can be passed to
+        `zipfile.ZipFile`
+    '''
+    return open_tar_member(location.archive_path, location.zip_file_name,
+            location.index_directory)
+
+
+def extract_sample_zip(location, path):
+    '''
+    Extract a sample ZIP file from the archive holding it, if it hasn't been extracted
+    already
+
+    The ZIP is written to a temporary file next to `path` and then renamed, so an
+    interrupted extraction doesn't leave a truncated ZIP behind, and several processes
+    can extract ZIPs into the same directory.
+
+    Parameters
+    ----------
+    location : SampleZip
+        Where the ZIP file is
+    path : str
+        Where to extract the ZIP file to
+    '''
+    if isfile(path):
+        # TODO: check the file is the one we expect
+        return
+    makedirs(dirname(path), exist_ok=True)
+    partial_file_name = f'{path}.{getpid()}.part'
+    try:
+        with open_tar_member(location.archive_path, location.zip_file_name,
+                    location.index_directory, random_access=False) as member, \
+                open(partial_file_name, 'wb') as out:
+            shutil.copyfileobj(member, out)
+        rename(partial_file_name, path)
+    finally:
+        if isfile(partial_file_name):
+            unlink(partial_file_name)
+
+
 class ZenodoCeMEEWCONDataSource(ZenodoFileDataSource, CeMEEWCONDataSource):
     class_context = CONTEXT
 
 
+def compress_wcon(conf, default=False):
+    '''
+    Whether corrected WCON should be compressed according to the given configuration
+
+    Parameters
+    ----------
+    conf : owmeta_core.configure.Configuration
+        The configuration
+    default : bool, optional
+        Returned if `COMPRESS_WCON_CONF_KEY` isn't set in `conf`
+    '''
+    return conf.get(COMPRESS_WCON_CONF_KEY, default)
+
+
+def open_wcon_output(path, compress=False):
+    '''
+    Open a file for writing WCON, optionally compressed with gzip
+
+    Parameters
+    ----------
+    path : str
+        Path to the file
+    compress : bool, optional
+        If `True`, the file is compressed with gzip
+
+    Returns
+    -------
+    io.TextIOBase
+        The opened file
+    '''
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
 class CeMEEToWCON202007DataTranslator(CapableConfigurable, DataTranslator):
     '''
     Corrects the pseudo-WCON format into a form compliant with the 2020/07 version of the
@@ -124,6 +307,12 @@ class CeMEEToWCON202007DataTranslator(CapableConfigurable, DataTranslator):
     input_type = (CeMEEWCONDataSource,)
     output_type = WCONDataSource
 
+    compress_output = False
+    '''
+    If `True`, the corrected WCON is compressed with gzip. Overridden by the
+    configuration value for `COMPRESS_WCON_CONF_KEY` if there is one
+    '''
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if not hasattr(self, '_tempdir'):
@@ -143,62 +332,169 @@ class CeMEEToWCON202007DataTranslator(CapableConfigurable, DataTranslator):
 
         if self._tempdir is None:
             raise NoProviderGiven(TemporaryDirectoryCapability())
-        with source.wcon_contents() as wcon:
-            wcon_json = json.load(wcon)
-            # CeMEE wants to be special... fix up their data
-            try:
-                lab = wcon_json['metadata']['lab']
-                if isinstance(lab, str):
-                    wcon_json['metadata']['lab'] = {'name': lab}
-            except KeyError:
-                pass
+        _, sample_wcon_file_name = source._sample_file_names()
+        prepared = current_prepared_wcon()
+        if prepared is not None and prepared.wcon_file_path is not None:
+            # Already fixed-up, probably by a worker process in `translate_many`
+            source_file_path = prepared.wcon_file_path
+            if source_file_path.endswith('.gz'):
+                sample_wcon_file_name += '.gz'
+        else:
+            compress = compress_wcon(self.conf, self.compress_output)
+            if compress:
+                sample_wcon_file_name += '.gz'
+            source_file_path = p(self._tempdir, sample_wcon_file_name)
 
-            try:
-                software = wcon_json['units']['software']
-                del wcon_json['units']['software']
-                wcon_json.setdefault('metadata', {})['software'] = software
-            except KeyError:
-                pass
+            with source.wcon_contents() as wcon, \
+                    open_wcon_output(source_file_path, compress) as outfile:
+                for _ in fix_up_wcon_stream(wcon, outfile):
+                    pass
 
-            try:
-                food = wcon_json['units']['food']
-                del wcon_json['units']['food']
-                wcon_json.setdefault('metadata', {})['food'] = food
-            except KeyError:
-                pass
-            data = wcon_json['data']
-            if isinstance(data, dict) and 'x' not in data:
-                # 'x' is required in a data record, so this was *probably* supposed to
-                # be an array, so let's pretend it is one
-                new_data = []
-                for index, record in data.items():
-                    # CeMEE uses integers for the IDs, but we need strings
-                    record['id'] = str(record['id'])
-                    # Fix the dimensions of the data: each field is a singleton list, but
-                    # they should all be lists of numbers
-                    record['t'] = record['t'][0]
-                    record['x'] = record['x'][0]
-                    record['y'] = record['y'][0]
-                    for extra_field, extra_val in record['@MWT'].items():
-                        record['@MWT'][extra_field] = extra_val[0]
-                    new_data.append(record)
-                wcon_json['data'] = new_data
-            sample_wcon_file_name, _ = splitext(source.sample_zip_file_name.one())
-            source_file_path = p(self._tempdir, sample_wcon_file_name)
+        dest = self.make_new_output((source,),
+                file_name=sample_wcon_file_name)
+        dest.commit_op = CommitOp.RENAME
+        dest.source_file_path = source_file_path
 
-            with open(source_file_path, 'w') as outfile:
-                json.dump(wcon_json, outfile)
+        source_docs = source.attach_property(SourcedFrom).get()
+        dest.attach_property(SourcedFrom)
+        for source_doc in source_docs:
+            dest.sourced_from.set(source_doc)
+        return dest
 
-            dest = self.make_new_output((source,),
-                    file_name=sample_wcon_file_name)
-            dest.commit_op = CommitOp.RENAME
-            dest.source_file_path = source_file_path
 
-            source_docs = source.attach_property(SourcedFrom).get()
-            dest.attach_property(SourcedFrom)
-            for source_doc in source_docs:
-                dest.sourced_from.set(source_doc)
-            return dest
+def fix_up_wcon_stream(wcon, out):
+    '''
+    Correct the pseudo-WCON from the CeMEE MWT dataset in a single pass, writing the
+    corrected WCON to `out` as it goes
+
+    Data records are corrected and written one at a time as they're read, so only one
+    is held in memory. The other members of the top-level object are held until the
+    end since corrections to them depend on each other. Consequently, ``data`` comes
+    first in the output.
+
+    Parameters
+    ----------
+    wcon : file object
+        The CeMEE WCON
+    out : file object
+        Text file where the corrected WCON is written
+
+    Yields
+    ------
+    tuple
+        ``(key, value)`` pairs for the members of the corrected WCON, like those from
+        `~owmeta_movement.wcon_stream.wcon_items`. The value for ``data`` may be an
+        iterator of data records. Records are only written when they're consumed and
+        any which aren't are written when the next member is requested. The output is
+        complete once iteration finishes
+    '''
+    header = dict()
+    out.write('{')
+    first = True
+    for key, value in wcon_items(wcon, data_object_items=True):
+        if key != 'data':
+            header[key] = value
+            continue
+        first = False
+        out.write('"data": ')
+        if isinstance(value, ObjectItems):
+            value = _stream_data_object(value)
+        if isinstance(value, Iterator):
+            records = _write_records(value, out)
+            yield key, records
+            for _ in records:
+                pass
+        else:
+            json.dump(value, out)
+            yield key, value
+
+    _fix_up_header(header)
+    for key, value in header.items():
+        if not first:
+            out.write(', ')
+        first = False
+        out.write(json.dumps(key) + ': ')
+        json.dump(value, out)
+        yield key, value
+    out.write('}')
+
+
+def _stream_data_object(members):
+    # Without the whole object, we guess that it's records keyed by ID if the first
+    # value looks like a record. Otherwise, we read it all and decide with
+    # `_fix_up_data`
+    for first_key, first_value in members:
+        break
+    else: # no break
+        return _fix_up_data(dict())
+
+    if isinstance(first_value, dict) and 'x' in first_value:
+        return (_fix_up_record(record)
+                for record in _chain_values(first_value, members))
+    data = {first_key: first_value}
+    data.update(members)
+    return _fix_up_data(data)
+
+
+def _chain_values(first_value, members):
+    yield first_value
+    for _, value in members:
+        yield value
+
+
+def _write_records(records, out):
+    out.write('[')
+    for idx, record in enumerate(records):
+        if idx:
+            out.write(', ')
+        json.dump(record, out)
+        yield record
+    out.write(']')
+
+
+def _fix_up_header(wcon_json):
+    # CeMEE wants to be special... fix up their data
+    try:
+        lab = wcon_json['metadata']['lab']
+        if isinstance(lab, str):
+            wcon_json['metadata']['lab'] = {'name': lab}
+    except KeyError:
+        pass
+
+    try:
+        software = wcon_json['units']['software']
+        del wcon_json['units']['software']
+        wcon_json.setdefault('metadata', {})['software'] = software
+    except KeyError:
+        pass
+
+    try:
+        food = wcon_json['units']['food']
+        del wcon_json['units']['food']
+        wcon_json.setdefault('metadata', {})['food'] = food
+    except KeyError:
+        pass
+
+
+def _fix_up_data(data):
+    if isinstance(data, dict) and 'x' not in data:
+        # 'x' is required in a data record, so this was *probably* supposed to
+        # be an array, so let's pretend it is one
+        return [_fix_up_record(record) for record in data.values()]
+    return data
+
+
+def _fix_up_record(record):
+    # CeMEE uses integers for the IDs, but we need strings
+    record['id'] = str(record['id'])
+    # Fix the dimensions of the data: each field is a singleton list, but
+    # they should all be lists of numbers
+    record['t'] = record['t'][0]
+    record['x'] = record['x'][0]
+    record['y'] = record['y'][0]
+    for extra_field, extra_val in record['@MWT'].items():
+        record['@MWT'][extra_field] = extra_val[0]
+    return record
 
 
 class CeMEEDataTranslator(DataTranslator):
@@ -2,6 +2,18 @@ from owmeta_core.cli_common import METHOD_NAMED_ARG
 
 CLI_HINTS = {
     'owmeta_movement.command.MovementCommand': {
+        'translate_many': {
+            (METHOD_NAMED_ARG, 'data_sources'): {
+                'names': ['data_sources'],
+                'nargs': '*',
+            },
+        },
+        'render': {
+            (METHOD_NAMED_ARG, 'tracks'): {
+                'names': ['tracks'],
+                'nargs': '*',
+            },
+        },
         'plot': {
             (METHOD_NAMED_ARG, 'tracks'): {
                 'names': ['tracks'],
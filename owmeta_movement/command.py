@@ -1,12 +1,39 @@
+from collections import namedtuple
+from importlib.util import find_spec
+from itertools import islice
+from os import makedirs
+from os.path import isfile, join as p
+import tempfile
+
 import transaction
 from owmeta.document import SourcedFrom
 from owmeta_core.collections import Seq
 from owmeta_core.command_util import SubCommand, GenericUserError, GeneratorWithData
+from owmeta_core.datasource import DataSource
 from owmeta_core.utils import retrieve_provider
+from rdflib.namespace import RDF
+from rdflib.term import URIRef
 
-from . import WormTracks, DataRecord
+from .batch import TranslateManyError, translate_many
+from .metadata_index import MetadataIndex, metadata_index_path, tracks_metadata
 from .zenodo import list_record_files, ZenodoRecord
-from .cemee import ZenodoCeMEEWCONDataSource, CeMEEDataTranslator
+from .zenodo_catalog import (ZenodoCatalog, CATALOG_FILE_NAME, DEFAULT_COMMUNITY,
+                             sync_catalog)
+from .cemee import (ZenodoCeMEEWCONDataSource, CeMEEDataTranslator,
+                    CeMEEWCONDataSource)
+from .wcon_ds import WCONDataSource
+
+
+_SUMMARY_METADATA = ('lab', 'strain', 'timestamp', 'food')
+'''
+Metadata properties listed for each `~owmeta_movement.WormTracks` by
+`MovementCommand.list_tracks`
+'''
+
+_SOURCE_TYPES = {
+    'wcon': WCONDataSource,
+    'cemee': CeMEEWCONDataSource,
+}
 
 
 class CeMEECommand:
@@ -88,48 +115,200 @@ class MovementCommand:
         self._parent = parent
         self._owm = parent
 
-    def list_tracks(self):
+    def list_tracks(self, limit=None, offset=None, strain=None, lab=None, food=None,
+            since=None, before=None):
         '''
         List `~owmeta_movement.WormTracks`
+
+        The tracks are listed in order of identifier, and their metadata are looked up
+        as each one is listed. If any of the metadata filters are given, tracks are
+        looked up in the metadata index (see `index_tracks`) rather than the store.
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of tracks to list. optional
+        offset : int
+            Number of tracks to skip before listing. optional
+        strain : str
+            Only list tracks of this strain. optional
+        lab : str
+            Only list tracks from the lab with this name, location, or identifier.
+            optional
+        food : str
+            Only list tracks recorded on this food. optional
+        since : str
+            Only list tracks recorded at or after this time, in ISO 8601 format (e.g.,
+            "2019-01-01"). optional
+        before : str
+            Only list tracks recorded before this time, in ISO 8601 format. optional
+        '''
+        for name, value in (('limit', limit), ('offset', offset)):
+            if value is not None and (not isinstance(value, int) or value < 0):
+                raise GenericUserError(f'{name} must be a non-negative integer')
+
+        filters = dict(strain=strain, lab=lab, food=food, since=since, before=before)
+        if any(v is not None for v in filters.values()):
+            gen = self._indexed_tracks(filters, limit, offset)
+        else:
+            gen = self._stored_tracks(limit, offset)
+
+        return GeneratorWithData(gen,
+                                 text_format=lambda r: r.identifier,
+                                 default_columns=('ID',),
+                                 columns=(lambda r: r.identifier,
+                                          lambda r: r.lab,
+                                          lambda r: r.strain,
+                                          lambda r: r.timestamp,
+                                          lambda r: r.food),
+                                 header=('ID', 'Lab', 'Strain', 'Timestamp', 'Food'))
+
+    def _stored_tracks(self, limit, offset):
+        with self._owm.connect():
+            graph = self._owm.default_context.stored.rdf_graph()
+            yield from _tracks_summaries(graph, limit, offset)
+
+    def _indexed_tracks(self, filters, limit, offset):
+        with self._owm.connect():
+            index_path = metadata_index_path(self._owm.default_context.conf)
+        if index_path is None or not isfile(index_path):
+            raise GenericUserError('There is no metadata index for this project. You can'
+                    ' make one with `owm movement index-tracks`')
+        with MetadataIndex(index_path) as index:
+            try:
+                matches = index.query(limit=limit, offset=offset, **filters)
+            except ValueError as e:
+                raise GenericUserError(str(e)) from e
+            yield from matches
+
+    def index_tracks(self):
         '''
+        Rebuild the metadata index from all of the `~owmeta_movement.WormTracks` in the
+        project
+
+        Tracks are added to the index as they're translated, so this is only needed for
+        tracks translated before the index was introduced or if the index is lost.
+        '''
+        from . import WormTracks
+
         def gen():
             with self._owm.connect():
-                ctx = self._owm.default_context.stored
-                tracks_q = ctx(WormTracks)()
+                index_path = metadata_index_path(self._owm.default_context.conf)
+                if index_path is None:
+                    raise GenericUserError('Cannot determine where to put the metadata'
+                            ' index')
+                with MetadataIndex(index_path) as index:
+                    index.clear()
+                    graph = self._owm.default_context.stored.rdf_graph()
+                    for tracks in graph.subjects(RDF.type, WormTracks.rdf_type):
+                        index.add_tracks(tracks, **tracks_metadata(tracks, graph))
+                        yield tracks
+
+        return gen()
+
+    def translate_many(self, data_sources=None, source_type=None, jobs=None):
+        '''
+        Translate many WCON or CeMEE data sources into `~owmeta_movement.WormTracks`
 
-                for e in tracks_q.load():
-                    yield e
+        Parsing and conversion of the sources is done in parallel. Outputs are saved one
+        at a time, each in its own transaction.
 
-        def format_id(r):
-            return r.identifier
+        Parameters
+        ----------
+        data_sources : list of str
+            Identifiers of the data sources to translate. optional
+        source_type : str
+            Also translate all data sources of this type in the default context. One of
+            "wcon" or "cemee". optional
+        jobs : int
+            Number of worker processes. optional: defaults to the number of CPUs
+        '''
+        if jobs is not None and jobs < 1:
+            raise GenericUserError('The number of jobs must be at least 1')
+        if source_type is not None and source_type not in _SOURCE_TYPES:
+            raise GenericUserError(f'Unknown source type {source_type!r}. Must be one of:'
+                    f' {", ".join(_SOURCE_TYPES)}')
+        if not data_sources and source_type is None:
+            raise GenericUserError('Either data sources or a source type must be given')
 
-        def format_lab(r):
-            md = r.metadata()
-            return md.lab()
+        def gen():
+            with self._owm.connect():
+                ctx = self._owm.default_context
+                srcctx = ctx.stored
+                sources = []
+                for ds in data_sources or ():
+                    src = next(srcctx(DataSource)(ident=ds).load(), None)
+                    if src is None:
+                        raise GenericUserError(f'No source for "{ds}"')
+                    if not isinstance(src, tuple(_SOURCE_TYPES.values())):
+                        raise GenericUserError(f'Cannot translate "{ds}": it is not a'
+                                ' WCON or CeMEE data source')
+                    sources.append(src)
+                if source_type is not None:
+                    seen = set(sources)
+                    for src in srcctx(_SOURCE_TYPES[source_type])().load():
+                        if src not in seen:
+                            seen.add(src)
+                            sources.append(src)
+
+                if not sources:
+                    return
+
+                makedirs(self._owm.temporary_directory, exist_ok=True)
+                with tempfile.TemporaryDirectory(
+                        dir=self._owm.temporary_directory) as work_dir:
+                    try:
+                        yield from translate_many(ctx, sources, jobs=jobs,
+                                transaction_manager=self._owm.transaction_manager,
+                                work_dir=work_dir)
+                    except TranslateManyError as e:
+                        raise GenericUserError(str(e)) from e
+
+        def format_source(r):
+            return r[0].identifier
+
+        def format_output(r):
+            return r[1].identifier
 
         return GeneratorWithData(gen(),
-                                 text_format=format_id,
-                                 default_columns=('ID',),
-                                 columns=(format_id,
-                                          format_lab),
-                                 header=('ID', 'Lab'))
-
-    def plot(self, tracks, record_index=None):
+                                 text_format=format_output,
+                                 default_columns=('Output',),
+                                 columns=(format_source,
+                                          format_output),
+                                 header=('Source', 'Output'))
+
+    def plot(self, tracks, record_index=None, max_points=None, full_resolution=False,
+            frame_stride=1):
         '''
         Do a plot of the given `~owmeta_movement.WormTracks`
 
+        Records are drawn as they're loaded. Each is downsampled to about as many points
+        as the plot is wide in pixels unless `max_points` or `full_resolution` is given.
+
         Parameters
         ----------
         tracks : str
             ID of a WormTracks
         record_index : int
             Index of the record to plot. optional
+        max_points : int
+            Maximum total number of points to draw, divided evenly among the records.
+            optional
+        full_resolution : bool
+            If given, draw every point in each record. optional
+        frame_stride : int
+            Draw skeletons and contours for only every `frame_stride`-th frame. optional
         '''
+        for name, value in (('max_points', max_points), ('frame_stride', frame_stride)):
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise GenericUserError(f'{name} must be a positive integer')
         try:
             import matplotlib.pyplot as plt
         except ImportError:
             raise GenericUserError('Cannot plot. To install necessary dependencies, you can run:\n'
                     '    pip install owmeta_movement[plot]')
+        from . import WormTracks, DataRecord
+        from .plotting import RecordPlotter
 
         with self._owm.connect():
             ctx = self._owm.default_context.stored
@@ -141,31 +320,139 @@ class MovementCommand:
             if isinstance(data_record, Seq):
                 stored_data_record = ctx.stored(data_record)
                 if record_index is None:
-                    members = stored_data_record.rdfs_member()
-
-                    for record in members:
-                        plot_record(record, plt)
+                    # Only the record identifiers are loaded here. The coordinates, which
+                    # are the bulk of the data, are loaded as each record is drawn
+                    records = list(stored_data_record.rdfs_member())
                 else:
                     record = stored_data_record[record_index]
                     if record is None:
                         raise GenericUserError(f'No record at index {record_index}')
-                    plot_record(record, plt)
+                    records = [record]
             elif isinstance(data_record, DataRecord):
-                plot_record(record, plt)
+                records = [data_record]
             else:
                 raise GenericUserError(f'Cannot plot record {data_record}')
 
+            plotter = RecordPlotter(plt.gca(),
+                                    max_points=max_points,
+                                    record_count=len(records),
+                                    downsample=not full_resolution,
+                                    frame_stride=frame_stride)
+            plt.show(block=False)
+            for record in records:
+                plotter.plot(record)
+                plotter.refresh()
+            self._owm.message(f'Drew {plotter.points_drawn} points')
+
         plt.show()
 
+    def render(self, tracks=None, output_dir='.', format='png', width=640, height=480,
+            max_points=None, frame_stride=1, strain=None, lab=None, food=None, since=None,
+            before=None, jobs=None, force=False):
+        '''
+        Render plots of many `~owmeta_movement.WormTracks` to image files
 
-def plot_record(record, plt):
-    x = record.x()
-    y = record.y()
-    if len(x) > 0 and isinstance(x[0], (int, float)):
-        plt.plot(x, y)
-    elif len(x) > 0 and isinstance(x[0], list):
-        for ske_x, ske_y in zip(x, y):
-            plt.plot(ske_x, ske_y)
+        Images are drawn without a display in worker processes. An image that's already
+        up to date with its tracks and the rendering options is not drawn again.
+
+        If no tracks are given, the tracks matching the metadata filters are rendered or,
+        if there are no filters either, all of the tracks in the project.
+
+        Parameters
+        ----------
+        tracks : list of str
+            IDs of the WormTracks to render. optional
+        output_dir : str
+            Directory for the images. optional: defaults to the current directory
+        format : str
+            Image format. One of "png" or "svg". optional
+        width : int
+            Width of each image in pixels. optional
+        height : int
+            Height of each image in pixels. optional
+        max_points : int
+            Maximum number of points to draw for each tracks. optional
+        frame_stride : int
+            Draw skeletons and contours for only every `frame_stride`-th frame. optional
+        strain : str
+            Render tracks of this strain. optional
+        lab : str
+            Render tracks from the lab with this name, location, or identifier. optional
+        food : str
+            Render tracks recorded on this food. optional
+        since : str
+            Render tracks recorded at or after this time, in ISO 8601 format. optional
+        before : str
+            Render tracks recorded before this time, in ISO 8601 format. optional
+        jobs : int
+            Number of worker processes. optional: defaults to the number of CPUs
+        force : bool
+            If given, render images even if they're up to date. optional
+        '''
+        from .render import render_many, RenderOptions
+
+        if jobs is not None and jobs < 1:
+            raise GenericUserError('The number of jobs must be at least 1')
+        try:
+            options = RenderOptions(format=format, width=width, height=height,
+                    max_points=max_points, frame_stride=frame_stride)
+        except ValueError as e:
+            raise GenericUserError(str(e)) from e
+        if find_spec('matplotlib') is None:
+            raise GenericUserError('Cannot render. To install necessary dependencies, you'
+                    ' can run:\n    pip install owmeta_movement[plot]')
+
+        filters = dict(strain=strain, lab=lab, food=food, since=since, before=before)
+        if tracks and any(v is not None for v in filters.values()):
+            raise GenericUserError('Either tracks or metadata filters may be given, but not'
+                    ' both')
+
+        def gen():
+            if tracks:
+                idents = [URIRef(t) for t in tracks]
+            elif any(v is not None for v in filters.values()):
+                idents = [r.identifier for r in self._indexed_tracks(filters, None, None)]
+            else:
+                idents = [r.identifier for r in self._stored_tracks(None, None)]
+            with self._owm.connect():
+                yield from render_many(self._owm.default_context.stored, idents,
+                        output_dir, options=options, jobs=jobs, force=force)
+
+        return GeneratorWithData(gen(),
+                                 text_format=lambda r: r.output_path,
+                                 default_columns=('Output',),
+                                 columns=(lambda r: r.tracks,
+                                          lambda r: r.output_path,
+                                          lambda r: 'rendered' if r.rendered else
+                                                    'up to date'),
+                                 header=('Tracks', 'Output', 'Status'))
+
+
+class _TracksSummary(namedtuple('_TracksSummary', ('identifier',) + _SUMMARY_METADATA)):
+    __slots__ = ()
+
+
+def _tracks_summaries(graph, limit=None, offset=None):
+    '''
+    Summarize each `~owmeta_movement.WormTracks` in `graph`, in order of identifier, with
+    one value, if there are any, for each of the metadata properties in
+    `_SUMMARY_METADATA`
+
+    Only the identifiers of the tracks are gathered up-front; metadata are looked up for
+    each track as it's yielded
+    '''
+    from . import WormTracks, WormTracksMetadata
+
+    links = [getattr(WormTracksMetadata, name).link for name in _SUMMARY_METADATA]
+    idents = sorted(set(graph.subjects(RDF.type, WormTracks.rdf_type)))
+    stop = None if limit is None else (offset or 0) + limit
+    for ident in islice(idents, offset, stop):
+        md = graph.value(ident, WormTracks.metadata.link)
+        values = [None if md is None else graph.value(md, link) for link in links]
+        yield _TracksSummary(ident, *(None if v is None else
+                                      v if isinstance(v, URIRef) else
+                                      v.toPython()
+                                      for v in values))
 
 
 class ZenodoCommand:
@@ -176,6 +463,9 @@ class ZenodoCommand:
         '''
         List files in a Zenodo record
 
+        If the record is in the project's Zenodo catalog (see `sync_catalog`), the files
+        are listed from there without contacting Zenodo
+
         Parameters
         ----------
         zenodo_id : int
@@ -188,9 +478,51 @@ class ZenodoCommand:
             points: ``path.to.module:path.to.provider.callable``.  Notably, there's no
             name and "extras" are not supported. optional.
         '''
+        catalog_path = self._catalog_path()
+        if isfile(catalog_path):
+            with ZenodoCatalog(catalog_path) as catalog:
+                record_files = catalog.record_files(zenodo_id, zenodo_base_url)
+            if record_files is not None:
+                return [f.name for f in record_files]
+
         if session_provider is not None:
             session = retrieve_provider(session_provider)()
         else:
             session = None
         return list_record_files(zenodo_id, zenodo_base_url=zenodo_base_url,
                 session=session)
+
+    def sync_catalog(self, community=DEFAULT_COMMUNITY, zenodo_base_url=None, jobs=8):
+        '''
+        Save the records in a Zenodo community, and the files in them, to the project's
+        Zenodo catalog
+
+        Once a record is in the catalog, listing its files, or loading all of them for a
+        data source, doesn't need to ask Zenodo for the list. Records already in the
+        catalog are updated.
+
+        Parameters
+        ----------
+        community : str
+            The Zenodo community ID. optional: defaults to the OpenWorm movement database
+        zenodo_base_url : str
+            The base URL for zenodo. optional: Uses the well-known Zenodo URL if not provided
+        jobs : int
+            Maximum number of requests to Zenodo to make at once. optional
+        '''
+        makedirs(self._parent.owmdir, exist_ok=True)
+        with ZenodoCatalog(self._catalog_path()) as catalog:
+            records = sync_catalog(catalog, community=community,
+                    zenodo_base_url=zenodo_base_url, concurrency=jobs)
+
+        return GeneratorWithData(iter(sorted(records)),
+                                 text_format=lambda r: r.record_id,
+                                 default_columns=('ID', 'Title'),
+                                 columns=(lambda r: r.record_id,
+                                          lambda r: r.title,
+                                          lambda r: r.version,
+                                          lambda r: len(r.files)),
+                                 header=('ID', 'Title', 'Version', 'Files'))
+
+    def _catalog_path(self):
+        return p(self._parent.owmdir, CATALOG_FILE_NAME)
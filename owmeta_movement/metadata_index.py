@@ -0,0 +1,425 @@
+'''
+An index of `~owmeta_movement.WormTracks` by their metadata.
+
+Finding tracks by strain, lab, recording time, or food in the store means loading every
+`~owmeta_movement.WormTracks` and its metadata. Instead, the WCON translators record those
+metadata in a SQLite index in the owmeta project directory as they make each
+`~owmeta_movement.WormTracks`, once the transaction it's saved in commits, and
+`MetadataIndex.query` looks tracks up there.
+'''
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+import logging
+from os.path import join as p
+import re
+import sqlite3
+
+from rdflib.graph import Graph
+from rdflib.term import URIRef
+
+
+L = logging.getLogger(__name__)
+
+
+INDEX_FILE_NAME = 'movement_metadata_index.sqlite'
+'''
+Name of the index file in the owmeta project directory
+'''
+
+INDEX_CONF_KEY = 'owmeta_movement.metadata_index'
+'''
+Configuration key for the path to the index. Defaults to `INDEX_FILE_NAME` in the owmeta
+project directory
+'''
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tracks (
+    identifier TEXT PRIMARY KEY,
+    lab TEXT,
+    lab_name TEXT,
+    lab_location TEXT,
+    strain TEXT,
+    timestamp TEXT,
+    timestamp_key TEXT,
+    food TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_strain ON tracks (strain);
+CREATE INDEX IF NOT EXISTS tracks_lab_name ON tracks (lab_name);
+CREATE INDEX IF NOT EXISTS tracks_lab_location ON tracks (lab_location);
+CREATE INDEX IF NOT EXISTS tracks_timestamp ON tracks (timestamp_key);
+CREATE INDEX IF NOT EXISTS tracks_food ON tracks (food);
+'''
+
+
+class IndexedTracks(namedtuple('IndexedTracks', ('identifier', 'lab', 'strain',
+        'timestamp', 'food'))):
+    '''
+    A `~owmeta_movement.WormTracks` in the index
+
+    Attributes
+    ----------
+    identifier : rdflib.term.URIRef
+        Identifier of the tracks
+    lab : rdflib.term.URIRef or None
+        Identifier of the lab from the tracks' metadata
+    strain : str or None
+        Strain from the tracks' metadata
+    timestamp : str or None
+        Timestamp from the tracks' metadata, as given in the WCON
+    food : str or None
+        Food from the tracks' metadata
+    '''
+    __slots__ = ()
+
+
+class MetadataIndex:
+    '''
+    A SQLite index of `~owmeta_movement.WormTracks` by strain, lab, timestamp, and food
+
+    Can be used as a context manager, closing the database connection on exit.
+    '''
+
+    def __init__(self, path):
+        '''
+        Parameters
+        ----------
+        path : str
+            Path to the SQLite database. Created if it doesn't exist
+        '''
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def add_tracks(self, tracks, lab=None, lab_name=None, lab_location=None, strain=None,
+            timestamp=None, food=None):
+        '''
+        Add a `~owmeta_movement.WormTracks` to the index, replacing any entry for it
+
+        The metadata are typically those returned by `tracks_metadata`
+
+        Parameters
+        ----------
+        tracks : rdflib.term.URIRef
+            Identifier of the tracks
+        lab : str, optional
+            Identifier of the lab
+        lab_name : str, optional
+            Name of the lab
+        lab_location : str, optional
+            Location of the lab
+        strain : str, optional
+            Strain of the worms
+        timestamp : str, optional
+            Time of the recording in ISO 8601 format
+        food : str, optional
+            Food on the plate
+        '''
+        timestamp_key = _timestamp_key(timestamp)
+        if timestamp is not None and timestamp_key is None:
+            L.warning('Unable to parse the timestamp %r of %s. The tracks will not be'
+                    ' found by time', timestamp, tracks)
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (str(tracks), lab, lab_name, lab_location, strain, timestamp,
+                     timestamp_key, food))
+
+    def remove_tracks(self, tracks):
+        '''
+        Remove a `~owmeta_movement.WormTracks` from the index
+
+        Parameters
+        ----------
+        tracks : rdflib.term.URIRef
+            Identifier of the tracks
+        '''
+        with self._conn:
+            self._conn.execute('DELETE FROM tracks WHERE identifier = ?', (str(tracks),))
+
+    def clear(self):
+        '''
+        Remove all tracks from the index
+        '''
+        with self._conn:
+            self._conn.execute('DELETE FROM tracks')
+
+    def query(self, strain=None, lab=None, food=None, since=None, before=None,
+            limit=None, offset=None):
+        '''
+        Find tracks matching all of the given metadata
+
+        Parameters
+        ----------
+        strain : str, optional
+            Strain of the worms
+        lab : str, optional
+            Name, location, or identifier of the lab
+        food : str, optional
+            Food on the plate
+        since : str or datetime.datetime, optional
+            Earliest recording time, inclusive. Strings are in ISO 8601 format, like
+            ``2019-07-05`` or ``2019-07-05T10:54:44``
+        before : str or datetime.datetime, optional
+            Latest recording time, exclusive. Strings are in the same format as for
+            `since`
+        limit : int, optional
+            Maximum number of tracks to return
+        offset : int, optional
+            Number of matching tracks to skip
+
+        Returns
+        -------
+        iterator of IndexedTracks
+            The matching tracks, ordered by identifier
+
+        Raises
+        ------
+        ValueError
+            Raised if `since` or `before` is not a valid timestamp
+        '''
+        conditions = []
+        params = []
+        for column, value in (('strain', strain), ('food', food)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if lab is not None:
+            conditions.append('(lab_name = ? OR lab_location = ? OR lab = ?)')
+            params += [lab] * 3
+        for op, value in (('>=', since), ('<', before)):
+            if value is not None:
+                key = _timestamp_key(value)
+                if key is None:
+                    raise ValueError(f'Invalid timestamp: {value!r}')
+                conditions.append(f'timestamp_key {op} ?')
+                params.append(key)
+
+        query = 'SELECT identifier, lab, strain, timestamp, food FROM tracks'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY identifier'
+        if limit is not None or offset is not None:
+            query += ' LIMIT ? OFFSET ?'
+            params += [-1 if limit is None else limit, offset or 0]
+
+        return (IndexedTracks(URIRef(identifier),
+                              None if lab_id is None else URIRef(lab_id),
+                              *rest)
+                for identifier, lab_id, *rest in self._conn.execute(query, params))
+
+
+def metadata_index_path(conf):
+    '''
+    The path of the metadata index according to the given configuration
+
+    Parameters
+    ----------
+    conf : owmeta_core.configure.Configuration or dict
+        The configuration
+
+    Returns
+    -------
+    str or None
+        Path to the index, or `None` if there's no index configured and no owmeta
+        project directory
+    '''
+    path = conf.get(INDEX_CONF_KEY, None)
+    if isinstance(path, str):
+        return path
+    owm_directory = conf.get('owm.directory', None)
+    if not isinstance(owm_directory, str):
+        return None
+    return p(owm_directory, INDEX_FILE_NAME)
+
+
+def tracks_metadata(tracks, graph):
+    '''
+    Get the metadata of a `~owmeta_movement.WormTracks` that are recorded in the index
+
+    Parameters
+    ----------
+    tracks : rdflib.term.URIRef
+        Identifier of the tracks
+    graph : rdflib.graph.Graph
+        Graph with the statements about the tracks and their metadata. Only those
+        selected by `metadata_triples` are needed
+
+    Returns
+    -------
+    dict
+        Keyword arguments for `MetadataIndex.add_tracks`
+    '''
+    from . import WormTracks, WormTracksMetadata, WormTracksMetadataLab
+
+    metadata = graph.value(tracks, WormTracks.metadata.link)
+    values = dict()
+    if metadata is not None:
+        for name in ('lab', 'strain', 'timestamp', 'food'):
+            values[name] = graph.value(metadata, getattr(WormTracksMetadata, name).link)
+    lab = values.get('lab')
+    if lab is not None:
+        lab_ns = WormTracksMetadataLab.schema_namespace
+        values['lab_name'] = graph.value(lab, lab_ns['name'])
+        values['lab_location'] = graph.value(lab, lab_ns['location'])
+    return {k: str(v) for k, v in values.items() if v is not None}
+
+
+def metadata_triples(triples):
+    '''
+    Select the triples that `tracks_metadata` looks at
+
+    Useful for getting the metadata of tracks from all of the triples made for them
+    without putting all of those triples in a graph
+
+    Parameters
+    ----------
+    triples : iterable of tuple
+        Triples about some tracks, their metadata, and anything else
+
+    Yields
+    ------
+    tuple
+        The triples about tracks' metadata
+    '''
+    from . import WormTracks, WormTracksMetadata, WormTracksMetadataLab
+
+    lab_ns = WormTracksMetadataLab.schema_namespace
+    predicates = {WormTracks.metadata.link, lab_ns['name'], lab_ns['location']}
+    predicates.update(getattr(WormTracksMetadata, name).link
+                      for name in ('lab', 'strain', 'timestamp', 'food'))
+    return (triple for triple in triples if triple[1] in predicates)
+
+
+def metadata_graph(triples):
+    '''
+    Make a graph for `tracks_metadata` from triples about tracks
+
+    Parameters
+    ----------
+    triples : iterable of tuple
+        Triples about some tracks, their metadata, and anything else. Only those selected
+        by `metadata_triples` are added to the graph
+
+    Returns
+    -------
+    rdflib.graph.Graph
+    '''
+    graph = Graph()
+    for triple in metadata_triples(triples):
+        graph.add(triple)
+    return graph
+
+
+_DATE_FORMATS = (
+    # Calendar dates, possibly with reduced precision
+    re.compile(r'(?P<year>\d{4})(?:-(?P<month>\d{2})(?:-(?P<day>\d{2}))?)?'),
+    re.compile(r'(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})'),
+    # Week dates
+    re.compile(r'(?P<year>\d{4})-?W(?P<week>\d{2})(?:-?(?P<weekday>[1-7]))?'),
+    # Ordinal dates
+    re.compile(r'(?P<year>\d{4})-?(?P<yearday>\d{3})'),
+)
+
+_TIME_FORMAT = re.compile(
+    r'(?P<hour>\d{2})(?::?(?P<minute>\d{2})(?::?(?P<second>\d{2}))?)?'
+    r'(?:[.,](?P<fraction>\d+))?'
+    r'(?P<tz>Z|[+-]\d{2}(?::?\d{2})?)?')
+
+
+def _parse_timestamp(value):
+    '''
+    Parse an ISO 8601 date or date and time
+
+    More lenient than `datetime.fromisoformat` before Python 3.11: also accepts the basic
+    format, week and ordinal dates, a "Z" suffix, any number of digits in the fraction
+    of a second, and "," as the decimal sign. Returns `None` if `value` can't be parsed
+    '''
+    date_part, sep, time_part = value.replace(' ', 'T', 1).partition('T')
+    for date_format in _DATE_FORMATS:
+        md = date_format.fullmatch(date_part)
+        if md is not None:
+            break
+    else: # no break
+        return None
+
+    try:
+        year = int(md['year'])
+        if 'week' in md.re.groupindex:
+            jan4 = date(year, 1, 4)
+            day = (jan4 - timedelta(days=jan4.isoweekday() - 1) +
+                   timedelta(weeks=int(md['week']) - 1, days=int(md['weekday'] or 1) - 1))
+            if day.isocalendar()[0] != year:
+                return None
+        elif 'yearday' in md.re.groupindex:
+            day = date(year, 1, 1) + timedelta(days=int(md['yearday']) - 1)
+            if day.year != year:
+                return None
+        else:
+            day = date(year, int(md['month'] or 1), int(md['day'] or 1))
+    except ValueError:
+        return None
+
+    res = datetime(day.year, day.month, day.day)
+    if not sep:
+        return res
+
+    mt = _TIME_FORMAT.fullmatch(time_part)
+    if mt is None:
+        return None
+    units = [(name, int(mt[name])) for name in ('hour', 'minute', 'second')
+             if mt[name] is not None]
+    if any(v >= limit for (_, v), limit in zip(units, (25, 60, 61))):
+        return None
+    if units[0][1] == 24 and (any(v for _, v in units[1:]) or
+                              mt['fraction'] and int(mt['fraction'])):
+        return None
+    # Leap seconds are folded into the following second
+    res += timedelta(**{name + 's': v for name, v in units})
+    fraction = mt['fraction']
+    if fraction is not None:
+        name, _ = units[-1]
+        if name == 'second':
+            # Truncated to microseconds, as by `datetime.fromisoformat`
+            res += timedelta(microseconds=int(fraction[:6].ljust(6, '0')))
+        else:
+            res += timedelta(**{name + 's': int(fraction) / 10 ** len(fraction)})
+
+    tz = mt['tz']
+    if tz is not None:
+        if tz == 'Z':
+            offset = timedelta()
+        else:
+            digits = tz[1:].replace(':', '')
+            offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:] or 0))
+            if tz[0] == '-':
+                offset = -offset
+        try:
+            res = res.replace(tzinfo=timezone(offset))
+        except ValueError:
+            return None
+    return res
+
+
+def _timestamp_key(value):
+    '''
+    Returns a key for the timestamp that sorts in time order, or `None` if `value` isn't
+    a valid timestamp. Timestamps with a time zone are converted to UTC. Those without
+    one are taken as being in UTC
+    '''
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = _parse_timestamp(value.strip())
+        if value is None:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
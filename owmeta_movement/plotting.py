@@ -0,0 +1,252 @@
+'''
+Plotting of `~owmeta_movement.DataRecord` tracks with matplotlib.
+
+A full-plate sample can have millions of points, far more than there are pixels to draw
+them on. `RecordPlotter` downsamples each track before drawing it: centroid paths with
+the largest-triangle-three-buckets algorithm (`lttb`), which keeps the visually
+significant points, and skeletons and contours by drawing evenly spaced frames. By
+default, each record gets about as many points as the axes are wide in pixels.
+'''
+from itertools import cycle
+from numbers import Real
+
+import numpy as np
+
+
+PIXEL_OVERSAMPLING = 2
+'''
+Number of points drawn per horizontal pixel of the axes for each record when no point
+budget is given
+'''
+
+
+def lttb(x, y, n_out):
+    '''
+    Downsample a line with the largest-triangle-three-buckets algorithm
+
+    The first and last points are kept. The other points are split into ``n_out - 2``
+    buckets, and from each bucket, the point forming the largest triangle with the point
+    chosen from the previous bucket and the average of the next bucket is kept.
+
+    Non-finite points (e.g., NaN for frames where the worm wasn't found) are dropped.
+
+    Parameters
+    ----------
+    x : array_like
+        X coordinates
+    y : array_like
+        Y coordinates
+    n_out : int
+        Maximum number of points to return. Must be at least 3
+
+    Returns
+    -------
+    numpy.ndarray
+        Downsampled x coordinates
+    numpy.ndarray
+        Downsampled y coordinates
+    '''
+    if n_out < 3:
+        raise ValueError(f'n_out must be at least 3, not {n_out}')
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.all():
+        x = x[finite]
+        y = y[finite]
+    n = len(x)
+    if n <= n_out:
+        return x, y
+
+    # Bucket boundaries for the points between the first and last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=np.intp)
+    keep[0] = 0
+    keep[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < n_out - 1:
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Twice the triangle areas. The factor doesn't matter for picking the largest
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) -
+                       (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(areas.argmax())
+        keep[i + 1] = prev
+    return x[keep], y[keep]
+
+
+class RecordPlotter:
+    '''
+    Draws records on a set of axes, downsampling each to fit a point budget
+
+    Centroid paths are drawn as one line per record. Skeletons (``x`` and ``y`` with a
+    list of points for each frame) and contours (``px`` and ``py``) are each drawn as one
+    `~matplotlib.collections.LineCollection` per record rather than as a line per frame,
+    which would make tens of thousands of artists for a single track.
+
+    Attributes
+    ----------
+    points_drawn : int
+        Total number of points drawn so far
+    '''
+
+    def __init__(self, axes, max_points=None, record_count=1, downsample=True,
+            frame_stride=1):
+        '''
+        Parameters
+        ----------
+        axes : matplotlib.axes.Axes
+            The axes to draw on
+        max_points : int, optional
+            Maximum total number of points to draw for all records. By default, there's
+            no total limit, but each record is limited based on the width of the axes
+        record_count : int, optional
+            Number of records that will be drawn. The point budget is divided among them
+        downsample : bool, optional
+            If `False`, records are drawn in full. `max_points` is ignored
+        frame_stride : int, optional
+            Draw skeletons and contours for only every `frame_stride`-th frame. Applies
+            whether or not records are downsampled
+        '''
+        if max_points is not None and max_points < 1:
+            raise ValueError(f'max_points must be positive, not {max_points}')
+        if frame_stride < 1:
+            raise ValueError(f'frame_stride must be positive, not {frame_stride}')
+        self.axes = axes
+        self.downsample = downsample
+        self.frame_stride = frame_stride
+        self.points_drawn = 0
+        if max_points is not None:
+            self._points_per_record = max(max_points // max(record_count, 1), 3)
+        else:
+            width = axes.get_window_extent().width
+            self._points_per_record = max(int(width * PIXEL_OVERSAMPLING), 3)
+        self._colors = None
+
+    def plot(self, record):
+        '''
+        Draw a record
+
+        Parameters
+        ----------
+        record : owmeta_movement.DataRecord
+            The record to draw
+
+        Returns
+        -------
+        int
+            Number of points drawn
+        '''
+        return self.plot_values(record.x(), record.y(), record.px(), record.py())
+
+    def plot_values(self, x, y, px=None, py=None):
+        '''
+        Draw a record given the values of its fields
+
+        Parameters
+        ----------
+        x : list or numpy.ndarray
+            Values of the record's ``x``: either one per frame or a list for each frame.
+            NumPy arrays come from fields stored as `~owmeta_movement.ArrayLiteral`
+        y : list or numpy.ndarray
+            Values of the record's ``y``, shaped like `x`
+        px : list or numpy.ndarray, optional
+            Values of the record's ``px``: a list for each frame
+        py : list or numpy.ndarray, optional
+            Values of the record's ``py``, shaped like `px`
+
+        Returns
+        -------
+        int
+            Number of points drawn
+        '''
+        has_path = x is not None and y is not None and len(x) > 0
+        has_contours = px is not None and py is not None and len(px) > 0
+        if not (has_path or has_contours):
+            return 0
+
+        budget = self._points_per_record // (int(has_path) + int(has_contours))
+        color = self._next_color()
+        n = 0
+        if has_path:
+            if isinstance(x[0], Real):
+                n += self._plot_path(x, y, budget, color)
+            else:
+                n += self._plot_frames(x, y, budget, color, closed=False)
+        if has_contours:
+            n += self._plot_frames(px, py, budget, color, closed=True)
+        self.points_drawn += n
+        return n
+
+    def _next_color(self):
+        if self._colors is None:
+            from matplotlib import rcParams
+            self._colors = cycle(rcParams['axes.prop_cycle'].by_key()['color'])
+        return next(self._colors)
+
+    def _plot_path(self, x, y, budget, color):
+        if self.downsample:
+            x, y = lttb(x, y, max(budget, 3))
+        self.axes.plot(x, y, color=color)
+        return len(x)
+
+    def _plot_frames(self, xs, ys, budget, color, closed):
+        from matplotlib.collections import LineCollection
+
+        frames = np.arange(0, len(xs), self.frame_stride)
+        if self.downsample:
+            frame_size = max(len(np.atleast_1d(xs[0])), 1)
+            max_frames = max(budget // frame_size, 1)
+            if len(frames) > max_frames:
+                frames = frames[np.linspace(0, len(frames) - 1, max_frames).astype(int)]
+        segments = _segments(xs, ys, frames, closed)
+        if isinstance(segments, np.ndarray):
+            n = segments.shape[0] * segments.shape[1]
+        else:
+            n = sum(len(s) for s in segments)
+        self.axes.add_collection(LineCollection(segments, colors=color))
+        self.axes.autoscale_view()
+        return n
+
+    def refresh(self):
+        '''
+        Redraw the figure, if it's shown, so that records drawn so far appear
+        '''
+        canvas = self.axes.figure.canvas
+        canvas.draw_idle()
+        canvas.flush_events()
+
+
+def _segments(xs, ys, frames, closed):
+    '''
+    Line segments for `~matplotlib.collections.LineCollection` from the given frames of
+    per-frame coordinates. An array of shape (frames, points, 2) if every frame has the
+    same number of points, and otherwise a list of (points, 2) arrays
+    '''
+    if isinstance(xs, np.ndarray) and xs.ndim == 2:
+        x = xs[frames]
+        y = ys[frames]
+    else:
+        x = [xs[i] for i in frames]
+        y = [ys[i] for i in frames]
+        try:
+            # None, for missing points, becomes NaN, which leaves a gap in the line
+            x = np.array(x, dtype=float)
+            y = np.array(y, dtype=float)
+        except ValueError:
+            # Frames have different numbers of points
+            segments = [np.column_stack((np.asarray(fx, dtype=float),
+                                         np.asarray(fy, dtype=float)))
+                        for fx, fy in zip(x, y)]
+            if closed:
+                segments = [np.concatenate((s, s[:1])) for s in segments]
+            return segments
+    segments = np.stack((x, y), axis=-1)
+    if closed:
+        segments = np.concatenate((segments, segments[:, :1]), axis=1)
+    return segments
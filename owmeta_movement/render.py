@@ -0,0 +1,321 @@
+'''
+Rendering of many `~owmeta_movement.WormTracks` plots to image files at once.
+
+Loading a track's records needs the database, so it's done in the calling process, one
+track at a time, and only for tracks whose image needs to be rendered. Drawing and
+encoding the image, which take most of the time for large tracks, don't, so they're done
+with the Agg backend in a pool of worker processes.
+
+Outputs are recorded in a manifest in the output directory with a fingerprint of the
+track data and rendering options they were made from. The fingerprint is made from the
+stored literals' lexical forms, which, for a `~owmeta_movement.ChunkedArrayLiteral`, hold
+a digest of the array rather than the array itself, so checking it doesn't load the
+chunks. Outputs whose fingerprint hasn't changed are not rendered again.
+'''
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from os.path import join as p, isfile
+from urllib.parse import quote
+
+from owmeta_core.collections import Seq
+
+L = logging.getLogger(__name__)
+
+
+MANIFEST_FILE_NAME = 'render-manifest.json'
+'''
+Name of the file, in the output directory, recording the fingerprint of each output
+'''
+
+FORMATS = ('png', 'svg')
+'''
+Supported output formats
+'''
+
+
+class RenderOptions(namedtuple('RenderOptions', ('format', 'width', 'height',
+        'max_points', 'frame_stride'))):
+    '''
+    How to render tracks
+
+    Attributes
+    ----------
+    format : str
+        Output format. One of `FORMATS`
+    width : int
+        Width of the image in pixels
+    height : int
+        Height of the image in pixels
+    max_points : int or None
+        Maximum number of points to draw for each track. See
+        `~owmeta_movement.plotting.RecordPlotter`
+    frame_stride : int
+        Draw skeletons and contours for only every `frame_stride`-th frame
+    '''
+    __slots__ = ()
+
+    def __new__(cls, format='png', width=640, height=480, max_points=None,
+            frame_stride=1):
+        if format not in FORMATS:
+            raise ValueError(f'Unsupported format {format!r}. Must be one of:'
+                    f' {", ".join(FORMATS)}')
+        for name, value in (('width', width), ('height', height),
+                            ('frame_stride', frame_stride)):
+            if value < 1:
+                raise ValueError(f'{name} must be positive, not {value}')
+        if max_points is not None and max_points < 1:
+            raise ValueError(f'max_points must be positive, not {max_points}')
+        return super().__new__(cls, format, width, height, max_points, frame_stride)
+
+
+class RenderResult(namedtuple('RenderResult', ('tracks', 'output_path', 'rendered'))):
+    '''
+    The output for one `~owmeta_movement.WormTracks`
+
+    Attributes
+    ----------
+    tracks : rdflib.term.URIRef
+        Identifier of the tracks
+    output_path : str
+        Path to the image file
+    rendered : bool
+        `True` if the image was rendered, or `False` if it was already up to date
+    '''
+    __slots__ = ()
+
+
+_MANIFEST_SAVE_INTERVAL = 100
+'''
+Number of outputs rendered between saves of the manifest
+'''
+
+_RecordValues = namedtuple('_RecordValues', ('x', 'y', 'px', 'py'))
+
+_RenderJob = namedtuple('_RenderJob', ('records', 'output_path', 'options'))
+
+
+def render_many(context, tracks, output_dir, options=None, jobs=None, force=False):
+    '''
+    Render plots of many `~owmeta_movement.WormTracks` to image files
+
+    Parameters
+    ----------
+    context : owmeta_core.context.Context
+        Context to load the tracks from
+    tracks : iterable of rdflib.term.URIRef
+        Identifiers of the tracks to render
+    output_dir : str
+        Directory for the images. Created if it doesn't exist. Each image is named after
+        its tracks' identifier
+    options : RenderOptions, optional
+        How to render the tracks. Defaults to ``RenderOptions()``
+    jobs : int, optional
+        Number of worker processes. If 1, then everything is done in this process.
+        Defaults to the number of CPUs
+    force : bool, optional
+        If `True`, render images even if they're up to date
+
+    Yields
+    ------
+    RenderResult
+        The result for each of the tracks, in the order they finish. Tracks with no data
+        are logged and skipped
+    '''
+    if options is None:
+        options = RenderOptions()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = p(output_dir, MANIFEST_FILE_NAME)
+    manifest = _read_manifest(manifest_path)
+
+    def jobs_to_run():
+        for ident in tracks:
+            record_terms = _load_record_terms(context, ident)
+            if record_terms is None:
+                L.warning('Found no data for %s. Not rendering it', ident)
+                continue
+            file_name = output_file_name(ident, options.format)
+            output_path = p(output_dir, file_name)
+            fingerprint = _fingerprint(record_terms, options)
+            if (not force and manifest.get(file_name) == fingerprint and
+                    isfile(output_path)):
+                job = None
+            else:
+                job = _RenderJob([_record_values(terms) for terms in record_terms],
+                        output_path, options)
+            yield (ident, file_name, fingerprint), job
+
+    unsaved = 0
+
+    def finish(result, rendered):
+        nonlocal unsaved
+        ident, file_name, fingerprint = result
+        if rendered:
+            manifest[file_name] = fingerprint
+            unsaved += 1
+            if unsaved >= _MANIFEST_SAVE_INTERVAL:
+                _write_manifest(manifest_path, manifest)
+                unsaved = 0
+        return RenderResult(ident, p(output_dir, file_name), rendered)
+
+    try:
+        if jobs == 1:
+            for result, job in jobs_to_run():
+                if job is not None:
+                    _render(job)
+                yield finish(result, job is not None)
+            return
+
+        workers = jobs or os.cpu_count() or 1
+        # Spawn rather than fork: the parent may have open database connections
+        with ProcessPoolExecutor(max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            pending = dict()
+
+            def completed():
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    yield finish(pending.pop(future), True)
+
+            for result, job in jobs_to_run():
+                if job is None:
+                    yield finish(result, False)
+                    continue
+                pending[executor.submit(_render, job)] = result
+                # Bound the number of tracks loaded, but not yet rendered, so they don't
+                # all end up in memory
+                if len(pending) >= 2 * workers:
+                    yield from completed()
+            while pending:
+                yield from completed()
+    finally:
+        # Also saved if rendering stops part way, so finished outputs aren't redone
+        if unsaved:
+            _write_manifest(manifest_path, manifest)
+
+
+def output_file_name(tracks, format):
+    '''
+    Name of the image file for a `~owmeta_movement.WormTracks`
+
+    Parameters
+    ----------
+    tracks : rdflib.term.URIRef
+        Identifier of the tracks
+    format : str
+        Output format. One of `FORMATS`
+
+    Returns
+    -------
+    str
+        The file name: the percent-encoded identifier with the format as its extension
+    '''
+    return f'{quote(str(tracks), safe="")}.{format}'
+
+
+def _load_record_terms(context, tracks):
+    '''
+    Returns the stored terms for the values of each of the tracks' records, ordered by the
+    records' identifiers, or `None` if the tracks have no data
+
+    The order determines the colors of the records in the image, so it's the same each
+    time rather than the order the records happen to be loaded in
+    '''
+    from . import WormTracks, DataRecord
+
+    data_set = set(context(WormTracks)(ident=tracks).data.get())
+    if not data_set:
+        return None
+    data_record = data_set.pop()
+    if isinstance(data_record, Seq):
+        records = context.stored(data_record).rdfs_member()
+    elif isinstance(data_record, DataRecord):
+        records = [data_record]
+    else:
+        return None
+    return [(r.identifier, _RecordValues(*(r.data_term(name)
+                                           for name in _RecordValues._fields)))
+            for r in sorted(records, key=lambda r: r.identifier)]
+
+
+def _record_values(record_terms):
+    '''
+    The values of a record's terms. This is where any chunks of the arrays are loaded
+    '''
+    _, terms = record_terms
+    return _RecordValues(*(None if term is None else term.toPython() for term in terms))
+
+
+def _fingerprint(record_terms, options):
+    '''
+    A digest of the records, in order, and the options, which determine the image
+    '''
+    h = hashlib.sha256(repr(tuple(options)).encode())
+    for ident, terms in record_terms:
+        h.update(ident.encode())
+        for term in terms:
+            h.update(b'\0')
+            if term is not None:
+                h.update(f'{term.datatype}\0{term}'.encode())
+        h.update(b'\0\0')
+    return h.hexdigest()
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+    except ValueError:
+        L.warning('Ignoring unreadable render manifest at %s', path, exc_info=True)
+        return dict()
+
+
+def _write_manifest(path, manifest):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    finally:
+        if isfile(tmp):
+            os.unlink(tmp)
+
+
+def _render(job):
+    '''
+    Draws the records and saves the image. Runs in a worker process
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    from .plotting import RecordPlotter
+
+    options = job.options
+    dpi = 100
+    fig = Figure(figsize=(options.width / dpi, options.height / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    axes = fig.add_subplot()
+    plotter = RecordPlotter(axes,
+                            max_points=options.max_points,
+                            record_count=len(job.records),
+                            frame_stride=options.frame_stride)
+    for record in job.records:
+        plotter.plot_values(*record)
+
+    # Written to a temporary file first so that an interrupted render doesn't leave a
+    # partial image behind
+    tmp = f'{job.output_path}.{os.getpid()}.tmp'
+    try:
+        fig.savefig(tmp, format=options.format)
+        os.replace(tmp, job.output_path)
+    finally:
+        if isfile(tmp):
+            os.unlink(tmp)
+    return job.output_path
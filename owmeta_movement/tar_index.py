@@ -0,0 +1,260 @@
+'''
+Random access to members of (possibly gzip-compressed) tar archives.
+
+Getting a member out of a ``.tar.gz`` with `tarfile` means decompressing, and scanning
+the headers of, everything before it. For archives like the CeMEE MWT dataset, with
+hundreds of samples in a single ~550MB ``.tar.gz``, that's repeated for every sample. The
+functions here build a sidecar index for an archive once: a table of member offsets and,
+if `indexed_gzip` is installed, gzip restart points. With the index, a member can be read
+by decompressing at most `GZIP_INDEX_SPACING` bytes before it. Without `indexed_gzip`
+(the ``gzip_index`` extra), reading a member of a ``.tar.gz`` still decompresses
+everything before it, and a warning is logged the first time that's done for an archive.
+Seeking backwards in the member would then mean decompressing from the start of the
+archive again, so the member is copied to a temporary file first.
+'''
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import logging
+import os
+from os.path import join as p, abspath, isfile
+import shutil
+import tarfile
+import tempfile
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+
+L = logging.getLogger(__name__)
+
+GZIP_INDEX_SPACING = 4 << 20
+'''
+Number of uncompressed bytes between gzip restart points in the index
+'''
+
+_INDEX_VERSION = 1
+
+_SPOOL_MAX_SIZE = 16 << 20
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+_warned_no_gzip_index = set()
+
+
+@contextmanager
+def open_tar_member(archive_path, member_name, index_directory, random_access=True):
+    '''
+    Open a member of a tar archive for reading
+
+    The index for the archive is made on first use and saved to `index_directory`. It's
+    rebuilt if the archive's size or modification time changes.
+
+    If the archive is gzipped and `indexed_gzip` isn't installed, the member can only be
+    read efficiently from start to end. In that case, if `random_access` is `True`, the
+    member is copied to a temporary file, which is what's yielded.
+
+    Parameters
+    ----------
+    archive_path : str
+        Path to the archive. May be compressed with gzip
+    member_name : str
+        Name of the member within the archive
+    index_directory : str
+        Directory where the index for the archive is, or will be, stored. Indexes for
+        several archives may be stored in the same directory
+    random_access : bool, optional
+        Whether the member will be read other than from start to end, as with
+        `zipfile.ZipFile`
+
+    Yields
+    ------
+    io.BufferedIOBase
+        A seekable, binary file object for the contents of the member
+
+    Raises
+    ------
+    KeyError
+        Raised if there is no member named `member_name` in the archive
+    '''
+    members, gzipped, gzip_index_path = _index(archive_path, index_directory)
+
+    try:
+        offset, size = members[member_name]
+    except KeyError:
+        raise KeyError(f'filename {member_name!r} not found in {archive_path}') from None
+
+    with _open_archive(archive_path, gzipped, gzip_index_path) as archive:
+        member = io.BufferedReader(_MemberView(archive, offset, size))
+        if not (random_access and gzipped and gzip_index_path is None):
+            yield member
+            return
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE) as spool:
+            shutil.copyfileobj(member, spool)
+            spool.seek(0)
+            yield spool
+
+
+def index_archive(archive_path, index_directory):
+    '''
+    Make the index for a tar archive, if it isn't already up to date
+
+    Useful for making the index once before several processes open members of the same
+    archive, rather than each of them making it
+
+    Parameters
+    ----------
+    archive_path : str
+        Path to the archive. May be compressed with gzip
+    index_directory : str
+        Directory where the index for the archive is, or will be, stored
+    '''
+    _index(archive_path, index_directory)
+
+
+def _index(archive_path, index_directory):
+    '''
+    Returns the member table for the archive, whether it's gzipped, and the path to its
+    gzip index, or `None` if there isn't one to use
+    '''
+    os.makedirs(index_directory, exist_ok=True)
+    base = p(index_directory, _index_base_name(archive_path))
+    stat = os.stat(archive_path)
+    gzipped = _is_gzipped(archive_path)
+    members = _read_member_table(base + '.json', stat)
+    gzip_index_path = None
+    if gzipped and indexed_gzip is not None:
+        gzip_index_path = base + '.gzidx'
+
+    if members is not None and gzip_index_path is not None and not isfile(gzip_index_path):
+        members = None
+
+    if members is None:
+        L.debug('Building index for %s in %s', archive_path, index_directory)
+        members = _build_index(archive_path, base, stat, gzip_index_path)
+    return members, gzipped, gzip_index_path
+
+
+def _index_base_name(archive_path):
+    return hashlib.sha224(abspath(archive_path).encode('utf-8')).hexdigest()
+
+
+def _is_gzipped(archive_path):
+    with open(archive_path, 'rb') as f:
+        return f.read(2) == _GZIP_MAGIC
+
+
+def _open_archive(archive_path, gzipped, gzip_index_path):
+    if not gzipped:
+        return open(archive_path, 'rb')
+    if gzip_index_path is not None:
+        return indexed_gzip.IndexedGzipFile(archive_path, index_file=gzip_index_path)
+    if archive_path not in _warned_no_gzip_index:
+        _warned_no_gzip_index.add(archive_path)
+        L.warning('indexed_gzip is not installed, so reading a member of %s means'
+                ' decompressing everything before it. Install the "gzip_index" extra of'
+                ' owmeta_movement for faster access', archive_path)
+    import gzip
+    return gzip.open(archive_path, 'rb')
+
+
+def _read_member_table(path, stat):
+    try:
+        with open(path) as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (table.get('version') != _INDEX_VERSION or
+            table.get('size') != stat.st_size or
+            table.get('mtime_ns') != stat.st_mtime_ns):
+        return None
+    return {name: tuple(loc) for name, loc in table['members'].items()}
+
+
+def _build_index(archive_path, base, stat, gzip_index_path):
+    if gzip_index_path is not None:
+        archive = indexed_gzip.IndexedGzipFile(archive_path, spacing=GZIP_INDEX_SPACING)
+        mode = 'r:'
+    else:
+        archive = open(archive_path, 'rb')
+        mode = 'r:*'
+
+    with archive:
+        members = dict()
+        with tarfile.open(fileobj=archive, mode=mode) as tf:
+            for member in tf:
+                if member.isfile():
+                    members[member.name] = (member.offset_data, member.size)
+        if gzip_index_path is not None:
+            archive.build_full_index()
+            _write_atomically(gzip_index_path, archive.export_index)
+
+    table = {'version': _INDEX_VERSION,
+             'size': stat.st_size,
+             'mtime_ns': stat.st_mtime_ns,
+             'members': members}
+
+    def write_table(path):
+        with open(path, 'w') as f:
+            json.dump(table, f)
+    # Written last so that it's only valid if the gzip index was written too
+    _write_atomically(base + '.json', write_table)
+    return members
+
+
+def _write_atomically(path, writer):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        writer(tmp)
+        os.replace(tmp, path)
+    finally:
+        if isfile(tmp):
+            os.unlink(tmp)
+
+
+class _MemberView(io.RawIOBase):
+    '''
+    A read-only, seekable view of a range of bytes in another file
+    '''
+
+    def __init__(self, fileobj, offset, size):
+        self._fileobj = fileobj
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            new_pos = pos
+        elif whence == io.SEEK_CUR:
+            new_pos = self._pos + pos
+        elif whence == io.SEEK_END:
+            new_pos = self._size + pos
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        if new_pos < 0:
+            raise ValueError(f'Negative seek position {new_pos}')
+        self._pos = new_pos
+        return new_pos
+
+    def readinto(self, b):
+        n = min(len(b), self._size - self._pos)
+        if n <= 0:
+            return 0
+        self._fileobj.seek(self._offset + self._pos)
+        data = self._fileobj.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
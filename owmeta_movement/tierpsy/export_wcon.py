@@ -23,6 +23,16 @@
 '''
 Utilities for reading movement data from Tierpsy HDF5 files
 
+`readMetaData`, `readUnits`, and `readData` each take either a file name, which they open
+for the duration of the call, or a `.param_readers.FeaturesFile`, which they read from
+and leave open. To read several of them from one file, open it once and pass the
+`~.param_readers.FeaturesFile` to each, as `exportWCONdict` does::
+
+    with FeaturesFile(file_name) as features:
+        metadata = readMetaData(features)
+        units = readUnits(features)
+        data = list(readData(features))
+
 Created on Mon Aug 15 20:55:19 2016
 
 @author: ajaver
@@ -32,12 +42,22 @@ from collections import OrderedDict
 import json
 
 import numpy as np
-import pandas as pd
-import tables
 
 from .obtain_features_helper import WormStats
-from .param_readers import read_unit_conversions, read_ventral_side, read_fps
+from .param_readers import (read_unit_conversions, read_ventral_side, read_fps,
+                            open_features_file)
+
 
+READ_BLOCK_BYTES = 16 * 1024 * 1024
+'''
+Target size, in bytes, of each read from the coordinate arrays in `readData`
+'''
+
+READ_BATCH_ROWS = 1 << 18
+'''
+Number of rows of the coordinate arrays that `readData` holds in memory at a time, unless a
+single worm has more
+'''
 
 wcon_metadata_fields = ['id', 'lab', 'who', 'timestamp', 'temperature', 'humidity', 'arena',
                         'food', 'media', 'sex', 'stage', 'age', 'strain', 'protocol', 'interpolate', 'software']
@@ -76,7 +96,7 @@ def readMetaData(fname, provenance_step='FEAT_CREATE'):
                 ordered_metadata[field] = metadata_dict[field]
         return ordered_metadata
 
-    with tables.File(fname, 'r') as fid:
+    with open_features_file(fname) as fid:
         if '/experiment_info' not in fid:
             experiment_info = {}
         else:
@@ -156,9 +176,13 @@ def readData(features_file, READ_FEATURES=False, IS_FOR_WCON=True):
     '''
     Read 'data' records from the features file, one per worm index
 
+    The coordinates are read for many worms at a time in large, chunk-aligned blocks (see
+    `READ_BLOCK_BYTES` and `READ_BATCH_ROWS`). Unless `IS_FOR_WCON` is `True`, the
+    coordinate arrays in each record are views of arrays shared by several worms
+
     Parameters
     ----------
-    features_file : ...
+    features_file : str or .param_readers.FeaturesFile
         HDF5 features file file from which data is to be read
     READ_FEATURES : bool, optional
         If `True`, add custom features to each record
@@ -171,56 +195,81 @@ def readData(features_file, READ_FEATURES=False, IS_FOR_WCON=True):
     dict
         Data records
     '''
+    with open_features_file(features_file) as features:
+        yield from _read_data(features, READ_FEATURES, IS_FOR_WCON)
+
+
+def _read_data(fid, READ_FEATURES, IS_FOR_WCON):
     if IS_FOR_WCON:
         lab_prefix = '@OMG '
     else:
         lab_prefix = ''
 
-    with pd.HDFStore(features_file, 'r') as fid:
-        if '/features_timeseries' not in fid:
-            return {}  # empty file nothing to do here
-
-        features_timeseries = fid['/features_timeseries']
-        feat_time_group_by_worm = features_timeseries.groupby('worm_index')
-
-    ventral_side = _get_ventral_side(features_file)
-
-    with tables.File(features_file, 'r') as fid:
-        # fps used to adjust timestamp to real time
-        fps = read_fps(features_file)
-
-        # get pointers to some useful data
-        skeletons = fid.get_node('/coordinates/skeletons')
-        dorsal_contours = fid.get_node('/coordinates/dorsal_contours')
-        ventral_contours = fid.get_node('/coordinates/ventral_contours')
-
-        # let's append the data of each individual worm as a element in a list
-
-        # group by iterator will return sorted worm indexes
-        for worm_id, worm_feat_time in feat_time_group_by_worm:
-
-            worm_id = int(worm_id)
-            # read worm skeletons data
-            worm_skel = skeletons[worm_feat_time.index]
-            worm_dor_cnt = dorsal_contours[worm_feat_time.index]
-            worm_ven_cnt = ventral_contours[worm_feat_time.index]
+    if '/features_timeseries' not in fid:
+        return  # empty file nothing to do here
+
+    features_timeseries = fid.store['/features_timeseries']
+
+    ventral_side = _get_ventral_side(fid)
+
+    # Rows for each worm, in the same order as `features_timeseries.groupby('worm_index')`
+    # would give them: worms by index and, for each worm, rows in file order
+    worm_index = features_timeseries['worm_index'].values
+    order = np.argsort(worm_index, kind='stable')
+    sorted_worm_index = worm_index[order]
+    worm_starts = np.flatnonzero(np.r_[True, sorted_worm_index[1:] != sorted_worm_index[:-1]])
+    worm_ends = np.r_[worm_starts[1:], len(order)]
+    coordinate_rows = features_timeseries.index.values[order]
+    timestamps = features_timeseries['timestamp'].values[order]
+
+    # fps used to adjust timestamp to real time
+    fps = read_fps(fid)
+
+    # get pointers to some useful data
+    skeletons = fid.get_node('/coordinates/skeletons')
+    dorsal_contours = fid.get_node('/coordinates/dorsal_contours')
+    ventral_contours = fid.get_node('/coordinates/ventral_contours')
+    n_ventral = ventral_contours.shape[1]
+
+    for batch_start, batch_end in _worm_batches(worm_starts, worm_ends):
+        # The coordinates for a batch of worms are read in a few large blocks rather
+        # than with a fancy-indexed read for each worm, and each worm's data are views
+        # of the batch arrays
+        rows = coordinate_rows[worm_starts[batch_start]:worm_ends[batch_end - 1]]
+        batch_skel = _read_rows(skeletons, rows)
+        batch_contour = np.empty((len(rows),
+                                  n_ventral + dorsal_contours.shape[1]) +
+                                 ventral_contours.shape[2:],
+                                 dtype=np.result_type(ventral_contours.dtype,
+                                                      dorsal_contours.dtype))
+        _read_rows(ventral_contours, rows, out=batch_contour[:, :n_ventral])
+        # Dorsal contours are reversed so the contour goes around the worm
+        _read_rows(dorsal_contours, rows, out=batch_contour[:, n_ventral:][:, ::-1])
+        batch_offset = worm_starts[batch_start]
+
+        for worm in range(batch_start, batch_end):
+            worm_start, worm_end = worm_starts[worm], worm_ends[worm]
+            worm_id = int(sorted_worm_index[worm_start])
+            worm_rows = slice(worm_start - batch_offset, worm_end - batch_offset)
+            worm_skel = batch_skel[worm_rows]
+            contour = batch_contour[worm_rows]
 
             # start ordered dictionary with the basic features
             worm_basic = OrderedDict()
             worm_basic['id'] = str(worm_id)
             worm_basic['head'] = 'L'
             worm_basic['ventral'] = ventral_side
-            worm_basic['ptail'] = worm_ven_cnt.shape[1] - 1  # index starting with 0
+            worm_basic['ptail'] = n_ventral - 1  # index starting with 0
 
-            worm_basic['t'] = worm_feat_time['timestamp'].values / fps  # convert from frames to seconds
+            # convert from frames to seconds
+            worm_basic['t'] = timestamps[worm_start:worm_end] / fps
             worm_basic['x'] = worm_skel[:, :, 0]
             worm_basic['y'] = worm_skel[:, :, 1]
-
-            contour = np.hstack((worm_ven_cnt, worm_dor_cnt[:, ::-1, :]))
             worm_basic['px'] = contour[:, :, 0]
             worm_basic['py'] = contour[:, :, 1]
 
             if READ_FEATURES:
+                worm_feat_time = features_timeseries.iloc[order[worm_start:worm_end]]
                 worm_features = __addOMGFeat(fid, worm_feat_time, worm_id)
                 for feat in worm_features:
                     worm_basic[lab_prefix + feat] = worm_features[feat]
@@ -234,6 +283,76 @@ def readData(features_file, READ_FEATURES=False, IS_FOR_WCON=True):
             yield worm_basic
 
 
+def _worm_batches(worm_starts, worm_ends, max_rows=None):
+    '''
+    Splits worms into consecutive batches of about `max_rows` rows. Yields the start and
+    end, exclusive, of each batch as indexes into `worm_starts` and `worm_ends`. A worm
+    with more than `max_rows` rows gets a batch to itself
+    '''
+    if max_rows is None:
+        max_rows = READ_BATCH_ROWS
+    batch_start = 0
+    n_worms = len(worm_starts)
+    while batch_start < n_worms:
+        limit = worm_starts[batch_start] + max_rows
+        batch_end = int(np.searchsorted(worm_ends, limit, side='right'))
+        batch_end = max(batch_end, batch_start + 1)
+        yield batch_start, batch_end
+        batch_start = batch_end
+
+
+def _read_rows(node, rows, out=None, block_size=None):
+    '''
+    Reads the given rows of an HDF5 array in order
+
+    Rather than one fancy-indexed read, which becomes a read for each run of rows, the
+    rows are sorted and read in contiguous blocks, aligned with the chunks of the array,
+    of about `block_size` bytes. Blocks without any of the rows are skipped.
+
+    Parameters
+    ----------
+    node : tables.Array
+        The array to read from
+    rows : numpy.ndarray
+        Indexes of the rows to read. They may be in any order and may repeat
+    out : numpy.ndarray, optional
+        Array to put the rows in, in the order of `rows`. Created if not given
+    block_size : int, optional
+        Target size of each read in bytes
+
+    Returns
+    -------
+    numpy.ndarray
+        `out`, holding the rows
+    '''
+    if block_size is None:
+        block_size = READ_BLOCK_BYTES
+    if out is None:
+        out = np.empty((len(rows),) + tuple(node.shape[1:]), dtype=node.dtype)
+    if len(rows) == 0:
+        return out
+
+    row_size = max(node.dtype.itemsize * int(np.prod(node.shape[1:])), 1)
+    chunk_rows = node.chunkshape[0] if node.chunkshape else 1
+    block_rows = max(block_size // row_size // chunk_rows, 1) * chunk_rows
+
+    perm = np.argsort(rows, kind='stable')
+    sorted_rows = rows[perm]
+    n_rows = node.shape[0]
+    if sorted_rows[0] < 0 or sorted_rows[-1] >= n_rows:
+        raise IndexError(f'Rows out of range for {node._v_pathname}, which has'
+                f' {n_rows} rows')
+    lo = 0
+    while lo < len(sorted_rows):
+        start = (int(sorted_rows[lo]) // chunk_rows) * chunk_rows
+        stop = min(start + block_rows, n_rows)
+        hi = int(np.searchsorted(sorted_rows, stop, side='left'))
+        block = node[start:stop]
+        out[perm[lo:hi]] = block[sorted_rows[lo:hi] - start]
+        lo = hi
+    return out
+
+
 def readUnits(features_file, READ_FEATURES=False):
     '''
     Read in the units for the corresponding data records recoverable from the features
@@ -241,7 +360,7 @@ def readUnits(features_file, READ_FEATURES=False):
 
     Parameters
     ----------
-    features_file : ...
+    features_file : str or .param_readers.FeaturesFile
         HDF5 features file file from which units are to be read
     READ_FEATURES : bool, optional
         If `True`, add units for custom features to each record
@@ -251,7 +370,8 @@ def readUnits(features_file, READ_FEATURES=False):
     dict
         The units for each field
     '''
-    fps_out, microns_per_pixel_out, _ = read_unit_conversions(features_file)
+    with open_features_file(features_file) as features:
+        fps_out, microns_per_pixel_out, _ = read_unit_conversions(features)
     xy_units = microns_per_pixel_out[1]
     time_units = fps_out[2]
 
@@ -269,3 +389,32 @@ def readUnits(features_file, READ_FEATURES=False):
             units['@OMG ' + field] = unit
 
     return units
+
+
+def exportWCONdict(features_file, READ_FEATURES=False):
+    '''
+    Read the metadata, units, and data records from the features file into a WCON
+    object, opening the file only once
+
+    Parameters
+    ----------
+    features_file : str or .param_readers.FeaturesFile
+        HDF5 features file file from which the WCON is to be read
+    READ_FEATURES : bool, optional
+        If `True`, add custom features, and their units, to each record
+
+    Returns
+    -------
+    collections.OrderedDict
+        The WCON object, with "metadata", "units", and "data" members
+    '''
+    with open_features_file(features_file) as features:
+        metadata = wcon_reformat_metadata(readMetaData(features))
+        units = readUnits(features, READ_FEATURES)
+        data = list(readData(features, READ_FEATURES))
+
+    wcon_dict = OrderedDict()
+    wcon_dict['metadata'] = metadata
+    wcon_dict['units'] = units
+    wcon_dict['data'] = data
+    return wcon_dict
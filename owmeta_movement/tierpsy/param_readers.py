@@ -19,10 +19,12 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+from contextlib import contextmanager
 import json
 import os
 
 import numpy as np
+import pandas as pd
 import tables
 
 
@@ -30,7 +32,7 @@ VALID_FIELDS = ['/mask', '/trajectories_data', '/features_timeseries']
 
 
 def read_unit_conversions(fname, dflt=1):
-    reader = AttrReader(fname, dflt)
+    reader = _attr_reader(fname, dflt)
     fps_out = reader.get_fps()
 
     microns_per_pixel_out = reader.get_microns_per_pixel()
@@ -42,25 +44,68 @@ def read_unit_conversions(fname, dflt=1):
 def read_ventral_side(fname):
     # I am giving priority to a contour stored in experiments_info, rather than one read by the json file.
     # currently i am only using the experiments_info in the re-analysis of the old schafer database
-    reader = AttrReader(fname)
+    reader = _attr_reader(fname)
     ventral_side = reader.ventral_side
     return ventral_side
 
 
 def read_fps(fname, dflt=1):
-    reader = AttrReader(fname, dflt)
+    reader = _attr_reader(fname, dflt)
     return reader.fps
 
 
+def _attr_reader(fname, dflt=1):
+    '''
+    The given `FeaturesFile`, so that what it has already read is reused, or a new
+    `AttrReader` for a file name
+    '''
+    if isinstance(fname, FeaturesFile):
+        return fname
+    return AttrReader(fname, dflt)
+
+
+@contextmanager
+def open_features_file(fname, tables_only=False):
+    '''
+    Context manager giving an open features file for `fname`. If `fname` is already a
+    `FeaturesFile`, it is given as-is and left open. Otherwise, the file is opened and then
+    closed on exit
+
+    Parameters
+    ----------
+    fname : str or FeaturesFile
+        The features file
+    tables_only : bool, optional
+        If `True`, a file name is opened as a `tables.File` rather than a `FeaturesFile`.
+        Both support ``get_node`` and ``in``, so this is for readers that only need those
+        and saves opening the file with pandas
+    '''
+    if isinstance(fname, FeaturesFile):
+        yield fname
+    elif tables_only:
+        with tables.File(fname, 'r') as fid:
+            yield fid
+    else:
+        with FeaturesFile(fname) as features:
+            yield features
+
+
 class AttrReader():
     def __init__(self, file_name, dflt=1):
         self.file_name = file_name
         self.dflt = dflt
+        self._attrs = {}
         self.field = self._find_field()
 
+    def _file(self):
+        '''
+        What to open to read from the file
+        '''
+        return self.file_name
+
     def _find_field(self):
         if os.path.exists(self.file_name):
-            with tables.File(self.file_name, 'r') as fid:
+            with open_features_file(self._file(), tables_only=True) as fid:
                 for field in VALID_FIELDS:
                     if field in fid:
                         return field
@@ -72,19 +117,28 @@ class AttrReader():
         if dflt is None:
             dflt = self.dflt
 
-        attr = dflt
-        if self.field:
-            with tables.File(self.file_name, 'r') as fid:
-                node = fid.get_node(self.field)
+        if attr_name not in self._attrs:
+            attr = None
+            found = False
+            if self.field:
+                with open_features_file(self._file(), tables_only=True) as fid:
+                    node = fid.get_node(self.field)
 
-                if attr_name in node._v_attrs:
-                    attr = node._v_attrs[attr_name]
-        return attr
+                    if attr_name in node._v_attrs:
+                        attr = node._v_attrs[attr_name]
+                        found = True
+            self._attrs[attr_name] = (found, attr)
+
+        found, attr = self._attrs[attr_name]
+        return attr if found else dflt
 
     def get_fps(self):
+        if hasattr(self, '_fps'):
+            return self._fps, self._expected_fps, self._time_units
+
         expected_fps = self._read_attr('expected_fps', dflt=1)
         try:
-            fps, time_units = fps_from_timestamp(self.file_name)
+            fps, time_units = fps_from_timestamp(self._file())
 
         except (tables.exceptions.NoSuchNodeError, IOError, ValueError, KeyError):
             fps = self._read_attr('fps', dflt=-1)
@@ -122,8 +176,11 @@ class AttrReader():
             return self._time_units
 
     def get_microns_per_pixel(self):
+        if hasattr(self, '_microns_per_pixel'):
+            return self._microns_per_pixel, self._xy_units
+
         try:
-            microns_per_pixel, xy_units = single_db_microns_per_pixel(self.file_name)
+            microns_per_pixel, xy_units = single_db_microns_per_pixel(self._file())
         except (tables.exceptions.NoSuchNodeError, IOError, ValueError, KeyError):
             microns_per_pixel = self._read_attr('microns_per_pixel', dflt=1)
             xy_units = self._read_attr('xy_units', dflt=None)
@@ -159,7 +216,7 @@ class AttrReader():
             return self._ventral_side
         except BaseException:
             try:
-                ventral_side = single_db_ventral_side(self.file_name)
+                ventral_side = single_db_ventral_side(self._file())
             except BaseException:
                 ventral_side = self._read_attr('ventral_side', dflt="")
 
@@ -167,9 +224,72 @@ class AttrReader():
             return self._ventral_side
 
 
+class FeaturesFile(AttrReader):
+    '''
+    A Tierpsy features file, opened once and shared by the readers of its data and
+    parameters
+
+    The functions in this module and in `~owmeta_movement.tierpsy.export_wcon` accept a
+    `FeaturesFile` in place of a file name, so exporting a file opens it only once rather
+    than for every value read. Values derived from the file (fps, time units, microns per
+    pixel, xy units, ventral side, and attributes of its nodes) are cached.
+
+    Can be used as a context manager, closing the file on exit.
+    '''
+
+    def __init__(self, file_name, dflt=1):
+        # pandas is needed to read some tables, so the file is opened through it. The
+        # other nodes are read through the same handle with `get_node`
+        self.store = pd.HDFStore(file_name, 'r')
+        try:
+            super().__init__(file_name, dflt)
+        except BaseException:
+            self.store.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.store.close()
+
+    def _file(self):
+        return self
+
+    def get_node(self, path):
+        '''
+        Get a node from the file
+
+        Parameters
+        ----------
+        path : str
+            Path to the node
+
+        Returns
+        -------
+        tables.Node
+            The node
+
+        Raises
+        ------
+        tables.NoSuchNodeError
+            Raised if there's no node at `path`
+        '''
+        node = self.store.get_node(path)
+        if node is None:
+            raise tables.NoSuchNodeError(path)
+        return node
+
+    def __contains__(self, path):
+        return path in self.store
+
+
 def fps_from_timestamp(file_name):
     # try to calculate the frames per second from the timestamp
-    with tables.File(file_name, 'r') as fid:
+    with open_features_file(file_name, tables_only=True) as fid:
         timestamp_time = fid.get_node('/timestamp/time')[:]
         if np.all(np.isnan(timestamp_time)):
             raise ValueError
@@ -189,7 +309,7 @@ def fps_from_timestamp(file_name):
 
 def single_db_ventral_side(file_name):
     # this for the shaffer's lab old database
-    with tables.File(file_name, 'r') as fid:
+    with open_features_file(file_name, tables_only=True) as fid:
         exp_info_b = fid.get_node('/experiment_info').read()
         exp_info = json.loads(exp_info_b.decode("utf-8"))
         ventral_side = exp_info['ventral_side']
@@ -199,7 +319,7 @@ def single_db_ventral_side(file_name):
 def single_db_microns_per_pixel(file_name):
     # this is used in the single worm case, but it would be deprecated. I want to use this
     # argument when I read the data from original additional files
-    with tables.File(file_name, 'r') as fid:
+    with open_features_file(file_name, tables_only=True) as fid:
         microns_per_pixel_scale = fid.get_node('/stage_movement')._v_attrs['microns_per_pixel_scale']
         if microns_per_pixel_scale.size == 2:
             assert np.abs(
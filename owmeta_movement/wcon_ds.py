@@ -1,12 +1,70 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
 import json
 
+from owmeta_core.data import TRANSACTION_MANAGER_KEY
 from owmeta_core.datasource import DataTranslator
 from owmeta_core.data_trans.local_file_ds import LocalFileDataSource
 from owmeta.data_trans.data_with_evidence_ds import DataWithEvidenceDataSource
 from owmeta.document import SourcedFrom
 from owmeta.evidence import Evidence
+from rdflib.term import URIRef
 
-from . import WormTracks, CONTEXT, WCONWormTracksCreator_2020_07
+from . import CONTEXT, add_triples
+from .metadata_index import (MetadataIndex, metadata_graph, metadata_index_path,
+                             metadata_triples, tracks_metadata)
+from .wcon_stream import text_stream, wcon_items
+
+
+PREPARED_TRACKS_IDENT = URIRef('urn:x-owmeta-movement:prepared-tracks')
+'''
+Placeholder identifier for the `WormTracks` in `PreparedWCON.tracks_triples`
+'''
+
+
+class PreparedWCON(namedtuple('PreparedWCON', ('wcon_file_path', 'tracks_triples'))):
+    '''
+    Results of translation steps done ahead of time, typically in another process, for a
+    single source
+
+    Attributes
+    ----------
+    wcon_file_path : str
+        Path to a file holding WCON which has already been fixed-up for a
+        `~owmeta_movement.cemee.CeMEEWCONDataSource`. May be `None`
+    tracks_triples : list of tuple
+        Triples for `WormTracks` made from the WCON. The `WormTracks` and objects made for
+        it have identifiers starting with `PREPARED_TRACKS_IDENT`. May be `None`
+    '''
+    __slots__ = ()
+
+
+_prepared_wcon = ContextVar('_prepared_wcon', default=None)
+
+
+@contextmanager
+def prepared_wcon(prepared):
+    '''
+    Make translators use the given `PreparedWCON` rather than reading their input
+
+    Parameters
+    ----------
+    prepared : PreparedWCON
+        The prepared results for the source being translated
+    '''
+    token = _prepared_wcon.set(prepared)
+    try:
+        yield prepared
+    finally:
+        _prepared_wcon.reset(token)
+
+
+def current_prepared_wcon():
+    '''
+    Get the `PreparedWCON` set with `prepared_wcon` or `None` if there isn't one
+    '''
+    return _prepared_wcon.get()
 
 
 class WCONDataSource(LocalFileDataSource):
@@ -20,27 +78,110 @@ class WCONDataSource(LocalFileDataSource):
 class WCONDataTranslator(DataTranslator):
     '''
     Takes valid WCON data and turns it into WormTracks
+
+    The metadata of each WormTracks made are recorded in the
+    `~owmeta_movement.metadata_index.MetadataIndex` for the project.
     '''
     class_context = CONTEXT
     input_type = (WCONDataSource,)
     output_type = DataWithEvidenceDataSource
 
+    streaming = True
+    '''
+    If `True`, the WCON is read incrementally and data records are added to the
+    `WormTracks` one at a time rather than deserializing the whole file up-front. Peak
+    memory use then depends on the largest data record rather than the size of the file.
+    '''
+
+    bulk = True
+    '''
+    If `True`, triples for data records are made in bulk. See the ``bulk`` parameter of
+    `~owmeta_movement.WCONWormTracksCreator`. Records are checked against the schema
+    either way. Also applies to the WCON prepared by
+    `~owmeta_movement.batch.translate_many`
+    '''
+
     def translate(self, source):
+        from . import WCONWormTracksCreator, WCON_SCHEMA_2020_07
+
+        prepared = current_prepared_wcon()
+        if prepared is not None and prepared.tracks_triples is not None:
+            return self._translate_prepared(source, prepared.tracks_triples)
+
         with source.file_contents() as wcon:
-            wcon_json = json.load(wcon)
+            if self.streaming:
+                wcon_json = None
+                wcon_members = wcon_items(wcon)
+            else:
+                wcon_json = json.load(text_stream(wcon))
             res = self.make_new_output((source,))
+            tracks = self._make_tracks(source, res)
+            creator = WCONWormTracksCreator(WCON_SCHEMA_2020_07, bulk=self.bulk)
+            if wcon_json is None:
+                creator.fill_in_stream(tracks, wcon_members,
+                        context=res.data_context)
+            else:
+                creator.fill_in(tracks, wcon_json,
+                        context=res.data_context)
+            self._index_tracks(tracks, res.data_context.contents_triples())
+            return res
 
-            res.data_context.add_import(WormTracks.definition_context)
+    def _translate_prepared(self, source, tracks_triples):
+        res = self.make_new_output((source,))
+        tracks = self._make_tracks(source, res)
+        add_triples(res.data_context,
+                _replace_prefix(tracks_triples, PREPARED_TRACKS_IDENT, tracks.identifier))
+        # Metadata triples are selected before the identifiers are replaced so that only
+        # those few have to be changed again
+        self._index_tracks(tracks, _replace_prefix(metadata_triples(tracks_triples),
+                PREPARED_TRACKS_IDENT, tracks.identifier))
+        return res
 
-            source_documents = source.attach_property(SourcedFrom).get()
-            if source_documents:
-                res.evidence_context.add_import(Evidence.definition_context)
-            for source_document in source_documents:
-                res.evidence_context(Evidence)(
-                        reference=source_document,
-                        supports=res.data_context)
+    def _index_tracks(self, tracks, triples):
+        '''
+        Record the tracks' metadata in the metadata index, if there's one configured
 
-            tracks = res.data_context(WormTracks)(key=res.identifier, direct_key=False)
-            WCONWormTracksCreator_2020_07.fill_in(tracks, wcon_json,
-                    context=res.data_context)
-            return res
+        The metadata are read from `triples`, the triples made for the tracks, right
+        away. If there's a transaction manager, the tracks are indexed once the current
+        transaction commits, so the index doesn't list tracks that were never saved
+        '''
+        index_path = metadata_index_path(self.conf)
+        if index_path is None:
+            return
+        identifier = tracks.identifier
+        metadata = tracks_metadata(identifier, metadata_graph(triples))
+
+        def add_tracks(committed=True):
+            if not committed:
+                return
+            with MetadataIndex(index_path) as index:
+                index.add_tracks(identifier, **metadata)
+
+        transaction_manager = self.conf.get(TRANSACTION_MANAGER_KEY, None)
+        if transaction_manager is None:
+            add_tracks()
+        else:
+            transaction_manager.get().addAfterCommitHook(add_tracks)
+
+    def _make_tracks(self, source, res):
+        from . import WormTracks
+
+        res.data_context.add_import(WormTracks.definition_context)
+
+        source_documents = source.attach_property(SourcedFrom).get()
+        if source_documents:
+            res.evidence_context.add_import(Evidence.definition_context)
+        for source_document in source_documents:
+            res.evidence_context(Evidence)(
+                    reference=source_document,
+                    supports=res.data_context)
+
+        return res.data_context(WormTracks)(key=res.identifier, direct_key=False)
+
+
+def _replace_prefix(triples, old, new):
+    n = len(old)
+    for triple in triples:
+        yield tuple(URIRef(new + term[n:])
+                    if isinstance(term, URIRef) and term.startswith(old) else term
+                    for term in triple)
@@ -0,0 +1,236 @@
+'''
+Incremental reading of WCON documents.
+
+WCON files from multi-worm trackers can be very large, but nearly all of the size is in
+the ``data`` array. The reader here parses the top-level object one member at a time and
+yields the records of the ``data`` array one by one so that the whole document never has
+to be held in memory at once.
+
+WCON compressed with gzip is decompressed transparently.
+'''
+import gzip
+import io
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+_DEFAULT_CHUNK_SIZE = 1 << 16
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+class ObjectItems:
+    '''
+    Iterator over the ``(key, value)`` pairs of a JSON object that hasn't been fully read.
+    Returned by `wcon_items` for the value of ``data`` if requested
+    '''
+
+    def __init__(self, items):
+        self._items = items
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+
+def wcon_items(wcon, chunk_size=_DEFAULT_CHUNK_SIZE, data_object_items=False):
+    '''
+    Iterate over the members of the top-level object of a WCON document
+
+    Parameters
+    ----------
+    wcon : file object
+        The WCON document. May be opened in text or binary mode. Binary files are decoded
+        as UTF-8 and may be compressed with gzip
+    chunk_size : int, optional
+        Number of characters to read from `wcon` at a time
+    data_object_items : bool, optional
+        If `True` and the value for ``data`` is an object, then the value is an
+        `ObjectItems` over the members of that object instead of a `dict`. As for
+        arrays, it must be exhausted before the next member is read
+
+    Yields
+    ------
+    tuple
+        ``(key, value)`` pairs for the top-level object in document order. If the value
+        for ``data`` is an array, then the value is an iterator over the records in that
+        array instead of a list. The iterator must be exhausted before the next member is
+        read -- if it isn't, it is drained when the next member is requested.
+
+    Raises
+    ------
+    json.JSONDecodeError
+        Raised if the document is not well-formed JSON or the top-level value is not an
+        object
+    '''
+    return _WCONReader(text_stream(wcon), chunk_size).items(data_object_items)
+
+
+def text_stream(wcon):
+    '''
+    Get a text stream for a WCON document
+
+    Parameters
+    ----------
+    wcon : file object
+        The WCON document. May be opened in text or binary mode. Binary files are decoded
+        as UTF-8 and may be compressed with gzip
+
+    Returns
+    -------
+    io.TextIOBase
+        The WCON as text
+    '''
+    if isinstance(wcon, io.TextIOBase):
+        return wcon
+    if _is_gzipped(wcon):
+        wcon = gzip.GzipFile(fileobj=wcon, mode='rb')
+    return io.TextIOWrapper(wcon, encoding='utf-8')
+
+
+def _is_gzipped(wcon):
+    if hasattr(wcon, 'peek'):
+        return wcon.peek(2)[:2] == _GZIP_MAGIC
+    if wcon.seekable():
+        pos = wcon.tell()
+        magic = wcon.read(2)
+        wcon.seek(pos)
+        return magic == _GZIP_MAGIC
+    return False
+
+
+class _WCONReader:
+    def __init__(self, stream, chunk_size):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def items(self, data_object_items=False):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                self._error('Expected a string for an object key')
+            self._expect(':')
+            if key == 'data' and self._peek() == '[':
+                self._pos += 1
+                records = self._array_items()
+                yield key, records
+                # Make sure we're past the end of the array even if the consumer stopped
+                # early
+                for _ in records:
+                    pass
+            elif key == 'data' and data_object_items and self._peek() == '{':
+                self._pos += 1
+                members = ObjectItems(self._object_items())
+                yield key, members
+                for _ in members:
+                    pass
+            else:
+                yield key, self._value()
+            c = self._peek()
+            self._pos += 1
+            if c == '}':
+                break
+            if c != ',':
+                self._pos -= 1
+                self._error("Expected ',' or '}'")
+
+    def _array_items(self):
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            c = self._peek()
+            self._pos += 1
+            if c == ']':
+                break
+            if c != ',':
+                self._pos -= 1
+                self._error("Expected ',' or ']'")
+
+    def _object_items(self):
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                self._error('Expected a string for an object key')
+            self._expect(':')
+            yield key, self._value()
+            c = self._peek()
+            self._pos += 1
+            if c == '}':
+                break
+            if c != ',':
+                self._pos -= 1
+                self._error("Expected ',' or '}'")
+
+    def _fill(self, min_size=0):
+        size = max(self._chunk_size, min_size)
+        chunk = self._stream.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        '''
+        Skip whitespace and return the next character or an empty string at the end of
+        the document
+        '''
+        while True:
+            buf = self._buf
+            pos = self._pos
+            end = len(buf)
+            while pos < end and buf[pos] in _WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < end:
+                return buf[pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, c):
+        if self._peek() != c:
+            self._error(f'Expected {c!r}')
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # Probably truncated by the end of the buffer. Grow the buffer at least
+                # geometrically so that very large values aren't re-parsed too many times
+                if not self._fill(len(self._buf) - self._pos):
+                    raise
+                continue
+            if (not self._eof and
+                    isinstance(value, (int, float)) and not isinstance(value, bool) and
+                    _NUMBER_CHARS.issuperset(self._buf[end:])):
+                # A number at the end of the buffer could continue into the next chunk.
+                # The decoder stops at the longest valid prefix, so "1." or "1e" at the
+                # end of the buffer decodes as 1 and leaves the rest unconsumed
+                if self._fill(len(self._buf) - self._pos):
+                    continue
+            self._pos = end
+            return value
+
+    def _error(self, msg):
+        raise json.JSONDecodeError(msg, self._buf, self._pos)
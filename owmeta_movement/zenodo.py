@@ -1,9 +1,16 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import hashlib
+import json
 import logging
+import os
 from os import makedirs
 from os.path import join as p, isfile
 import re
-import shutil
+import threading
+import time
+from urllib.parse import urlsplit
 
 from bs4 import BeautifulSoup
 from owmeta.document import BaseDocument
@@ -13,6 +20,9 @@ from owmeta_core.dataobject import DatatypeProperty
 from owmeta_core.datasource_loader import DataSourceDirLoader, LoadFailed
 from owmeta_core.datasource import Informational
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
 
 from . import CONTEXT as MOVEMENT_CONTEXT
 
@@ -24,16 +34,96 @@ CONTEXT = ClassContext(ident=SCHEMA_URL,
         imported=(MOVEMENT_CONTEXT,),
         base_namespace=SCHEMA_URL + '#')
 
+OFFLINE_CONF_KEY = 'owmeta_movement.zenodo.offline'
+'''
+Configuration key for turning on `ZenodoRecordDirLoader.offline` mode
+'''
+
+OFFLINE_ENV_VAR = 'OWMETA_MOVEMENT_ZENODO_OFFLINE'
+'''
+Environment variable for turning on `ZenodoRecordDirLoader.offline` mode. Takes
+precedence over `OFFLINE_CONF_KEY`. Values like "1", "true", or "yes" turn it on, and
+"0", "false", or "no" turn it off
+'''
+
 
 _ZENODO_BASE_URL = 'https://zenodo.org'
 
+_DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+_MANIFEST_VERSION = 1
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_REACHABILITY_CACHE_VERSION = 1
+
 
 class ZenodoRecordDirLoader(DataSourceDirLoader):
     '''
     Provides files by downloading them from Zonodo.
+
+    Files are downloaded to a ``.part`` file next to their final location and renamed
+    once they're complete and verified. If a download is interrupted, it's resumed from
+    where it left off with an HTTP range request, either immediately, up to
+    `download_attempts` times, or on the next call to `load`.
+
+    When a whole record is loaded, its files are downloaded concurrently.
+
+    Unless a `session_provider` is given, requests are made with sessions that share a
+    pool of keep-alive connections, so connections are reused across requests and data
+    sources. Requests answered with a 429 (Too Many Requests) or 5xx status are retried
+    with exponential backoff.
+    '''
+
+    download_attempts = 5
+    '''
+    Number of times to try downloading a file, resuming after each failure, before giving
+    up
+    '''
+
+    max_workers = 4
+    '''
+    Default maximum number of files to download at once for a record
+    '''
+
+    max_connections_per_host = 4
+    '''
+    Default maximum number of simultaneous downloads from any one host. This applies
+    across all records being loaded with the same loader
+    '''
+
+    pool_size = 10
+    '''
+    Default maximum number of connections to keep open to any one host
+    '''
+
+    retries = 3
+    '''
+    Default number of times to retry a request after a connection error or a 429 or 5xx
+    response
     '''
 
-    def __init__(self, base_directory=None, session_provider=None, **kwargs):
+    backoff_factor = 0.5
+    '''
+    Default base delay, in seconds, between retries. The delay doubles with each retry
+    '''
+
+    can_load_ttl = 3600
+    '''
+    Default number of seconds to remember whether a file or record is reachable
+    '''
+
+    offline = False
+    '''
+    If `True`, no network requests are made: `can_load` and `load` only use files
+    already downloaded to the base directory. May be overridden with the
+    `OFFLINE_ENV_VAR` environment variable or by the data source's configuration value
+    for `OFFLINE_CONF_KEY`
+    '''
+
+    def __init__(self, base_directory=None, session_provider=None, max_workers=None,
+            max_connections_per_host=None, pool_size=None, retries=None,
+            backoff_factor=None, can_load_ttl=None, offline=None, **kwargs):
         '''
         Parameters
         ----------
@@ -43,14 +133,71 @@ class ZenodoRecordDirLoader(DataSourceDirLoader):
             created in this directory may be reused by other instances *of the same
             version* of this class.
         session_provider : callable, optional
-            Should return a requests.Session for the sake of making requests to Zenodo. By
-            default, will use a new session for every request
+            Should return a requests.Session for the sake of making requests to Zenodo. It
+            may be called from several threads at once. By default, each thread gets a
+            session using a connection pool shared by the loader
+        max_workers : int, optional
+            Maximum number of files to download at once for a record. Defaults to
+            `max_workers`
+        max_connections_per_host : int, optional
+            Maximum number of simultaneous downloads from any one host. Defaults to
+            `max_connections_per_host`
+        pool_size : int, optional
+            Maximum number of connections to keep open to any one host. Defaults to
+            `pool_size`. Not used if `session_provider` is given
+        retries : int, optional
+            Number of times to retry a failed request. Defaults to `retries`. Not used if
+            `session_provider` is given
+        backoff_factor : float, optional
+            Base delay, in seconds, between retries. Defaults to `backoff_factor`
+        can_load_ttl : float, optional
+            Number of seconds to remember whether a file or record is reachable. Defaults
+            to `can_load_ttl`. If 0, reachability isn't remembered
+        offline : bool, optional
+            Whether to work without network access. Defaults to `offline`
         '''
         super().__init__(base_directory=base_directory, **kwargs)
 
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if max_connections_per_host is not None:
+            self.max_connections_per_host = max_connections_per_host
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if retries is not None:
+            self.retries = retries
+        if backoff_factor is not None:
+            self.backoff_factor = backoff_factor
+        if can_load_ttl is not None:
+            self.can_load_ttl = can_load_ttl
+        if offline is not None:
+            self.offline = offline
+
         if session_provider is None:
-            session_provider = lambda: requests.Session()
+            # Sessions aren't safe to share between threads, but the adapter's connection
+            # pool is, so there's one session per thread all using the same adapter
+            self._adapter = HTTPAdapter(pool_maxsize=self.pool_size,
+                    max_retries=Retry(total=self.retries,
+                        backoff_factor=self.backoff_factor,
+                        status_forcelist=_RETRY_STATUSES,
+                        allowed_methods=('HEAD', 'GET'),
+                        raise_on_status=False))
+            self._thread_sessions = threading.local()
+            session_provider = self._thread_session
         self._session_provider = session_provider
+        self._host_semaphores = dict()
+        self._host_semaphores_lock = threading.Lock()
+        self._reachability = None
+        self._reachability_lock = threading.Lock()
+
+    def _thread_session(self):
+        session = getattr(self._thread_sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            self._thread_sessions.session = session
+        return session
 
     def can_load(self, ob):
         try:
@@ -74,14 +221,25 @@ class ZenodoRecordDirLoader(DataSourceDirLoader):
             L.debug('zenodo_file_name value is invalid: %s', file_name)
             return False
 
+        if self._verified_locally(zenodo_id, file_name):
+            return True
+
+        if self._offline(ob):
+            if (file_name and self.base_directory is not None and
+                    isfile(p(self.base_directory, str(zenodo_id), file_name))):
+                # Not verified, but it's all we've got
+                return True
+            L.debug('Offline, and %s has not been downloaded', ob)
+            return False
+
         # Check the zenodo file is reachable by try to grab the HEAD response for it
-        # zenodo_base_url is entirely optional
-        zenodo_base_url_prop = getattr(ob, 'zenodo_base_url', None)
-        if zenodo_base_url_prop is not None:
-            zenodo_base_url = zenodo_base_url_prop()
-        else:
-            zenodo_base_url = None
-        base_url = zenodo_base_url or _ZENODO_BASE_URL
+        base_url = _base_url(ob)
+
+        cache_key = json.dumps([base_url, str(zenodo_id), file_name or ''])
+        reachable = self._cached_reachability(cache_key)
+        if reachable is not None:
+            return reachable
+
         if not file_name:
             url = _record_url(base_url, zenodo_id)
         else:
@@ -89,7 +247,82 @@ class ZenodoRecordDirLoader(DataSourceDirLoader):
 
         session = self._session_provider()
         response = session.head(url)
-        return response.status_code == 200
+        reachable = response.status_code == 200
+        # Other statuses, like for server errors, may not last, so they aren't cached
+        if reachable or response.status_code in (404, 410):
+            self._cache_reachability(cache_key, reachable)
+        return reachable
+
+    def _verified_locally(self, zenodo_id, file_name):
+        '''
+        Returns `True` if the file, or every file in the record if `file_name` is `None`,
+        was downloaded and verified before and hasn't changed since
+        '''
+        if self.base_directory is None:
+            return False
+        manifest = _read_manifest(self._manifest_path(zenodo_id))
+        if file_name:
+            files = [file_name]
+        else:
+            files = manifest.get('listing')
+            if not files:
+                return False
+        recorddir = p(self.base_directory, str(zenodo_id))
+        return all(_is_current(p(recorddir, f), manifest['files'].get(f)) for f in files)
+
+    def _offline(self, data_source):
+        env_value = _flag(os.environ.get(OFFLINE_ENV_VAR))
+        if env_value is not None:
+            return env_value
+        conf = getattr(data_source, 'conf', None)
+        conf_value = _flag(conf.get(OFFLINE_CONF_KEY, None)) if conf is not None else None
+        if conf_value is not None:
+            return conf_value
+        return self.offline
+
+    def _cached_reachability(self, key):
+        if not self.can_load_ttl:
+            return None
+        with self._reachability_lock:
+            entry = self._reachability_cache().get(key)
+        if entry is None:
+            return None
+        reachable, checked_at = entry
+        if time.time() - checked_at > self.can_load_ttl:
+            return None
+        return reachable
+
+    def _cache_reachability(self, key, reachable):
+        if not self.can_load_ttl:
+            return
+        with self._reachability_lock:
+            cache = self._reachability_cache()
+            now = time.time()
+            cache[key] = (reachable, now)
+            for k, (_, checked_at) in list(cache.items()):
+                if now - checked_at > self.can_load_ttl:
+                    del cache[k]
+            if self.base_directory is not None:
+                _write_json(self._reachability_cache_path(),
+                        {'version': _REACHABILITY_CACHE_VERSION, 'entries': cache})
+
+    def _reachability_cache(self):
+        # The in-process cache starts with what's saved in the base directory
+        if self._reachability is None:
+            saved = None
+            if self.base_directory is not None:
+                saved = _read_json(self._reachability_cache_path())
+            if saved is None or saved.get('version') != _REACHABILITY_CACHE_VERSION:
+                self._reachability = dict()
+            else:
+                self._reachability = {k: tuple(v) for k, v in saved['entries'].items()}
+        return self._reachability
+
+    def _reachability_cache_path(self):
+        return p(self.base_directory, 'reachability.json')
+
+    def _manifest_path(self, zenodo_id):
+        return p(self.base_directory, f'{zenodo_id}.manifest.json')
 
     def load(self, data_source):
         try:
@@ -107,40 +340,263 @@ class ZenodoRecordDirLoader(DataSourceDirLoader):
         recorddir = p(self.base_directory, zenodo_id)
         makedirs(recorddir, exist_ok=True)
 
-        zenodo_base_url_prop = getattr(data_source, 'zenodo_base_url', None)
-        if zenodo_base_url_prop is not None:
-            zenodo_base_url = zenodo_base_url_prop()
-        else:
-            zenodo_base_url = None
-        zenodo_base_url = zenodo_base_url or _ZENODO_BASE_URL
-        # May re-evaluate this for resilence  -- as it is, we could fail part-way
-        # through and have to redo everything
+        zenodo_base_url = _base_url(data_source)
+        # Files in the manifest were verified against the checksum listed in the record
+        # when they were downloaded, so they aren't read again unless they've changed
+        manifest_path = self._manifest_path(zenodo_id)
+        manifest = _read_manifest(manifest_path)
+        if self._offline(data_source):
+            return self._load_offline(data_source, zenodo_id, file_name, recorddir,
+                    manifest)
+
+        record_files = None
         if file_name:
             files = [file_name]
         else:
-            # Yeah, I know they have an API. Don't care.
-            session = self._session_provider()
-            files = list(list_record_files(zenodo_id, zenodo_base_url=zenodo_base_url, session=session))
+            record_files = self._record_files(data_source, zenodo_id, zenodo_base_url)
+            files = list(record_files)
             if not files:
                 raise LoadFailed(data_source, self, 'Could not find any files')
+            if manifest.get('listing') != files:
+                manifest['listing'] = files
+                _write_manifest(manifest_path, manifest)
 
+        pending = []
         for file_name in files:
-            dest_file_name = p(recorddir, file_name)
-            if isfile(dest_file_name):
-                # TODO: check the hash of the file is the one we expect
-                pass
-            else:
-                with self._download_from_zenodo(zenodo_id, file_name, zenodo_base_url) as response:
-                    if response.status_code != 200:
-                        raise LoadFailed(data_source, self, f'Missing file {file_name}')
-                    with open(dest_file_name, 'wb') as dest_file:
-                        # Zenodo seems to assign a distinct record ID for each version of a
-                        # record, so we shouldn't have to worry about conflicts here
-                        shutil.copyfileobj(response.raw, dest_file)
+            if not _is_current(p(recorddir, file_name), manifest['files'].get(file_name)):
+                pending.append(file_name)
+        if not pending:
+            return recorddir
+
+        if record_files is None:
+            record_files = self._record_files(data_source, zenodo_id, zenodo_base_url)
+
+        def load_file(file_name):
+            record_file = record_files.get(file_name) or RecordFile(file_name)
+            return self._load_file(zenodo_id, record_file, zenodo_base_url,
+                    p(recorddir, file_name))
+
+        failures = dict()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+            futures = [(file_name, executor.submit(load_file, file_name))
+                       for file_name in pending]
+            # The manifest is only written from this thread
+            for file_name, future in futures:
+                try:
+                    manifest_entry = future.result()
+                except Exception as e:
+                    failures[file_name] = e
+                    continue
+                if manifest_entry is not None:
+                    manifest['files'][file_name] = manifest_entry
+                    _write_manifest(manifest_path, manifest)
+
+        if failures:
+            first_failure = next(iter(failures.values()))
+            if len(files) == 1:
+                raise LoadFailed(data_source, self, str(first_failure)) from first_failure
+            succeeded = [f for f in files if f not in failures]
+            failure_descriptions = '; '.join(f'{f}: {e}' for f, e in failures.items())
+            raise LoadFailed(data_source, self, f'Failed to load {len(failures)} of'
+                    f' {len(files)} files ({failure_descriptions}). Loaded:'
+                    f' {", ".join(succeeded) or "none"}') from first_failure
+        return recorddir
+
+    def _load_offline(self, data_source, zenodo_id, file_name, recorddir, manifest):
+        if file_name:
+            files = [file_name]
+        else:
+            files = manifest.get('listing')
+            if not files:
+                cataloged = self._catalog_record_files(data_source, zenodo_id,
+                        _base_url(data_source))
+                files = cataloged and [f.name for f in cataloged]
+            if not files:
+                raise LoadFailed(data_source, self, f'Offline, and the files in Zenodo'
+                        f' record {zenodo_id} have not been listed before. Load the record'
+                        f' with network access first')
+        missing = [f for f in files if not isfile(p(recorddir, f))]
+        if missing:
+            raise LoadFailed(data_source, self, f'Offline, and {", ".join(missing)} from'
+                    f' Zenodo record {zenodo_id} has not been downloaded to {recorddir}.'
+                    f' Load it with network access first')
+        for f in files:
+            path = p(recorddir, f)
+            entry = manifest['files'].get(f)
+            if entry is None or _is_current(path, entry):
+                continue
+            # Changed since it was verified. We can still check it against the checksum
+            # from then
+            if _hash_file(path, _checksum_algorithm(entry['checksum'])) != entry['checksum']:
+                raise LoadFailed(data_source, self, f'Offline, and {path} no longer'
+                        f' matches its checksum, {entry["checksum"]}')
         return recorddir
 
+    def _load_file(self, zenodo_id, record_file, base_url, dest_file_name):
+        '''
+        Make sure `dest_file_name` has the contents of the file from Zenodo, downloading
+        it if necessary. Returns the manifest entry for the file or `None` if it couldn't
+        be verified
+        '''
+        file_name, size, checksum, _ = record_file
+        if checksum is None:
+            L.warning('No checksum listed for %s in Zenodo record %s. The file will'
+                    ' not be verified', file_name, zenodo_id)
+
+        if isfile(dest_file_name):
+            if checksum is None and size is None:
+                return None
+            if size is not None and os.stat(dest_file_name).st_size != size:
+                L.warning('%s is not the expected size, %d bytes. Downloading it again',
+                        dest_file_name, size)
+            elif checksum is None:
+                return None
+            else:
+                L.info('Verifying checksum of %s', dest_file_name)
+                if _hash_file(dest_file_name, _checksum_algorithm(checksum)) == checksum:
+                    return _manifest_entry(dest_file_name, checksum)
+                L.warning('%s does not match the expected checksum, %s. Downloading it'
+                        ' again', dest_file_name, checksum)
+
+        part_file_name, actual_checksum = self._fetch(zenodo_id, record_file, base_url,
+                dest_file_name)
+        actual_size = os.stat(part_file_name).st_size
+        if size is not None and actual_size != size:
+            _discard_part(part_file_name)
+            raise _DownloadFailed(f'Downloaded file {file_name} has {actual_size}'
+                    f' bytes. Expected {size}')
+        if actual_checksum != checksum:
+            _discard_part(part_file_name)
+            raise _DownloadFailed(f'Downloaded file {file_name}'
+                    f' has checksum {actual_checksum}. Expected {checksum}')
+        # Zenodo seems to assign a distinct record ID for each version of a
+        # record, so we shouldn't have to worry about conflicts here
+        os.replace(part_file_name, dest_file_name)
+        os.unlink(_journal_file_name(part_file_name))
+        if checksum is None:
+            return None
+        return _manifest_entry(dest_file_name, checksum)
+
+    def _record_files(self, data_source, zenodo_id, zenodo_base_url):
+        cataloged = self._catalog_record_files(data_source, zenodo_id, zenodo_base_url)
+        if cataloged is not None:
+            return {f.name: f for f in cataloged}
+        session = self._session_provider()
+        return {f.name: f for f in list_record_file_info(zenodo_id, session=session,
+            zenodo_base_url=zenodo_base_url)}
+
+    def _catalog_record_files(self, data_source, zenodo_id, zenodo_base_url):
+        '''
+        Returns the files in the record from the Zenodo catalog, or `None` if there's no
+        catalog or the record isn't in it. A record with no files in the catalog is
+        treated as not being in it: it may have been cataloged while it was a draft
+        '''
+        # Imported here since zenodo_catalog imports from this module
+        from .zenodo_catalog import ZenodoCatalog, catalog_path
+        conf = getattr(data_source, 'conf', None)
+        path = catalog_path(conf) if conf is not None else None
+        if path is None:
+            return None
+        with ZenodoCatalog(path) as catalog:
+            return catalog.record_files(zenodo_id, zenodo_base_url) or None
+
+    def _fetch(self, zenodo_id, record_file, base_url, dest_file_name):
+        '''
+        Download a file to a ``.part`` file, resuming a previous download if there is one
+
+        A journal next to the ``.part`` file records what it's a download of so that we
+        don't resume with a different file, or a different version of the same file.
+
+        Returns
+        -------
+        str
+            Path to the completed ``.part`` file
+        str
+            The checksum of the file, using the same algorithm as the listed checksum, or
+            `None` if there's no listed checksum
+        '''
+        file_name, expected_size, checksum, url = record_file
+        if url is None:
+            url = _file_url(base_url, zenodo_id, file_name)
+        part_file_name = dest_file_name + '.part'
+        journal_file_name = _journal_file_name(part_file_name)
+        journal = _read_json(journal_file_name)
+        if (journal is None or
+                journal.get('url') != url or
+                journal.get('checksum') != checksum or
+                not isfile(part_file_name)):
+            journal = {'url': url, 'checksum': checksum, 'validator': None}
+            offset = 0
+        else:
+            offset = os.stat(part_file_name).st_size
+            L.info('Resuming download of %s at byte %d', file_name, offset)
+
+        algorithm = _checksum_algorithm(checksum)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self._download_from_zenodo(zenodo_id, file_name, base_url,
+                        offset=offset, validator=journal['validator'],
+                        file_url=url) as response:
+                    if response.status_code == 206:
+                        start, total = _content_range(response)
+                        if start != offset:
+                            raise _IncompleteDownload(f'Requested bytes from {offset},'
+                                    f' but got bytes from {start}', restart=True)
+                    elif response.status_code == 200:
+                        # Either we asked for the whole file or the server is giving us
+                        # the whole thing anyway, maybe because it changed
+                        offset = 0
+                        total = _content_length(response)
+                    elif response.status_code == 416 and offset > 0:
+                        # Range not satisfiable. Whatever we have is no good
+                        raise _IncompleteDownload('Server could not resume the download',
+                                restart=True)
+                    else:
+                        raise _DownloadFailed(f'Missing file {file_name}')
+                    # The total from the response is preferred: the listed size may be
+                    # out of date
+                    if total is None:
+                        total = expected_size
+
+                    journal['validator'] = (response.headers.get('ETag') or
+                                            response.headers.get('Last-Modified'))
+                    _write_json(journal_file_name, journal)
+
+                    with open(part_file_name, 'r+b' if offset else 'wb') as part_file:
+                        part_file.truncate(offset)
+                        digest = algorithm and hashlib.new(algorithm)
+                        if digest and offset:
+                            # Hash state can't be saved with the journal, so we have to
+                            # read what we already have
+                            _copy_hashing(part_file, _NullWriter, digest)
+                        part_file.seek(offset)
+                        # The checksum is computed as the file is written so we don't
+                        # have to read it again
+                        received = offset + _copy_hashing(response.raw, part_file,
+                                digest)
+                if total is not None and received != total:
+                    raise _IncompleteDownload(f'Got {received} of {total} bytes')
+                break
+            except (requests.RequestException,
+                    urllib3.exceptions.HTTPError,
+                    _IncompleteDownload) as e:
+                if getattr(e, 'restart', False) or not isfile(part_file_name):
+                    offset = 0
+                else:
+                    offset = os.stat(part_file_name).st_size
+                if attempt >= self.download_attempts:
+                    raise _DownloadFailed(f'Failed to download {file_name}'
+                            f' after {attempt} attempts: {e}') from e
+                L.warning('Download of %s failed. Resuming at byte %d', file_name, offset,
+                        exc_info=True)
+                time.sleep(self.backoff_factor * 2 ** (attempt - 1))
+        return part_file_name, digest and f'{algorithm}:{digest.hexdigest()}'
+
     @contextmanager
-    def _download_from_zenodo(self, zenodo_id, file_name, base_url):
+    def _download_from_zenodo(self, zenodo_id, file_name, base_url, offset=0,
+            validator=None, file_url=None):
         '''
         Download a file from zenodo.
 
@@ -154,12 +610,120 @@ class ZenodoRecordDirLoader(DataSourceDirLoader):
             The file name for
         base_url : str
             The base zenodo URL
+        offset : int, optional
+            Byte offset to start the download from. If non-zero, the response status should
+            be 206 (Partial Content) if the server is able to resume the download
+        validator : str, optional
+            ETag or Last-Modified date from an earlier response for the same file. If
+            given, the server should send the whole file, rather than just the part from
+            `offset`, if the file has changed
+        file_url : str, optional
+            URL to download the file from, like the download link from the record
+            metadata. By default, the URL is made from the other arguments
         '''
-        file_url = _file_url(base_url, zenodo_id, file_name)
+        if file_url is None:
+            file_url = _file_url(base_url, zenodo_id, file_name)
+        headers = dict()
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if validator:
+                headers['If-Range'] = validator
         session = self._session_provider()
-        with session.get(file_url, stream=True) as response:
+        with self._host_slot(file_url), \
+                session.get(file_url, stream=True, headers=headers) as response:
             yield response
 
+    @contextmanager
+    def _host_slot(self, url):
+        '''
+        Waits until there are fewer than `max_connections_per_host` downloads from the
+        host for `url`
+        '''
+        host = urlsplit(url).netloc
+        with self._host_semaphores_lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_connections_per_host)
+                self._host_semaphores[host] = semaphore
+        with semaphore:
+            yield
+
+
+class _DownloadFailed(Exception):
+    pass
+
+
+class _IncompleteDownload(Exception):
+    def __init__(self, message, restart=False):
+        super().__init__(message)
+        self.restart = restart
+
+
+def _base_url(data_source):
+    # zenodo_base_url is entirely optional
+    zenodo_base_url_prop = getattr(data_source, 'zenodo_base_url', None)
+    if zenodo_base_url_prop is not None:
+        zenodo_base_url = zenodo_base_url_prop()
+    else:
+        zenodo_base_url = None
+    return zenodo_base_url or _ZENODO_BASE_URL
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ('1', 'true', 'yes', 'on'):
+            return True
+        if value in ('0', 'false', 'no', 'off'):
+            return False
+    return None
+
+
+def _content_range(response):
+    # Like "bytes 100-199/200" or "bytes 100-199/*"
+    md = re.match(r'bytes (\d+)-\d+/(\d+|\*)',
+            response.headers.get('Content-Range', ''))
+    if md is None:
+        raise _IncompleteDownload('Missing or invalid Content-Range for partial content')
+    start, total = md.groups()
+    return int(start), None if total == '*' else int(total)
+
+
+def _content_length(response):
+    length = response.headers.get('Content-Length')
+    return None if length is None else int(length)
+
+
+def _journal_file_name(part_file_name):
+    return part_file_name + '.json'
+
+
+def _discard_part(part_file_name):
+    for path in (part_file_name, _journal_file_name(part_file_name)):
+        if isfile(path):
+            os.unlink(path)
+
+
+class RecordFile(namedtuple('RecordFile', ('name', 'size', 'checksum', 'url'),
+        defaults=(None, None, None))):
+    '''
+    A file in a Zenodo record
+
+    Attributes
+    ----------
+    name : str
+        Name of the file
+    size : int or None
+        Size of the file in bytes, if known
+    checksum : str or None
+        Checksum of the file, like ``md5:<hex digest>``, if known
+    url : str or None
+        URL to download the file from, if known
+    '''
+    __slots__ = ()
+
 
 def list_record_files(zenodo_id, session=None, zenodo_base_url=None):
     '''
@@ -180,10 +744,93 @@ def list_record_files(zenodo_id, session=None, zenodo_base_url=None):
     str
         File names of records
     '''
+    for record_file in list_record_file_info(zenodo_id, session=session,
+            zenodo_base_url=zenodo_base_url):
+        yield record_file.name
+
+
+def list_record_file_info(zenodo_id, session=None, zenodo_base_url=None):
+    '''
+    List files in a Zenodo record with their sizes, checksums, and download links
+
+    The record's metadata is retrieved from the Zenodo REST API. If that fails, the
+    files are listed from the record's web page, which only gives file names and
+    checksums.
+
+    Parameters
+    ----------
+    zenodo_id : int
+        Zenodo record ID for which files should be listed
+    session : requests.Session, optional
+        The session to use for requests to Zenodo. Creates a default `requests.Session` if
+        not provided.
+    zenodo_base_url : str, optional
+        The base URL for zenodo. Uses the common Zenodo URL if not provided
+
+    Yields
+    ------
+    RecordFile
+        Files in the record
+    '''
     if session is None:
         session = requests.Session()
     if zenodo_base_url is None:
         zenodo_base_url = _ZENODO_BASE_URL
+    record_files = _api_record_files(zenodo_id, session, zenodo_base_url)
+    if record_files is None:
+        L.debug('Could not list files in Zenodo record %s with the API. Listing them from'
+                ' the record page instead', zenodo_id)
+        record_files = _html_record_files(zenodo_id, session, zenodo_base_url)
+    yield from record_files
+
+
+def _api_record_files(zenodo_id, session, zenodo_base_url):
+    '''
+    Returns a list of `RecordFile` from the record JSON or `None` if the record can't be
+    retrieved or doesn't look like we expect
+    '''
+    try:
+        with session.get(_api_record_url(zenodo_base_url, zenodo_id),
+                headers={'Accept': 'application/json'}) as response:
+            if response.status_code != 200:
+                return None
+            record = response.json()
+    except (requests.RequestException, ValueError):
+        L.debug('Failed to get record %s from the Zenodo API', zenodo_id, exc_info=True)
+        return None
+
+    return _parse_record_files(record)
+
+
+def _parse_record_files(record):
+    '''
+    Returns a list of `RecordFile` from Zenodo API record JSON or `None` if it doesn't
+    have a list of files
+    '''
+    files = record.get('files') if isinstance(record, dict) else None
+    if isinstance(files, dict):
+        # Newer records may have files as a mapping under "entries"
+        files = files.get('entries')
+        if isinstance(files, dict):
+            files = list(files.values())
+    if not isinstance(files, list):
+        return None
+
+    res = []
+    for file_info in files:
+        name = file_info.get('key') or file_info.get('filename')
+        if not name:
+            continue
+        size = file_info.get('size', file_info.get('filesize'))
+        links = file_info.get('links') or dict()
+        res.append(RecordFile(name,
+            size if isinstance(size, int) else None,
+            _normalize_checksum(file_info.get('checksum')),
+            links.get('content') or links.get('self') or links.get('download')))
+    return res
+
+
+def _html_record_files(zenodo_id, session, zenodo_base_url):
     with session.get(_record_url(zenodo_base_url, zenodo_id), stream=True) as response:
         soup = BeautifulSoup(response.content, 'html.parser')
         re_safe_id = re.escape(str(zenodo_id))
@@ -194,15 +841,121 @@ def list_record_files(zenodo_id, session=None, zenodo_base_url=None):
         for elem in link_elems:
             md = file_ref_re.match(elem['href'])
             if md:
-                yield md.group(1)
+                yield RecordFile(md.group(1), checksum=_listed_checksum(elem))
             else:
                 L.warning('Regular expression does not match twice?? I guess BeautifulSoup4 is broken.')
 
 
+def _listed_checksum(link_elem):
+    # The checksum is in a <small> element following the file link, like
+    # "md5:f9057f352e15bc597b578a912c913b91"
+    small = link_elem.find_next_sibling('small')
+    if small is None:
+        return None
+    return _normalize_checksum(small.get_text())
+
+
+def _normalize_checksum(text):
+    if not isinstance(text, str):
+        return None
+    md = _CHECKSUM_RE.search(text)
+    if md is None:
+        return None
+    return f'{md.group(1)}:{md.group(2).lower()}'
+
+
+_CHECKSUM_RE = re.compile(r'\b(md5|sha1|sha256|sha512):([0-9a-fA-F]+)\b')
+
+
+def _checksum_algorithm(checksum):
+    if checksum is None:
+        return None
+    return checksum.split(':', 1)[0]
+
+
+def _copy_hashing(src, dest, digest):
+    '''
+    Copy `src` to `dest`, updating `digest`, if given, with what was copied. Returns the
+    number of bytes copied
+    '''
+    count = 0
+    while True:
+        chunk = src.read(_DOWNLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if digest:
+            digest.update(chunk)
+        dest.write(chunk)
+        count += len(chunk)
+    return count
+
+
+def _hash_file(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        _copy_hashing(f, _NullWriter, digest)
+    return f'{algorithm}:{digest.hexdigest()}'
+
+
+class _NullWriter:
+    @staticmethod
+    def write(data):
+        pass
+
+
+def _is_current(path, manifest_entry):
+    return (manifest_entry is not None and isfile(path) and
+            manifest_entry == _manifest_entry(path, manifest_entry['checksum']))
+
+
+def _manifest_entry(path, checksum):
+    stat = os.stat(path)
+    return {'checksum': checksum, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_manifest(path):
+    '''
+    Returns the manifest for a record. It has ``files``, verified files with their
+    checksums, sizes, and modification times, and, if the whole record has been loaded,
+    ``listing``, the names of all files in the record
+    '''
+    manifest = _read_json(path)
+    if manifest is None or manifest.get('version') != _MANIFEST_VERSION:
+        return {'files': dict()}
+    return manifest
+
+
+def _write_manifest(path, manifest):
+    _write_json(path, dict(manifest, version=_MANIFEST_VERSION))
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, value):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+    finally:
+        if isfile(tmp):
+            os.unlink(tmp)
+
+
 def _record_url(base_url, zenodo_id):
     return f'{base_url}/record/{zenodo_id}'
 
 
+def _api_record_url(base_url, zenodo_id):
+    return f'{base_url}/api/records/{zenodo_id}'
+
+
 def _file_url(base_url, zenodo_id, file_name):
     return f'{base_url}/record/{zenodo_id}/files/{file_name}?download=1'
 
@@ -0,0 +1,301 @@
+'''
+A local catalog of Zenodo records and their files.
+
+`sync_catalog` crawls the records in a Zenodo community, like the OpenWorm movement
+database, with the Zenodo REST API and saves their IDs, versions, and files in a SQLite
+database. Looking up the files for a record in the catalog, as `ZenodoCommand.list_files
+<owmeta_movement.command.ZenodoCommand.list_files>` and
+`~owmeta_movement.zenodo.ZenodoRecordDirLoader` do, doesn't need the network.
+'''
+import asyncio
+from collections import namedtuple
+import logging
+from math import ceil
+from os.path import isfile, join as p
+import sqlite3
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .zenodo import (RecordFile, _ZENODO_BASE_URL, _api_record_url,
+                     _parse_record_files)
+
+
+L = logging.getLogger(__name__)
+
+CATALOG_FILE_NAME = 'zenodo_catalog.sqlite'
+'''
+Name of the catalog file in the owmeta project directory
+'''
+
+CATALOG_CONF_KEY = 'owmeta_movement.zenodo.catalog'
+'''
+Configuration key for the path to the catalog. Defaults to `CATALOG_FILE_NAME` in the
+owmeta project directory
+'''
+
+DEFAULT_COMMUNITY = 'open-worm-movement-database'
+'''
+The Zenodo community for the OpenWorm movement database
+'''
+
+_PAGE_SIZE = 25
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    base_url TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    concept_id TEXT,
+    version TEXT,
+    title TEXT,
+    community TEXT,
+    PRIMARY KEY (base_url, record_id)
+);
+CREATE TABLE IF NOT EXISTS files (
+    base_url TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    checksum TEXT,
+    url TEXT,
+    PRIMARY KEY (base_url, record_id, name)
+);
+'''
+
+
+class CatalogRecord(namedtuple('CatalogRecord', ('record_id', 'concept_id', 'version',
+        'title', 'files'))):
+    '''
+    A Zenodo record in the catalog
+
+    Attributes
+    ----------
+    record_id : str
+        The record ID
+    concept_id : str or None
+        ID shared by all versions of the record
+    version : str or None
+        Version of the record, as given by the record's creator
+    title : str or None
+        Title of the record
+    files : list of owmeta_movement.zenodo.RecordFile
+        Files in the record
+    '''
+    __slots__ = ()
+
+
+class ZenodoCatalog:
+    '''
+    A SQLite catalog of Zenodo records and their files
+
+    Can be used as a context manager, closing the database connection on exit.
+    '''
+
+    def __init__(self, path):
+        '''
+        Parameters
+        ----------
+        path : str
+            Path to the SQLite database. Created if it doesn't exist
+        '''
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def record_files(self, zenodo_id, zenodo_base_url=None):
+        '''
+        Files in a record
+
+        Parameters
+        ----------
+        zenodo_id : int or str
+            The record ID
+        zenodo_base_url : str, optional
+            The base URL for zenodo. Uses the common Zenodo URL if not provided
+
+        Returns
+        -------
+        list of owmeta_movement.zenodo.RecordFile or None
+            The files in the record or `None` if the record isn't in the catalog
+        '''
+        base_url = zenodo_base_url or _ZENODO_BASE_URL
+        key = (base_url, str(zenodo_id))
+        if self._conn.execute('SELECT 1 FROM records WHERE base_url = ? AND record_id = ?',
+                key).fetchone() is None:
+            return None
+        return [RecordFile(*row) for row in self._conn.execute(
+            'SELECT name, size, checksum, url FROM files'
+            ' WHERE base_url = ? AND record_id = ? ORDER BY name', key)]
+
+    def records(self, zenodo_base_url=None, community=None):
+        '''
+        Records in the catalog
+
+        Parameters
+        ----------
+        zenodo_base_url : str, optional
+            The base URL for zenodo. Uses the common Zenodo URL if not provided
+        community : str, optional
+            Only list records synced from this community
+
+        Yields
+        ------
+        CatalogRecord
+        '''
+        base_url = zenodo_base_url or _ZENODO_BASE_URL
+        query = ('SELECT record_id, concept_id, version, title FROM records'
+                 ' WHERE base_url = ?')
+        params = [base_url]
+        if community is not None:
+            query += ' AND community = ?'
+            params.append(community)
+        for row in self._conn.execute(query + ' ORDER BY record_id', params).fetchall():
+            yield CatalogRecord(*row, self.record_files(row[0], base_url))
+
+    def save_records(self, records, zenodo_base_url=None, community=None):
+        '''
+        Add records to the catalog, replacing any with the same IDs
+
+        Parameters
+        ----------
+        records : iterable of CatalogRecord
+            The records to save
+        zenodo_base_url : str, optional
+            The base URL for zenodo the records are from. Uses the common Zenodo URL if
+            not provided
+        community : str, optional
+            The community the records are from
+        '''
+        base_url = zenodo_base_url or _ZENODO_BASE_URL
+        with self._conn:
+            for record in records:
+                key = (base_url, str(record.record_id))
+                self._conn.execute('DELETE FROM files WHERE base_url = ? AND record_id = ?',
+                        key)
+                self._conn.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                        key + (record.concept_id, record.version, record.title, community))
+                self._conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                        [key + tuple(f) for f in record.files])
+
+
+def catalog_path(conf):
+    '''
+    The path of the catalog according to the given configuration
+
+    Parameters
+    ----------
+    conf : owmeta_core.configure.Configuration or dict
+        The configuration
+
+    Returns
+    -------
+    str or None
+        Path to the catalog, or `None` if there isn't one
+    '''
+    path = conf.get(CATALOG_CONF_KEY, None)
+    if not isinstance(path, str):
+        owm_directory = conf.get('owm.directory', None)
+        if not isinstance(owm_directory, str):
+            return None
+        path = p(owm_directory, CATALOG_FILE_NAME)
+    return path if isfile(path) else None
+
+
+def sync_catalog(catalog, community=DEFAULT_COMMUNITY, zenodo_base_url=None,
+        concurrency=8, verify=True):
+    '''
+    Crawl the records in a Zenodo community and save them in the catalog
+
+    Pages of community records are requested concurrently, as are the details of any
+    records that don't list their files in the search results.
+
+    Parameters
+    ----------
+    catalog : ZenodoCatalog
+        The catalog to save records in
+    community : str, optional
+        The ID of the community. Defaults to `DEFAULT_COMMUNITY`
+    zenodo_base_url : str, optional
+        The base URL for zenodo. Uses the common Zenodo URL if not provided
+    concurrency : int, optional
+        Maximum number of requests to make at once
+    verify : bool or ssl.SSLContext, optional
+        How to verify TLS certificates. Passed on to `httpx`
+
+    Returns
+    -------
+    list of CatalogRecord
+        The records that were saved
+    '''
+    if httpx is None:
+        raise ImportError('httpx is needed to sync the Zenodo catalog. To install it, you'
+                ' can run:\n    pip install owmeta-movement[catalog]')
+    base_url = zenodo_base_url or _ZENODO_BASE_URL
+    records = asyncio.run(_crawl_community(community, base_url, concurrency, verify))
+    catalog.save_records(records, base_url, community)
+    return records
+
+
+async def _crawl_community(community, base_url, concurrency, verify):
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.AsyncHTTPTransport(retries=3, verify=verify)
+    async with httpx.AsyncClient(transport=transport, follow_redirects=True,
+            headers={'Accept': 'application/json'}) as client:
+
+        async def get_json(url, params=None):
+            async with semaphore:
+                response = await client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+
+        records_url = f'{base_url}/api/communities/{community}/records'
+
+        def get_page(page):
+            return get_json(records_url, params={'page': page, 'size': _PAGE_SIZE})
+
+        first_page = await get_page(1)
+        hits, total = _page_hits(first_page)
+        L.debug('%d records in community %s', total, community)
+        pages = await asyncio.gather(*(get_page(n) for n in
+                                       range(2, ceil(total / _PAGE_SIZE) + 1)))
+        for page in pages:
+            hits += _page_hits(page)[0]
+
+        # Records may move between pages while we're crawling, so there may be
+        # duplicates
+        unique_hits = {str(hit['id']): hit for hit in hits}
+
+        async def catalog_record(hit):
+            files = _parse_record_files(hit)
+            if files is None:
+                files = _parse_record_files(await get_json(
+                    _api_record_url(base_url, hit['id']))) or []
+            metadata = hit.get('metadata') or dict()
+            concept_id = hit.get('conceptrecid')
+            return CatalogRecord(str(hit['id']),
+                    None if concept_id is None else str(concept_id),
+                    metadata.get('version'),
+                    metadata.get('title'),
+                    files)
+
+        return await asyncio.gather(*(catalog_record(hit)
+                                      for hit in unique_hits.values()))
+
+
+def _page_hits(page):
+    hits = page['hits']
+    total = hits.get('total', 0)
+    if isinstance(total, dict):
+        total = total.get('value', 0)
+    return list(hits.get('hits', ())), total
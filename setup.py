@@ -2,6 +2,7 @@ from setuptools import setup
 
 setup(name='owmeta_movement',
     version='0.0.1',
+    python_requires='>=3.7',
     install_requires=[
         'owmeta-core>=0.14.0.dev0',
         'owmeta>=0.12.4.dev0',
@@ -11,7 +12,10 @@ setup(name='owmeta_movement',
         'beautifulsoup4',
         'cachecontrol[filecache]'],
     extras_require={'plot': ['matplotlib'],
-        'tierpsy': ['numpy', 'pandas', 'tables']},
+        'arrays': ['numpy'],
+        'gzip_index': ['indexed_gzip'],
+        'tierpsy': ['numpy', 'pandas', 'tables'],
+        'catalog': ['httpx']},
     package_data={'owmeta_movement': ['wcon_schema*.json']},
     packages=['owmeta_movement'],
     entry_points={
@@ -0,0 +1,231 @@
+import pickle
+
+import pytest
+from BTrees.OOBTree import OOBTree
+from owmeta_core.context import Context
+from owmeta_core.data import Data
+from rdflib.term import Literal
+
+from owmeta_movement import (ArrayLiteral, ChunkedArrayLiteral, DataLiteral, DataRecord,
+                             WormTracks, WCONWormTracksCreator,
+                             WCON_SCHEMA_2020_07, ARRAY_DATATYPE, ARRAY_MAP_DATATYPE)
+
+np = pytest.importorskip('numpy')
+
+
+def test_value_is_array():
+    lit = ArrayLiteral([1.5, 2.5, None])
+    val = lit.toPython()
+    assert isinstance(val, np.ndarray)
+    assert val.dtype == np.float64
+    np.testing.assert_array_equal(val, [1.5, 2.5, np.nan])
+
+
+def test_datatype():
+    assert ArrayLiteral([1.0]).datatype == ARRAY_DATATYPE
+
+
+def test_shape():
+    lit = ArrayLiteral([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    assert lit.toPython().shape == (2, 3)
+
+
+def test_float32():
+    assert ArrayLiteral([1.0, 2.0], float32=True).toPython().dtype == np.float32
+
+
+def test_little_endian_lexical():
+    big = np.array([1.0, 2.0], dtype='>f8')
+    assert str(ArrayLiteral(big)) == str(ArrayLiteral(big.astype('<f8')))
+
+
+def test_pickle_round_trip():
+    lit = ArrayLiteral([[1.0, 2.0], [3.0, 4.0]], float32=True)
+    unpickled = pickle.loads(pickle.dumps(lit))
+    assert type(unpickled) is ArrayLiteral
+    assert unpickled == lit
+    np.testing.assert_array_equal(unpickled.toPython(), lit.toPython())
+
+
+def test_pickle_holds_raw_buffer():
+    '''
+    The pickle should hold the raw buffer rather than a text encoding of it
+    '''
+    lit = ArrayLiteral(np.arange(1000, dtype=np.float64))
+    assert len(pickle.dumps(lit, protocol=3)) < len(str(lit))
+
+
+def test_map():
+    lit = ArrayLiteral({'area': [1, 2], 'speed': [0.5, None]})
+    assert lit.datatype == ARRAY_MAP_DATATYPE
+    val = pickle.loads(pickle.dumps(lit)).toPython()
+    np.testing.assert_array_equal(val['area'], [1, 2])
+    np.testing.assert_array_equal(val['speed'], [0.5, np.nan])
+
+
+def test_ragged_raises():
+    with pytest.raises(ValueError):
+        ArrayLiteral([[1.0, 2.0], [3.0]])
+
+
+def test_orderable_as_btree_keys():
+    tree = OOBTree()
+    lits = [ArrayLiteral([float(i), 2.0]) for i in range(10)]
+    for i, lit in enumerate(lits):
+        tree[lit] = i
+    for i, lit in enumerate(lits):
+        assert tree[pickle.loads(pickle.dumps(lit))] == i
+
+
+@pytest.fixture
+def zodb_data(tmp_path):
+    dat = Data()
+    dat['rdf.source'] = 'zodb'
+    dat['rdf.store_conf'] = str(tmp_path / 'worm.db')
+    dat.init()
+    yield dat
+    dat.closeDatabase()
+
+
+def _save_and_reopen(dat, creator, record):
+    ctx = Context('http://example.org/ctx', conf=dat)
+    tracks = ctx(WormTracks)(ident='http://example.org/tracks')
+    creator.fill_in(tracks, {'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+                             'data': [record]}, context=ctx)
+    with dat['transaction_manager']:
+        ctx.save()
+    dat.closeDatabase()
+    dat.openDatabase()
+    return ctx
+
+
+def _stored_literals(dat):
+    res = dict()
+    for s, p, o in dat['rdf.graph'].triples((None, None, None)):
+        if s.endswith('#data/0') and isinstance(o, Literal):
+            res[p.split('/')[-1]] = o
+    return res
+
+
+@pytest.fixture
+def fill(zodb_data):
+    '''
+    Fills in `WormTracks` with a single record, saves to a ZODB store, and returns the
+    record's stored literals, as Python values, keyed by property name
+    '''
+    def f(creator, record):
+        _save_and_reopen(zodb_data, creator, record)
+        with zodb_data['transaction_manager']:
+            return {k: v.toPython() for k, v in _stored_literals(zodb_data).items()}
+    return f
+
+
+@pytest.fixture
+def record():
+    return {'id': '1',
+            't': [0.0, 0.1],
+            'x': [[1.0, 2.0], [3.0, 4.0]],
+            'y': [[5.0, 6.0], [7.0, 8.0]],
+            '@MWT': {'area': [10, 12]},
+            '@XYZ': {'notes': ['a', 'b']}}
+
+
+def test_creator_array_fields(fill, record):
+    rec = fill(WCONWormTracksCreator(WCON_SCHEMA_2020_07), record)
+    assert isinstance(rec['x'], np.ndarray)
+    assert rec['x'].shape == (2, 2)
+    assert isinstance(rec['t'], np.ndarray)
+
+
+def test_creator_extension_columns(fill, record):
+    rec = fill(WCONWormTracksCreator(WCON_SCHEMA_2020_07), record)
+    np.testing.assert_array_equal(rec['@MWT']['area'], [10, 12])
+
+
+def test_creator_non_numeric_falls_back(fill, record):
+    rec = fill(WCONWormTracksCreator(WCON_SCHEMA_2020_07), record)
+    assert rec['@XYZ'] == {'notes': ['a', 'b']}
+
+
+def test_creator_float32_keeps_time_double(fill, record):
+    rec = fill(WCONWormTracksCreator(WCON_SCHEMA_2020_07, float32=True), record)
+    assert rec['x'].dtype == np.float32
+    assert rec['t'].dtype == np.float64
+
+
+def test_creator_no_array_storage(record):
+    creator = WCONWormTracksCreator(WCON_SCHEMA_2020_07, array_storage=False)
+    ctx = Context('http://example.org/ctx')
+    tracks = ctx(WormTracks)(ident='http://example.org/tracks')
+    creator.fill_in(tracks, {'data': [record]}, context=ctx)
+    assert all(isinstance(o, DataLiteral)
+               for _, _, o in ctx.contents_triples()
+               if isinstance(o, Literal) and o.datatype is not None)
+
+
+def test_chunked_value():
+    lit = ChunkedArrayLiteral(np.arange(10.0), chunk_rows=3)
+    np.testing.assert_array_equal(lit.toPython(), np.arange(10.0))
+
+
+def test_chunked_take_rows():
+    arr = np.arange(20.0).reshape(10, 2)
+    lit = ChunkedArrayLiteral(arr, chunk_rows=3)
+    np.testing.assert_array_equal(lit.take_rows([8, 1, 4]), arr[[8, 1, 4]])
+
+
+def test_chunked_find_rows():
+    lit = ChunkedArrayLiteral([0.0, 0.5, None, 1.5, 2.0, 2.5, 3.0], chunk_rows=2)
+    np.testing.assert_array_equal(lit.find_rows(0.5, 2.0), [1, 3, 4])
+
+
+def test_chunked_find_rows_multidimensional():
+    lit = ChunkedArrayLiteral([[0.0, 1.0], [2.0, 3.0]], chunk_rows=1)
+    with pytest.raises(ValueError):
+        lit.find_rows(0, 1)
+
+
+def test_chunked_pickle_round_trip():
+    lit = ChunkedArrayLiteral(np.arange(10.0), chunk_rows=3)
+    unpickled = pickle.loads(pickle.dumps(lit))
+    assert type(unpickled) is ChunkedArrayLiteral
+    assert unpickled == lit
+    np.testing.assert_array_equal(unpickled.toPython(), np.arange(10.0))
+
+
+@pytest.fixture
+def long_record():
+    n = 100
+    return {'id': '1',
+            't': [i / 10 for i in range(n)],
+            'x': [[float(i), float(i) + 0.5] for i in range(n)],
+            'y': [[float(-i), float(-i) - 0.5] for i in range(n)]}
+
+
+def test_creator_chunks_long_arrays(fill, long_record):
+    rec = fill(WCONWormTracksCreator(WCON_SCHEMA_2020_07, chunk_rows=10), long_record)
+    np.testing.assert_array_equal(rec['x'], long_record['x'])
+
+
+def test_window_loads_only_needed_chunks(zodb_data, long_record):
+    _save_and_reopen(zodb_data, WCONWormTracksCreator(WCON_SCHEMA_2020_07, chunk_rows=10),
+            long_record)
+    with zodb_data['transaction_manager']:
+        chunks = _stored_literals(zodb_data)['x']._packed[3]
+        assert all(c._p_changed is None for c in chunks)
+
+        ctx = Context('http://example.org/ctx', conf=zodb_data).stored
+        rec = ctx(DataRecord)(ident='http://example.org/tracks#data/0')
+        x = rec.window('x', 2.05, 2.55)
+
+        np.testing.assert_array_equal(x, long_record['x'][21:26])
+        assert [i for i, c in enumerate(chunks) if c._p_changed is not None] == [2]
+
+
+def test_window_with_list_fields(zodb_data, long_record):
+    _save_and_reopen(zodb_data, WCONWormTracksCreator(WCON_SCHEMA_2020_07,
+            array_storage=False), long_record)
+    with zodb_data['transaction_manager']:
+        ctx = Context('http://example.org/ctx', conf=zodb_data).stored
+        rec = ctx(DataRecord)(ident='http://example.org/tracks#data/0')
+        assert rec.window('y', 2.05, 2.55) == long_record['y'][21:26]
@@ -1,24 +1,33 @@
+import gzip
+import io
 import json
 import os
 from os.path import join as p, isfile
+import tarfile
 import tempfile
+import zipfile
 
 import pytest
+import transaction
 from owmeta.evidence import Evidence
 from owmeta.document import SourcedFrom, Document
 from owmeta_core.context import Context, IMPORTS_CONTEXT_KEY
+from owmeta_core.data import TRANSACTION_MANAGER_KEY
 from owmeta_core.capable_configurable import CAPABILITY_PROVIDERS_KEY
 from owmeta_core.capabilities import (FilePathProvider,
                                       OutputFilePathProvider,
                                       CacheDirectoryProvider,
                                       TemporaryDirectoryProvider)
 
-from owmeta_movement import WormTracks
+from owmeta_movement import WormTracks, cemee
+from owmeta_movement.batch import TranslateManyError, translate_many
+from owmeta_movement.metadata_index import INDEX_CONF_KEY, MetadataIndex
 from owmeta_movement.wcon_ds import WCONDataSource
 from owmeta_movement.cemee import (CeMEEDataTranslator,
                                    CeMEEWCONDataSource,
                                    CeMEEToWCON202007DataTranslator as _202007DT,
-                                   ZenodoCeMEEWCONDataSource)
+                                   ZenodoCeMEEWCONDataSource,
+                                   fix_up_wcon_stream)
 
 
 @pytest.fixture
@@ -97,6 +106,71 @@ def test_translate_result_has_tracks(cemeedt_result):
     assert len(tracksets) == 1
 
 
+def test_translate_indexes_metadata(context, cemeedt, cemeewdsf, tmp_path):
+    index_path = str(tmp_path / 'index.sqlite')
+    context.conf[INDEX_CONF_KEY] = index_path
+    source = cemeewdsf(zenodo_id=1010101,
+            file_name='test_cemee_file.tar.gz',
+            zenodo_file_name='zenodo_fname',
+            sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+    result = cemeedt(source, output_key='test')
+    tracks = next(result.data_context(WormTracks)().load())
+    with MetadataIndex(index_path) as index:
+        (indexed,) = index.query(lab='EEV')
+    assert indexed.identifier == tracks.identifier
+
+
+@pytest.mark.parametrize('jobs', [None, 1])
+def test_translate_indexes_metadata_without_graph(context, cemeedt, cemeewdsf, tmp_path,
+        monkeypatch, jobs):
+    index_path = str(tmp_path / 'index.sqlite')
+    context.conf[INDEX_CONF_KEY] = index_path
+    source = cemeewdsf(zenodo_id=1010101,
+            file_name='test_cemee_file.tar.gz',
+            zenodo_file_name='zenodo_fname',
+            sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+
+    graph_contexts = []
+    rdf_graph = Context.rdf_graph
+
+    def record_rdf_graph(self):
+        graph_contexts.append(self.identifier)
+        return rdf_graph(self)
+    monkeypatch.setattr(Context, 'rdf_graph', record_rdf_graph)
+    if jobs is None:
+        result = cemeedt(source, output_key='test')
+    else:
+        ((_, result),) = translate_many(context, [source], jobs=jobs)
+    assert result.data_context.identifier not in graph_contexts
+    with MetadataIndex(index_path) as index:
+        (indexed,) = index.query(lab='EEV')
+    assert indexed.timestamp is not None
+
+
+@pytest.mark.parametrize('commit', [True, False])
+def test_translate_indexes_metadata_after_commit(context, cemeedt, cemeewdsf, tmp_path,
+        commit):
+    index_path = str(tmp_path / 'index.sqlite')
+    context.conf[INDEX_CONF_KEY] = index_path
+    transaction_manager = transaction.TransactionManager()
+    context.conf[TRANSACTION_MANAGER_KEY] = transaction_manager
+    source = cemeewdsf(zenodo_id=1010101,
+            file_name='test_cemee_file.tar.gz',
+            zenodo_file_name='zenodo_fname',
+            sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+    try:
+        with transaction_manager:
+            cemeedt(source, output_key='test')
+            with MetadataIndex(index_path) as index:
+                assert list(index.query(lab='EEV')) == []
+            if not commit:
+                raise _Abort()
+    except _Abort:
+        pass
+    with MetadataIndex(index_path) as index:
+        assert len(list(index.query(lab='EEV'))) == (1 if commit else 0)
+
+
 def test_translate_result_no_evidence(cemeedt_result):
     '''
     We do not attach any documents to the result unless they are present on the source
@@ -143,6 +217,64 @@ def test_data_list(cemee_translation_res):
         assert wcon['data'][0]['id'] == '6'
 
 
+def test_translate_compressed(providers, monkeypatch, context, cemeedt, cemeewdsf):
+    monkeypatch.setattr(_202007DT, 'compress_output', True)
+    source = cemeewdsf(file_name='test_cemee_file.tar.gz',
+            zenodo_file_name='zenodo_fname',
+            sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+    res = cemeedt(source, output_key='test')
+    tracks = res.data_context(WormTracks)()
+    assert len(list(tracks.load())) == 1
+    wcon_files = os.listdir(providers[3].output_file_path())
+    assert wcon_files == ['LSJ2_20190705_105444.wcon.gz']
+    with gzip.open(p(providers[3].output_file_path(), wcon_files[0])) as f:
+        assert json.load(f)['data'][0]['id'] == '6'
+
+
+@pytest.fixture
+def cemee_wcon():
+    with tarfile.open(p('tests', 'testdata', 'test_cemee_file.tar.gz')) as tf, \
+            tf.extractfile('LSJ2_20190705_105444.wcon.zip') as zfo, \
+            zipfile.ZipFile(zfo) as zf:
+        return zf.read('LSJ2_20190705_105444.wcon')
+
+
+def fix_up_wcon(wcon_json):
+    '''
+    Fix up the whole of the deserialized CeMEE WCON at once, in place
+    '''
+    cemee._fix_up_header(wcon_json)
+    wcon_json['data'] = cemee._fix_up_data(wcon_json['data'])
+
+
+def test_fix_up_wcon_stream_same_as_fix_up_wcon(cemee_wcon):
+    expected = json.loads(cemee_wcon)
+    fix_up_wcon(expected)
+    out = io.StringIO()
+    items = dict(fix_up_wcon_stream(io.BytesIO(cemee_wcon), out))
+    assert json.loads(out.getvalue()) == expected
+    assert set(items) == set(expected)
+
+
+def test_fix_up_wcon_stream_yields_records(cemee_wcon):
+    out = io.StringIO()
+    for key, value in fix_up_wcon_stream(io.BytesIO(cemee_wcon), out):
+        if key == 'data':
+            assert [r['id'] for r in value] == ['6']
+
+
+def test_fix_up_wcon_stream_single_record():
+    wcon = {'units': {'t': 's', 'x': 'mm', 'y': 'mm', 'food': 'OP50'},
+            'data': {'id': '1', 't': 0.0, 'x': [1.0], 'y': [2.0]}}
+    out = io.StringIO()
+    for _ in fix_up_wcon_stream(io.StringIO(json.dumps(wcon)), out):
+        pass
+    assert json.loads(out.getvalue()) == {
+            'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+            'metadata': {'food': 'OP50'},
+            'data': {'id': '1', 't': 0.0, 'x': [1.0], 'y': [2.0]}}
+
+
 def test_cemeedt_with_evidence(context, cemeedt, cemeewdsf):
     source = cemeewdsf(
             file_name='test_cemee_file.tar.gz',
@@ -155,6 +287,97 @@ def test_cemeedt_with_evidence(context, cemeedt, cemeewdsf):
     assert ref.identifier == doc.identifier
 
 
+def test_wcon_contents_without_caching_zip(cemeewdsf, tmp_path):
+    def read(cache_sample_zips):
+        source = cemeewdsf(file_name='test_cemee_file.tar.gz',
+                zenodo_file_name='zenodo_fname',
+                sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+        source.cache_sample_zips = cache_sample_zips
+        with source.wcon_contents() as wcon:
+            return wcon.read()
+
+    direct = read(False)
+    assert not [f for _, _, files in os.walk(tmp_path / 'cache')
+                for f in files if f.endswith('.zip')]
+    assert direct == read(True)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('cache_sample_zips', [True, False])
+def test_translate_many(context, cemeedt, jobs, cache_sample_zips):
+    sources = [context(ZenodoCeMEEWCONDataSource)(key=f'test{i}',
+                   file_name='test_cemee_file.tar.gz',
+                   zenodo_file_name='zenodo_fname',
+                   sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+               for i in range(3)]
+    for source in sources:
+        source.cache_sample_zips = cache_sample_zips
+    results = dict(translate_many(context, sources, jobs=jobs))
+    assert set(results) == set(sources)
+    for output in results.values():
+        tracks = list(output.data_context(WormTracks)().load())
+        assert len(tracks) == 1
+
+
+def test_translate_many_extracts_in_workers(context, cemeedt, monkeypatch, tmp_path):
+    sources = [context(ZenodoCeMEEWCONDataSource)(key=f'test{i}',
+                   file_name='test_cemee_file.tar.gz',
+                   zenodo_file_name='zenodo_fname',
+                   sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+               for i in range(2)]
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Sample extracted in the calling process')
+    # Only patched in this process, not in the spawned workers
+    monkeypatch.setattr(cemee, 'extract_sample_zip', fail)
+    results = dict(translate_many(context, sources, jobs=2))
+    assert set(results) == set(sources)
+    assert len([f for _, _, files in os.walk(tmp_path / 'cache')
+                for f in files if f.endswith('.zip')]) == 2
+
+
+def test_translate_many_same_as_translate(context, cemeedt, cemeewdsf):
+    source = cemeewdsf(file_name='test_cemee_file.tar.gz',
+            zenodo_file_name='zenodo_fname',
+            sample_zip_file_name='LSJ2_20190705_105444.wcon.zip')
+    expected = cemeedt(source, output_key='test')
+    expected_triples = set(expected.data_context.contents_triples())
+    ((_, output),) = translate_many(context, [source], jobs=1)
+    output_triples = set(output.data_context.contents_triples())
+
+    def relabel(triples, ident):
+        return {tuple(str(t).replace(ident, 'TRACKS') for t in triple)
+                for triple in triples}
+
+    expected_tracks = next(expected.data_context(WormTracks)().load())
+    tracks = next(output.data_context(WormTracks)().load())
+    assert (relabel(output_triples, tracks.identifier) ==
+            relabel(expected_triples, expected_tracks.identifier))
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_translate_many_continues_after_failure(context, cemeedt, jobs):
+    sources = [context(ZenodoCeMEEWCONDataSource)(key=f'test{i}',
+                   file_name='test_cemee_file.tar.gz',
+                   zenodo_file_name='zenodo_fname',
+                   sample_zip_file_name=name)
+               for i, name in enumerate(['LSJ2_20190705_105444.wcon.zip',
+                                         'missing.wcon.zip',
+                                         'LSJ2_20190705_105444.wcon.zip'])]
+    results = {}
+    with pytest.raises(TranslateManyError) as exc_info:
+        for source, output in translate_many(context, sources, jobs=jobs):
+            results[source] = output
+    assert set(results) == {sources[0], sources[2]}
+    assert [source for source, _ in exc_info.value.failures] == [sources[1]]
+    assert str(sources[1].identifier) in str(exc_info.value)
+
+
+def test_translate_many_unsupported_source(context):
+    with pytest.raises(TypeError):
+        list(translate_many(context, [context(Document)(key='nope')]))
+
+
 # TODO: Test with zip file already cached.
 
 
@@ -232,3 +455,7 @@ class _OutFileProvider(OutputFilePathProvider):
 
     def output_file_path(self):
         return self.dir
+
+
+class _Abort(Exception):
+    pass
@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import owmeta_movement
+
+
+def run_python(code, schema_cache=''):
+    env = dict(os.environ)
+    env[owmeta_movement.SCHEMA_CACHE_ENV_VAR] = str(schema_cache)
+    proc = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+            universal_newlines=True, check=True, env=env)
+    return proc.stdout.strip()
+
+
+DESCRIBE_TYPES = '''
+import json
+import owmeta_movement as m
+print(json.dumps(m._map_owm_types(m.WCON_SCHEMA_2020_07,
+        lambda t: [t.__name__, t.__doc__, str(t.rdf_type), str(t.base_data_namespace),
+                   [b.__name__ for b in t.__bases__],
+                   sorted(n for n in vars(t) if not n.startswith('_'))]),
+        sort_keys=True))
+'''
+
+NO_SCHEMA_WALK = '''
+import owmeta_movement as m
+def annotate(self):
+    raise AssertionError('Walked the schema')
+m.WormTracksTypeCreator.annotate = annotate
+'''
+
+
+def test_schema_types_not_created_on_import():
+    assert run_python('import owmeta_movement.command, owmeta_movement as m;'
+                      ' print(m._schema_types_created)') == 'False'
+
+
+def test_schema_types_created_on_access():
+    assert run_python('import owmeta_movement as m; m.DataRecord;'
+                      ' print(m._schema_types_created, m.WormTracks.__name__)') == \
+            'True WormTracks'
+
+
+def test_from_import_schema_type():
+    assert run_python('from owmeta_movement import WCON_SCHEMA_2020_07;'
+                      ' print(WCON_SCHEMA_2020_07["_owm_type"].__name__)') == 'WormTracks'
+
+
+def test_missing_attribute():
+    with pytest.raises(AttributeError, match='NotASchemaType'):
+        owmeta_movement.NotASchemaType
+
+
+def test_dir_includes_schema_types():
+    assert {'WormTracks', 'DataRecord', 'WormTracksMetadata'} <= set(dir(owmeta_movement))
+
+
+def test_schema_types_cached(tmp_path):
+    uncached = run_python(DESCRIBE_TYPES, tmp_path)
+    assert len(os.listdir(tmp_path)) == 1
+    assert run_python(NO_SCHEMA_WALK + DESCRIBE_TYPES, tmp_path) == uncached
+
+
+def test_schema_types_cache_disabled():
+    assert run_python('import owmeta_movement as m;'
+                      ' print(m._schema_cache_file("WormTracks", b""))', '') == 'None'
+
+
+def test_schema_types_cache_invalid(tmp_path):
+    uncached = run_python(DESCRIBE_TYPES, tmp_path)
+    cache_file = tmp_path / os.listdir(tmp_path)[0]
+    cache_file.write_text('{"version": 0}')
+    assert run_python(DESCRIBE_TYPES, tmp_path) == uncached
+    assert json.loads(cache_file.read_text())['version'] != 0
+
+
+def test_schema_types_cache_keyed_by_owmeta_core_version(monkeypatch, tmp_path):
+    monkeypatch.setenv(owmeta_movement.SCHEMA_CACHE_ENV_VAR, str(tmp_path))
+    cache_file = owmeta_movement._schema_cache_file('WormTracks', b'{}')
+    monkeypatch.setattr(owmeta_movement.owmeta_core, '__version__', '0.0.0')
+    assert owmeta_movement._schema_cache_file('WormTracks', b'{}') != cache_file
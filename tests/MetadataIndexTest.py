@@ -0,0 +1,165 @@
+from datetime import datetime, timezone
+
+from owmeta_core.context import Context
+import pytest
+from rdflib.term import URIRef
+
+from owmeta_movement import WormTracks, WCONWormTracksCreator, WCON_SCHEMA_2020_07
+from owmeta_movement.metadata_index import (MetadataIndex, INDEX_CONF_KEY,
+                                            INDEX_FILE_NAME, metadata_graph,
+                                            metadata_index_path, tracks_metadata,
+                                            _timestamp_key)
+
+
+TRACKS = {
+    'http://example.org/tracks0': {'lab': {'name': 'Brown', 'location': 'London'},
+                                   'strain': 'N2',
+                                   'timestamp': '2019-07-05T10:54:44',
+                                   'food': 'OP50'},
+    'http://example.org/tracks1': {'lab': {'name': 'Brown', 'location': 'London'},
+                                   'strain': 'CB4856',
+                                   'timestamp': '2019-12-31T23:30:00-01:00',
+                                   'food': 'OP50'},
+    'http://example.org/tracks2': {'lab': {'name': 'Teotonio'},
+                                   'strain': 'N2',
+                                   'timestamp': '2018-01-01T00:00:00Z',
+                                   'food': 'HB101'},
+    'http://example.org/tracks3': {},
+}
+
+
+def make_tracks(ident, metadata):
+    ctx = Context('http://example.org/ctx')
+    tracks = ctx(WormTracks)(ident=ident)
+    wcon = {'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+            'data': [{'id': '1', 't': [0.0], 'x': [1.0], 'y': [2.0]}]}
+    if metadata:
+        wcon['metadata'] = metadata
+    WCONWormTracksCreator(WCON_SCHEMA_2020_07).fill_in(tracks, wcon, context=ctx)
+    return tracks_metadata(URIRef(ident), ctx.rdf_graph())
+
+
+@pytest.fixture
+def index(tmp_path):
+    with MetadataIndex(str(tmp_path / 'index.sqlite')) as index:
+        for ident, metadata in TRACKS.items():
+            index.add_tracks(URIRef(ident), **make_tracks(ident, metadata))
+        yield index
+
+
+def idents(results):
+    return [str(r.identifier)[-1] for r in results]
+
+
+def test_query_all(index):
+    assert idents(index.query()) == ['0', '1', '2', '3']
+
+
+def test_query_strain(index):
+    assert idents(index.query(strain='N2')) == ['0', '2']
+
+
+def test_query_combined(index):
+    assert idents(index.query(strain='N2', lab='Brown', food='OP50')) == ['0']
+
+
+def test_query_lab_location(index):
+    assert idents(index.query(lab='London')) == ['0', '1']
+
+
+def test_query_timestamp_range(index):
+    # tracks1 is 2020-01-01T00:30:00 in UTC
+    assert idents(index.query(since='2019-01-01', before='2020-01-01')) == ['0']
+    assert idents(index.query(since='2019-01-01')) == ['0', '1']
+    assert idents(index.query(before=datetime(2019, 1, 1, tzinfo=timezone.utc))) == ['2']
+
+
+def test_query_invalid_timestamp(index):
+    with pytest.raises(ValueError, match='last week'):
+        index.query(since='last week')
+
+
+def test_query_paged(index):
+    assert idents(index.query(limit=2, offset=1)) == ['1', '2']
+    assert idents(index.query(offset=3)) == ['3']
+
+
+def test_indexed_values(index):
+    (tracks,) = index.query(strain='CB4856')
+    assert tracks.timestamp == '2019-12-31T23:30:00-01:00'
+    assert tracks.food == 'OP50'
+    assert tracks.lab == URIRef('http://example.org/tracks1#metadata/lab')
+
+
+def test_add_tracks_replaces(index):
+    ident = 'http://example.org/tracks3'
+    index.add_tracks(URIRef(ident), **make_tracks(ident, {'strain': 'N2'}))
+    assert idents(index.query(strain='N2')) == ['0', '2', '3']
+
+
+def test_remove_tracks(index):
+    index.remove_tracks(URIRef('http://example.org/tracks0'))
+    assert idents(index.query(strain='N2')) == ['2']
+
+
+def test_metadata_index_path():
+    assert metadata_index_path({INDEX_CONF_KEY: '/a/b.sqlite'}) == '/a/b.sqlite'
+    assert metadata_index_path({'owm.directory': '/owm'}) == '/owm/' + INDEX_FILE_NAME
+    assert metadata_index_path({}) is None
+
+
+def test_tracks_metadata_from_selected_triples():
+    ident = 'http://example.org/tracks0'
+    ctx = Context('http://example.org/ctx')
+    tracks = ctx(WormTracks)(ident=ident)
+    wcon = {'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+            'metadata': TRACKS[ident],
+            'data': [{'id': '1', 't': [0.0], 'x': [1.0], 'y': [2.0]}]}
+    WCONWormTracksCreator(WCON_SCHEMA_2020_07).fill_in(tracks, wcon, context=ctx)
+    graph = metadata_graph(ctx.contents_triples())
+    assert len(graph) < len(list(ctx.contents_triples()))
+    assert tracks_metadata(URIRef(ident), graph) == {
+            'lab': 'http://example.org/tracks0#metadata/lab',
+            'lab_name': 'Brown',
+            'lab_location': 'London',
+            'strain': 'N2',
+            'timestamp': '2019-07-05T10:54:44',
+            'food': 'OP50'}
+
+
+@pytest.mark.parametrize('timestamp,key', [
+    ('2019-07-05T10:54:44.5Z', '2019-07-05T10:54:44.500000'),
+    ('2019-07-05T10:54:44.12345+01:00', '2019-07-05T09:54:44.123450'),
+    ('2019-07-05T10:54:44,1234567', '2019-07-05T10:54:44.123456'),
+    ('20190705T105444Z', '2019-07-05T10:54:44'),
+    ('2019-07-05 10:54', '2019-07-05T10:54:00'),
+    ('2019-W27-5', '2019-07-05T00:00:00'),
+    ('2019W275T1054-0130', '2019-07-05T12:24:00'),
+    ('2019-186', '2019-07-05T00:00:00'),
+    ('2019-07', '2019-07-01T00:00:00'),
+    ('2019-07-05T24:00', '2019-07-06T00:00:00'),
+])
+def test_timestamp_key(timestamp, key):
+    assert _timestamp_key(timestamp) == key
+
+
+@pytest.mark.parametrize('timestamp', ['last week', '2019-13-01', '2019-07-05T25:00',
+                                       '2019-07-05T24:30', '2019-366', '2019-W53',
+                                       '2019-07-05T10:54+25'])
+def test_timestamp_key_invalid(timestamp):
+    assert _timestamp_key(timestamp) is None
+
+
+def test_add_tracks_fractional_second_timestamp(index):
+    ident = 'http://example.org/tracks4'
+    index.add_tracks(URIRef(ident),
+            **make_tracks(ident, {'timestamp': '2019-07-05T10:54:44.5Z'}))
+    assert idents(index.query(since='2019-07-05T10:54:44.25Z',
+                              before='2019-07-05T10:54:45')) == ['4']
+
+
+def test_add_tracks_unparseable_timestamp_logged(index, caplog):
+    index.add_tracks(URIRef('http://example.org/tracks4'), timestamp='yesterday')
+    assert 'yesterday' in caplog.text
+    (tracks,) = index.query(offset=4)
+    assert tracks.timestamp == 'yesterday'
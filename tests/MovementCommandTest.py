@@ -0,0 +1,113 @@
+from contextlib import nullcontext
+from unittest.mock import Mock
+
+from owmeta_core.command_util import GenericUserError
+from owmeta_core.context import Context
+import pytest
+from rdflib.graph import ConjunctiveGraph
+from rdflib.term import URIRef
+
+from owmeta_movement import WormTracks, WCONWormTracksCreator, WCON_SCHEMA_2020_07
+from owmeta_movement.command import MovementCommand
+
+
+def wcon(i):
+    return {
+        'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+        'metadata': {'lab': {'location': f'Lab {i}'},
+                     'strain': f'N{i}',
+                     'timestamp': '2019-07-05T10:54:44',
+                     'food': 'OP50'},
+        'data': [{'id': '1', 't': [0.0], 'x': [1.0], 'y': [2.0]}],
+    }
+
+
+@pytest.fixture
+def command(tmp_path):
+    graph = ConjunctiveGraph()
+    for i in range(5):
+        ctx = Context(f'http://example.org/ctx{i}')
+        tracks = ctx(WormTracks)(ident=f'http://example.org/tracks{i}')
+        WCONWormTracksCreator(WCON_SCHEMA_2020_07).fill_in(tracks, wcon(i), context=ctx)
+        for triple in ctx.contents_triples():
+            graph.get_context(ctx.identifier).add(triple)
+    # One without metadata
+    graph.add((URIRef('http://example.org/tracks5'), WormTracks.rdf_type_property.link,
+               WormTracks.rdf_type))
+
+    owm = Mock()
+    owm.connect.return_value = nullcontext()
+    owm.default_context.stored.rdf_graph.return_value = graph
+    owm.default_context.conf = {'owm.directory': str(tmp_path)}
+    return MovementCommand(owm)
+
+
+def test_list_tracks(command):
+    rows = list(command.list_tracks())
+    assert [r.identifier for r in rows] == [URIRef(f'http://example.org/tracks{i}')
+                                            for i in range(6)]
+    assert rows[2].strain == 'N2'
+    assert rows[2].food == 'OP50'
+    assert rows[2].timestamp == '2019-07-05T10:54:44'
+    assert isinstance(rows[2].lab, URIRef)
+    assert rows[5].strain is None
+
+
+def test_list_tracks_paged(command):
+    rows = list(command.list_tracks(limit=2, offset=3))
+    assert [r.identifier for r in rows] == [URIRef('http://example.org/tracks3'),
+                                            URIRef('http://example.org/tracks4')]
+
+
+def test_list_tracks_offset_only(command):
+    rows = list(command.list_tracks(offset=4))
+    assert [r.identifier for r in rows] == [URIRef('http://example.org/tracks4'),
+                                            URIRef('http://example.org/tracks5')]
+    assert rows[0].strain == 'N4'
+
+
+def test_list_tracks_one_query(command):
+    list(command.list_tracks())
+    graph = command._owm.default_context.stored.rdf_graph
+    assert graph.call_count == 1
+
+
+def test_list_tracks_invalid_limit(command):
+    with pytest.raises(GenericUserError, match='limit'):
+        command.list_tracks(limit=-1)
+
+
+def test_list_tracks_filtered_without_index(command):
+    with pytest.raises(GenericUserError, match='index-tracks'):
+        list(command.list_tracks(strain='N2'))
+
+
+def test_index_tracks_and_filter(command):
+    assert len(list(command.index_tracks())) == 6
+    rows = list(command.list_tracks(strain='N3'))
+    assert [r.identifier for r in rows] == [URIRef('http://example.org/tracks3')]
+    assert rows[0].food == 'OP50'
+
+
+def test_list_tracks_filter_by_lab_and_time(command):
+    list(command.index_tracks())
+    rows = list(command.list_tracks(lab='Lab 1', since='2019-01-01',
+                                    before='2020-01-01'))
+    assert [r.identifier for r in rows] == [URIRef('http://example.org/tracks1')]
+    assert list(command.list_tracks(lab='Lab 1', since='2020-01-01')) == []
+
+
+def test_list_tracks_filter_invalid_timestamp(command):
+    list(command.index_tracks())
+    with pytest.raises(GenericUserError, match='Invalid timestamp'):
+        list(command.list_tracks(since='yesterday'))
+
+
+def test_render_invalid_format(command):
+    with pytest.raises(GenericUserError, match='gif'):
+        command.render(format='gif')
+
+
+def test_render_tracks_and_filters(command):
+    with pytest.raises(GenericUserError, match='not both'):
+        command.render(tracks=['http://example.org/tracks1'], strain='N1')
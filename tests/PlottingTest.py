@@ -0,0 +1,163 @@
+from unittest.mock import Mock
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+
+from owmeta_movement.plotting import lttb, RecordPlotter
+
+
+def record(x, y, px=None, py=None):
+    return Mock(**{'x.return_value': x, 'y.return_value': y,
+                   'px.return_value': px, 'py.return_value': py})
+
+
+def axes(width=100):
+    ax = Mock()
+    ax.get_window_extent.return_value.width = width
+    return ax
+
+
+def test_lttb_keeps_short_lines():
+    x, y = lttb([0, 1, 2], [3, 4, 5], 10)
+    assert list(x) == [0, 1, 2]
+    assert list(y) == [3, 4, 5]
+
+
+def test_lttb_keeps_end_points():
+    x = np.arange(1000)
+    y = np.sin(x / 50)
+    dx, dy = lttb(x, y, 50)
+    assert len(dx) == 50
+    assert dx[0] == 0 and dx[-1] == 999
+    assert np.all(np.diff(dx) > 0)
+
+
+def test_lttb_keeps_spike():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[437] = 10
+    dx, dy = lttb(x, y, 20)
+    assert 437 in dx
+    assert dy.max() == 10
+
+
+def test_lttb_drops_nan():
+    x = np.arange(10, dtype=float)
+    y = np.arange(10, dtype=float)
+    y[3] = np.nan
+    dx, dy = lttb(x, y, 20)
+    assert 3 not in dx
+    assert len(dx) == 9
+
+
+def test_lttb_too_few_points():
+    with pytest.raises(ValueError):
+        lttb([0, 1], [0, 1], 2)
+
+
+def test_plot_path_limited_by_axes_width():
+    ax = axes(width=100)
+    plotter = RecordPlotter(ax)
+    n = plotter.plot(record(list(range(10000)), [0.0] * 10000))
+    assert n == 200
+    (x, y), _ = ax.plot.call_args
+    assert len(x) == 200
+
+
+def test_plot_max_points_divided_among_records():
+    ax = axes()
+    plotter = RecordPlotter(ax, max_points=1000, record_count=4)
+    for _ in range(4):
+        plotter.plot(record(np.arange(10000.), np.arange(10000.)))
+    assert plotter.points_drawn == 1000
+
+
+def test_plot_full_resolution():
+    ax = axes(width=10)
+    plotter = RecordPlotter(ax, max_points=10, downsample=False)
+    assert plotter.plot(record(list(range(1000)), list(range(1000)))) == 1000
+
+
+def test_plot_empty_record():
+    ax = axes()
+    assert RecordPlotter(ax).plot(record([], [])) == 0
+    ax.plot.assert_not_called()
+
+
+def test_invalid_max_points():
+    with pytest.raises(ValueError):
+        RecordPlotter(axes(), max_points=0)
+
+
+def test_invalid_frame_stride():
+    with pytest.raises(ValueError):
+        RecordPlotter(axes(), frame_stride=0)
+
+
+@pytest.fixture
+def agg_axes():
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig.add_subplot()
+
+
+def test_plot_skeletons_one_collection(agg_axes):
+    frames = np.random.default_rng(0).random((1000, 10))
+    plotter = RecordPlotter(agg_axes, downsample=False)
+    assert plotter.plot(record(frames, frames + 1)) == 10000
+    assert len(agg_axes.collections) == 1
+    assert len(agg_axes.lines) == 0
+    (segments,) = [c.get_segments() for c in agg_axes.collections]
+    assert len(segments) == 1000
+    assert np.array_equal(segments[3][:, 1], frames[3] + 1)
+    agg_axes.figure.canvas.draw()
+
+
+def test_plot_skeletons_limited(agg_axes):
+    frames = [list(range(10))] * 1000
+    plotter = RecordPlotter(agg_axes, max_points=100)
+    assert plotter.plot(record(frames, frames)) == 100
+    assert len(agg_axes.collections[0].get_segments()) == 10
+
+
+def test_plot_skeletons_frame_stride(agg_axes):
+    frames = np.arange(100.).reshape(10, 10)
+    plotter = RecordPlotter(agg_axes, downsample=False, frame_stride=3)
+    assert plotter.plot(record(frames, frames)) == 40
+    segments = agg_axes.collections[0].get_segments()
+    assert [s[0, 0] for s in segments] == [0, 30, 60, 90]
+
+
+def test_plot_ragged_skeletons(agg_axes):
+    x = [[0, 1, 2], [0, 1], [0, 1, 2, 3]]
+    plotter = RecordPlotter(agg_axes, downsample=False)
+    assert plotter.plot(record(x, x)) == 9
+    segments = agg_axes.collections[0].get_segments()
+    assert [len(s) for s in segments] == [3, 2, 4]
+    agg_axes.figure.canvas.draw()
+
+
+def test_plot_contours_closed(agg_axes):
+    px = [[0, 1, 1, 0]] * 5
+    py = [[0, 0, 1, 1]] * 5
+    plotter = RecordPlotter(agg_axes, downsample=False)
+    assert plotter.plot(record([], [], px, py)) == 25
+    segments = agg_axes.collections[0].get_segments()
+    assert np.array_equal(segments[0][0], segments[0][-1])
+
+
+def test_plot_centroids_and_contours(agg_axes):
+    px = [[0, 1, 1, 0]] * 5
+    plotter = RecordPlotter(agg_axes, downsample=False)
+    plotter.plot(record([0.5] * 5, [0.5] * 5, px, px))
+    assert len(agg_axes.lines) == 1
+    assert len(agg_axes.collections) == 1
+    # Both parts of the record are the same color
+    from matplotlib.colors import to_rgba
+    assert to_rgba(agg_axes.lines[0].get_color()) == \
+        tuple(agg_axes.collections[0].get_colors()[0])
@@ -0,0 +1,141 @@
+import json
+
+from owmeta_core.collections import Seq
+from owmeta_core.context import Context
+from owmeta_core.data import Data
+import pytest
+from rdflib.term import URIRef
+
+from owmeta_movement import (DataRecord, WormTracks, WCONWormTracksCreator,
+                             WCON_SCHEMA_2020_07)
+from owmeta_movement import render
+from owmeta_movement.render import (render_many, output_file_name, RenderOptions,
+                                    MANIFEST_FILE_NAME)
+
+pytest.importorskip('numpy')
+pytest.importorskip('matplotlib')
+
+
+TRACKS = [URIRef(f'http://example.org/tracks{i}') for i in range(3)]
+
+
+@pytest.fixture
+def context():
+    dat = Data()
+    dat.init()
+    ctx = Context('http://example.org/ctx', conf=dat)
+    for i, ident in enumerate(TRACKS):
+        tracks = ctx(WormTracks)(ident=ident)
+        n = 50
+        WCONWormTracksCreator(WCON_SCHEMA_2020_07).fill_in(tracks, {
+            'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+            'data': [{'id': str(j),
+                      't': [f / 10 for f in range(n)],
+                      'x': [[float(f), f + 0.5 * j, f + i] for f in range(n)],
+                      'y': [[float(j), j + 0.5, float(f)] for f in range(n)]}
+                     for j in range(2)]}, context=ctx)
+    with dat['transaction_manager']:
+        ctx.save()
+    stored = Context('http://example.org/ctx', conf=dat).stored
+    # There's no class registry to look up the types of the loaded data, so they're
+    # mapped directly
+    stored.mapper.process_class(Seq, DataRecord)
+    yield stored
+    dat.destroy()
+
+
+def test_render_png(context, tmp_path):
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    assert [r.tracks for r in results] == TRACKS
+    assert all(r.rendered for r in results)
+    for r in results:
+        with open(r.output_path, 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_render_svg(context, tmp_path):
+    (result,) = render_many(context, TRACKS[:1], str(tmp_path),
+            options=RenderOptions(format='svg'), jobs=1)
+    assert result.output_path.endswith('.svg')
+    with open(result.output_path) as f:
+        assert '<svg' in f.read()
+
+
+def test_up_to_date_skipped(context, tmp_path):
+    list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    assert not any(r.rendered for r in results)
+
+
+def test_up_to_date_values_not_loaded(context, tmp_path, monkeypatch):
+    list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+
+    def fail(*args):
+        raise AssertionError('Record values loaded')
+    monkeypatch.setattr(render, '_record_values', fail)
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    assert not any(r.rendered for r in results)
+
+
+def test_records_in_identifier_order(context):
+    record_terms = render._load_record_terms(context, TRACKS[0])
+    idents = [ident for ident, _ in record_terms]
+    assert len(idents) == 2
+    assert idents == sorted(idents)
+
+
+def test_fingerprint_depends_on_record_order(context):
+    record_terms = render._load_record_terms(context, TRACKS[0])
+    options = RenderOptions()
+    assert (render._fingerprint(record_terms, options) !=
+            render._fingerprint(record_terms[::-1], options))
+
+
+def test_force(context, tmp_path):
+    list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1, force=True))
+    assert all(r.rendered for r in results)
+
+
+def test_changed_options_rendered(context, tmp_path):
+    list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1,
+            options=RenderOptions(width=320)))
+    assert all(r.rendered for r in results)
+
+
+def test_missing_output_rendered(context, tmp_path):
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    (tmp_path / output_file_name(TRACKS[1], 'png')).unlink()
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    assert [r.rendered for r in results] == [False, True, False]
+
+
+def test_manifest(context, tmp_path):
+    list(render_many(context, TRACKS, str(tmp_path), jobs=1))
+    with open(tmp_path / MANIFEST_FILE_NAME) as f:
+        manifest = json.load(f)
+    assert set(manifest) == {output_file_name(t, 'png') for t in TRACKS}
+
+
+def test_tracks_without_data_skipped(context, tmp_path):
+    results = list(render_many(context, [URIRef('http://example.org/nothing')] + TRACKS,
+            str(tmp_path), jobs=1))
+    assert [r.tracks for r in results] == TRACKS
+
+
+def test_render_in_workers(context, tmp_path):
+    results = list(render_many(context, TRACKS, str(tmp_path), jobs=2))
+    assert sorted(r.tracks for r in results) == TRACKS
+    assert all(r.rendered for r in results)
+    assert all((tmp_path / output_file_name(t, 'png')).is_file() for t in TRACKS)
+
+
+def test_output_file_name():
+    name = output_file_name(URIRef('http://example.org/a/tracks#abc'), 'png')
+    assert name == 'http%3A%2F%2Fexample.org%2Fa%2Ftracks%23abc.png'
+
+
+def test_invalid_format():
+    with pytest.raises(ValueError, match='gif'):
+        RenderOptions(format='gif')
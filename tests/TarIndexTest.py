@@ -0,0 +1,133 @@
+import io
+import logging
+import os
+import tarfile
+
+import pytest
+
+from owmeta_movement import tar_index
+from owmeta_movement.tar_index import index_archive, open_tar_member
+
+
+MEMBERS = {f'sample{i}.wcon.zip': os.urandom(100000 + i) for i in range(5)}
+
+
+@pytest.fixture(params=['w:gz', 'w'])
+def archive(request, tmp_path):
+    path = tmp_path / 'archive.tar'
+    with tarfile.open(path, request.param) as tf:
+        for name, data in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    return str(tmp_path / 'index')
+
+
+def read_member(archive, name, index_dir):
+    with open_tar_member(archive, name, index_dir) as member:
+        return member.read()
+
+
+def test_read_members(archive, index_dir):
+    for name in reversed(list(MEMBERS)):
+        assert read_member(archive, name, index_dir) == MEMBERS[name]
+
+
+def test_member_is_seekable(archive, index_dir):
+    with open_tar_member(archive, 'sample3.wcon.zip', index_dir) as member:
+        member.seek(-10, io.SEEK_END)
+        assert member.read() == MEMBERS['sample3.wcon.zip'][-10:]
+        member.seek(5)
+        assert member.read(5) == MEMBERS['sample3.wcon.zip'][5:10]
+
+
+def test_index_reused(archive, index_dir, monkeypatch):
+    read_member(archive, 'sample0.wcon.zip', index_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Archive was scanned again')
+    monkeypatch.setattr(tarfile, 'open', fail)
+    assert read_member(archive, 'sample4.wcon.zip', index_dir) == MEMBERS['sample4.wcon.zip']
+
+
+def test_index_archive(archive, index_dir, monkeypatch):
+    index_archive(archive, index_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Archive was scanned again')
+    monkeypatch.setattr(tarfile, 'open', fail)
+    index_archive(archive, index_dir)
+    assert read_member(archive, 'sample1.wcon.zip', index_dir) == MEMBERS['sample1.wcon.zip']
+
+
+def test_gzip_index_written(archive, index_dir):
+    pytest.importorskip('indexed_gzip')
+    read_member(archive, 'sample0.wcon.zip', index_dir)
+    suffixes = {os.path.splitext(f)[1] for f in os.listdir(index_dir)}
+    if archive_is_gzipped(archive):
+        assert suffixes == {'.json', '.gzidx'}
+    else:
+        assert suffixes == {'.json'}
+
+
+def test_index_rebuilt_when_archive_changes(archive, index_dir):
+    read_member(archive, 'sample0.wcon.zip', index_dir)
+    with tarfile.open(archive, 'w:gz') as tf:
+        info = tarfile.TarInfo('other.zip')
+        info.size = 3
+        tf.addfile(info, io.BytesIO(b'abc'))
+    st = os.stat(archive)
+    os.utime(archive, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    assert read_member(archive, 'other.zip', index_dir) == b'abc'
+
+
+def test_missing_member(archive, index_dir):
+    with pytest.raises(KeyError, match='blah.zip'):
+        read_member(archive, 'blah.zip', index_dir)
+
+
+def test_without_indexed_gzip(archive, index_dir, monkeypatch):
+    monkeypatch.setattr(tar_index, 'indexed_gzip', None)
+    assert read_member(archive, 'sample2.wcon.zip', index_dir) == MEMBERS['sample2.wcon.zip']
+
+
+def test_without_indexed_gzip_random_access(archive, index_dir, monkeypatch):
+    if not archive_is_gzipped(archive):
+        pytest.skip('Only gzipped archives are read without restart points')
+    monkeypatch.setattr(tar_index, 'indexed_gzip', None)
+    archives = []
+    open_archive = tar_index._open_archive
+
+    def record_archive(*args):
+        res = open_archive(*args)
+        archives.append(res)
+        return res
+    monkeypatch.setattr(tar_index, '_open_archive', record_archive)
+    with open_tar_member(archive, 'sample2.wcon.zip', index_dir) as member:
+        archive_pos = archives[0].tell()
+        member.seek(0, io.SEEK_END)
+        member.seek(0)
+        assert member.read() == MEMBERS['sample2.wcon.zip']
+        # The member was read from the archive once, up-front
+        assert archives[0].tell() == archive_pos
+
+
+def test_without_indexed_gzip_warns_once(archive, index_dir, monkeypatch, caplog):
+    if not archive_is_gzipped(archive):
+        pytest.skip('Only gzipped archives are read without restart points')
+    monkeypatch.setattr(tar_index, 'indexed_gzip', None)
+    monkeypatch.setattr(tar_index, '_warned_no_gzip_index', set())
+    with caplog.at_level(logging.WARNING, logger=tar_index.__name__):
+        read_member(archive, 'sample2.wcon.zip', index_dir)
+        read_member(archive, 'sample3.wcon.zip', index_dir)
+    assert len([r for r in caplog.records if 'indexed_gzip' in r.getMessage()]) == 1
+
+
+def archive_is_gzipped(archive):
+    with open(archive, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
@@ -0,0 +1,167 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+tables = pytest.importorskip('tables')
+
+from owmeta_movement.tierpsy import export_wcon
+from owmeta_movement.tierpsy.export_wcon import (readData, readMetaData, readUnits,
+                                                  exportWCONdict, _read_rows)
+from owmeta_movement.tierpsy.param_readers import FeaturesFile, read_fps
+
+
+N_POINTS = 5
+
+FPS = 25
+
+
+@pytest.fixture
+def features_file(tmp_path):
+    rng = np.random.default_rng(0)
+    # Worms' rows interleaved, as they are when rows are ordered by frame
+    worm_index = rng.integers(0, 7, 300)
+    timestamp = np.arange(300)
+    path = str(tmp_path / 'features.hdf5')
+    with pd.HDFStore(path, 'w') as store:
+        store.put('features_timeseries',
+                pd.DataFrame({'worm_index': worm_index, 'timestamp': timestamp}),
+                format='table')
+    with tables.File(path, 'a') as fid:
+        for name in ('skeletons', 'dorsal_contours', 'ventral_contours'):
+            fid.create_carray('/coordinates', name,
+                    obj=rng.random((300, N_POINTS, 2)),
+                    chunkshape=(16, N_POINTS, 2),
+                    createparents=True)
+        attrs = fid.get_node('/features_timeseries')._v_attrs
+        attrs['fps'] = FPS
+        attrs['microns_per_pixel'] = 2.5
+        fid.create_array('/', 'experiment_info',
+                obj=json.dumps({'strain': 'N2', 'ventral_side': 'clockwise'}).encode())
+        fid.create_array('/provenance_tracking', 'FEAT_CREATE',
+                obj=json.dumps({'pkgs_versions': {'tierpsy': '1.5'}}).encode(),
+                createparents=True)
+    return path
+
+
+def expected_records(path):
+    '''
+    Each worm's coordinates read with fancy indexing
+    '''
+    with pd.HDFStore(path, 'r') as fid:
+        features_timeseries = fid['/features_timeseries']
+    with tables.File(path, 'r') as fid:
+        skeletons = fid.get_node('/coordinates/skeletons')
+        dorsal = fid.get_node('/coordinates/dorsal_contours')
+        ventral = fid.get_node('/coordinates/ventral_contours')
+        for worm_id, feat in features_timeseries.groupby('worm_index'):
+            contour = np.hstack((ventral[feat.index], dorsal[feat.index][:, ::-1, :]))
+            yield {'id': str(int(worm_id)),
+                   't': feat['timestamp'].values / FPS,
+                   'x': skeletons[feat.index][:, :, 0],
+                   'y': skeletons[feat.index][:, :, 1],
+                   'px': contour[:, :, 0],
+                   'py': contour[:, :, 1]}
+
+
+@pytest.mark.parametrize('block_bytes,batch_rows',
+        [(export_wcon.READ_BLOCK_BYTES, export_wcon.READ_BATCH_ROWS), (1, 1), (1000, 50)])
+def test_read_data(monkeypatch, features_file, block_bytes, batch_rows):
+    monkeypatch.setattr(export_wcon, 'READ_BLOCK_BYTES', block_bytes)
+    monkeypatch.setattr(export_wcon, 'READ_BATCH_ROWS', batch_rows)
+    records = list(readData(features_file, IS_FOR_WCON=False))
+    expected = list(expected_records(features_file))
+    assert [r['id'] for r in records] == [e['id'] for e in expected]
+    for record, exp in zip(records, expected):
+        assert record['ptail'] == N_POINTS - 1
+        for k in ('t', 'x', 'y', 'px', 'py'):
+            np.testing.assert_array_equal(record[k], exp[k])
+
+
+def test_read_data_views(features_file):
+    '''
+    Each worm's coordinates are views of arrays shared with other worms rather than
+    copies
+    '''
+    records = list(readData(features_file, IS_FOR_WCON=False))
+    assert all(r['x'].base is not None for r in records)
+    assert records[0]['x'].base is records[1]['x'].base
+
+
+def test_read_data_for_wcon(features_file):
+    record = next(readData(features_file))
+    assert isinstance(record['x'], list)
+    assert len(record['px'][0]) == 2 * N_POINTS
+
+
+def test_read_rows_any_order(features_file):
+    rows = np.array([250, 3, 3, 17, 0, 299])
+    with tables.File(features_file, 'r') as fid:
+        skeletons = fid.get_node('/coordinates/skeletons')
+        np.testing.assert_array_equal(_read_rows(skeletons, rows, block_size=1),
+                                      skeletons[:][rows])
+
+
+def test_read_rows_out_of_range(features_file):
+    with tables.File(features_file, 'r') as fid:
+        with pytest.raises(IndexError):
+            _read_rows(fid.get_node('/coordinates/skeletons'), np.array([1, 300]))
+
+
+@pytest.fixture
+def count_opens(monkeypatch):
+    opens = []
+    init = tables.File.__init__
+
+    def counting_init(self, filename, *args, **kwargs):
+        opens.append(filename)
+        init(self, filename, *args, **kwargs)
+
+    monkeypatch.setattr(tables.File, '__init__', counting_init)
+    return opens
+
+
+def test_features_file_opened_once(features_file, count_opens):
+    with FeaturesFile(features_file) as features:
+        metadata = readMetaData(features)
+        units = readUnits(features)
+        records = list(readData(features))
+        fps = read_fps(features)
+    assert len(count_opens) == 1
+    assert metadata['strain'] == 'N2'
+    assert units['t'] == 'seconds'
+    assert records[0]['ventral'] == 'CW'
+    assert fps == FPS
+
+
+def test_export_wcon_dict_opens_file_once(features_file, count_opens):
+    wcon = exportWCONdict(features_file)
+    assert len(count_opens) == 1
+    assert list(wcon) == ['metadata', 'units', 'data']
+    assert wcon['metadata']['strain'] == 'N2'
+    assert wcon['units']['t'] == 'seconds'
+    assert len(wcon['data']) == 7
+
+
+def test_features_file_caches_attributes(features_file):
+    with FeaturesFile(features_file) as features:
+        assert features.fps == FPS
+        assert features.microns_per_pixel == 2.5
+        assert features.ventral_side == 'clockwise'
+    # Closed, so these can only come from the cache
+    assert features.get_fps() == (FPS, 1.0, 'seconds')
+    assert features.get_microns_per_pixel()[0] == 2.5
+    assert features.ventral_side == 'clockwise'
+
+
+def test_features_file_missing_node(features_file):
+    with FeaturesFile(features_file) as features:
+        assert '/nothing' not in features
+        with pytest.raises(tables.NoSuchNodeError):
+            features.get_node('/nothing')
+
+
+def test_read_with_file_name(features_file):
+    assert readMetaData(features_file)['software']['version'] == '1.5'
+    assert readUnits(features_file)['t'] == 'seconds'
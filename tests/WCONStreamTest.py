@@ -0,0 +1,130 @@
+import gzip
+import io
+import json
+
+import pytest
+from owmeta_core.context import Context
+
+from owmeta_movement import WormTracks, WCONWormTracksCreator_2020_07
+from owmeta_movement.wcon_stream import ObjectItems, wcon_items
+
+
+WCON = {
+    'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+    'metadata': {'lab': {'name': 'EEV'}},
+    'data': [
+        {'id': '1', 't': [0.0, 0.1, 0.2], 'x': [1.5, 2.25, 3.125], 'y': [4, 5, 6]},
+        {'id': '2', 't': [1.0], 'x': [[0.5, 1.5]], 'y': [[2.5, 3.5]]},
+    ],
+}
+
+
+def _materialize(items):
+    return {k: (v if isinstance(v, (dict, list, str, int, float)) else list(v))
+            for k, v in items}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_items_match_json_load(chunk_size):
+    wcon = io.StringIO(json.dumps(WCON, indent=2))
+    assert _materialize(wcon_items(wcon, chunk_size=chunk_size)) == WCON
+
+
+def test_binary_input():
+    wcon = io.BytesIO(json.dumps(WCON).encode('utf-8'))
+    assert _materialize(wcon_items(wcon, chunk_size=5)) == WCON
+
+
+def test_gzip_input():
+    wcon = io.BytesIO(gzip.compress(json.dumps(WCON).encode('utf-8')))
+    assert _materialize(wcon_items(wcon, chunk_size=5)) == WCON
+
+
+def test_data_object_items():
+    data = {'6': {'id': 6, 'x': [[1.0]]}, '7': {'id': 7, 'x': [[2.0]]}}
+    wcon = io.StringIO(json.dumps({'data': data, 'units': {}}))
+    items = list((k, v if isinstance(v, dict) else dict(v))
+                 for k, v in wcon_items(wcon, chunk_size=4, data_object_items=True))
+    assert items == [('data', data), ('units', {})]
+
+
+def test_data_object_items_lazy():
+    wcon = io.StringIO(json.dumps({'data': {'6': {}}}))
+    for key, value in wcon_items(wcon, data_object_items=True):
+        assert isinstance(value, ObjectItems)
+
+
+def test_data_is_lazy():
+    wcon = io.StringIO(json.dumps(WCON))
+    for key, value in wcon_items(wcon):
+        if key == 'data':
+            assert not isinstance(value, list)
+
+
+def test_number_split_across_chunks():
+    wcon = io.StringIO('{"data": [123456789], "units": {}}')
+    assert _materialize(wcon_items(wcon, chunk_size=12)) == {'data': [123456789],
+                                                             'units': {}}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 6, 12])
+def test_float_split_across_chunks(chunk_size):
+    wcon = io.StringIO('{"data": [1.5, 2]}')
+    assert _materialize(wcon_items(wcon, chunk_size=chunk_size)) == {'data': [1.5, 2]}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 6, 12])
+def test_exponent_split_across_chunks(chunk_size):
+    wcon = io.StringIO('{"data": [1e5, -2.5E-3]}')
+    assert _materialize(wcon_items(wcon, chunk_size=chunk_size)) == {'data': [1e5, -2.5e-3]}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 6, 12])
+def test_top_level_number_split_across_chunks(chunk_size):
+    wcon = io.StringIO('{"version": 1.25, "data": []}')
+    assert _materialize(wcon_items(wcon, chunk_size=chunk_size)) == {'version': 1.25,
+                                                                      'data': []}
+
+
+def test_data_partially_consumed():
+    wcon = io.StringIO(json.dumps(WCON))
+    keys = []
+    for key, value in wcon_items(wcon, chunk_size=3):
+        keys.append(key)
+        if key == 'data':
+            next(value)
+    assert keys == list(WCON.keys())
+
+
+def test_single_data_record_object():
+    doc = dict(WCON, data=WCON['data'][0])
+    wcon = io.StringIO(json.dumps(doc))
+    assert _materialize(wcon_items(wcon)) == doc
+
+
+def test_empty_object():
+    assert list(wcon_items(io.StringIO(' {} '))) == []
+
+
+def test_not_an_object():
+    with pytest.raises(json.JSONDecodeError):
+        list(wcon_items(io.StringIO('[]')))
+
+
+def test_truncated():
+    with pytest.raises(json.JSONDecodeError):
+        _materialize(wcon_items(io.StringIO(json.dumps(WCON)[:-20]), chunk_size=8))
+
+
+def test_fill_in_stream_same_as_fill_in():
+    def fill(how):
+        ctx = Context('http://example.org/ctx')
+        tracks = ctx(WormTracks)(ident='http://example.org/tracks')
+        if how == 'stream':
+            WCONWormTracksCreator_2020_07.fill_in_stream(tracks,
+                    wcon_items(io.StringIO(json.dumps(WCON))), context=ctx)
+        else:
+            WCONWormTracksCreator_2020_07.fill_in(tracks, WCON, context=ctx)
+        return set(ctx.contents_triples())
+
+    assert fill('stream') == fill('load')
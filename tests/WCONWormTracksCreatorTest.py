@@ -0,0 +1,72 @@
+import io
+import json
+
+import pytest
+from owmeta_core.context import Context
+from owmeta_core.json_schema import AssignmentValidationException
+from rdflib.term import URIRef
+
+from owmeta_movement import (DataRecord, WormTracks, WCONWormTracksCreator,
+                             WCON_SCHEMA_2020_07)
+from owmeta_movement.wcon_stream import wcon_items
+
+
+WCON = {
+    'units': {'t': 's', 'x': 'mm', 'y': 'mm'},
+    'data': [
+        {'id': '1', 't': [0.0], 'x': [1.0], 'y': [2.0], 'ptail': 3, 'head': 'L',
+         '@MWT': {'area': [1]}, 'foo': 'bar'},
+        {'id': '2', 't': [1.0, 2.0], 'x': [[1.0, 2.0], [3.0, 4.0]],
+         'y': [[5.0, 6.0], [7.0, 8.0]], 'ventral': 'CW'},
+    ],
+}
+
+
+def fill(wcon, bulk, stream=False):
+    ctx = Context('http://example.org/ctx')
+    tracks = ctx(WormTracks)(ident='http://example.org/tracks')
+    creator = WCONWormTracksCreator(WCON_SCHEMA_2020_07, bulk=bulk)
+    if stream:
+        creator.fill_in_stream(tracks, wcon_items(io.StringIO(json.dumps(wcon))),
+                context=ctx)
+    else:
+        creator.fill_in(tracks, wcon, context=ctx)
+    return ctx
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_bulk_same_as_regular(stream):
+    bulk = fill(WCON, True, stream=stream)
+    regular = fill(WCON, False, stream=stream)
+    assert set(bulk.contents_triples()) == set(regular.contents_triples())
+
+
+def test_bulk_statements_in_context():
+    ctx = fill(WCON, True)
+    assert (URIRef('http://example.org/tracks#data/1'),
+            DataRecord.schema_namespace['ventral'],
+            None) in ctx.rdf_graph()
+
+
+def test_bulk_invalid_record_falls_back():
+    wcon = dict(WCON, data=WCON['data'] + [{'id': 3, 't': [0.0], 'x': [1.0], 'y': [2.0]}])
+    with pytest.raises(AssignmentValidationException):
+        fill(wcon, True)
+
+
+@pytest.mark.parametrize('bad', [{'ventral': 5}, {'head': 'L', 't': ['0.0']},
+                                 {'x': [[1.0], 'a']}, {'ptail': True}])
+def test_bulk_mismatched_value_falls_back(bad):
+    record = dict({'id': '3', 't': [0.0], 'x': [1.0], 'y': [2.0]}, **bad)
+    wcon = dict(WCON, data=WCON['data'] + [record])
+    with pytest.raises(AssignmentValidationException):
+        fill(wcon, True)
+
+
+def test_records_validated_by_default():
+    wcon = dict(WCON, data=WCON['data'] + [{'id': '3', 't': [0.0], 'x': [1.0], 'y': [2.0],
+                                            'ventral': 5}])
+    ctx = Context('http://example.org/ctx')
+    tracks = ctx(WormTracks)(ident='http://example.org/tracks')
+    with pytest.raises(AssignmentValidationException):
+        WCONWormTracksCreator(WCON_SCHEMA_2020_07).fill_in(tracks, wcon, context=ctx)
@@ -0,0 +1,188 @@
+import json
+from os.path import isfile, join as p
+from unittest.mock import Mock
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from owmeta_movement.command import ZenodoCommand
+from owmeta_movement.zenodo import ZenodoRecordDirLoader, RecordFile
+from owmeta_movement.zenodo_catalog import (ZenodoCatalog, CatalogRecord,
+                                            CATALOG_CONF_KEY, CATALOG_FILE_NAME,
+                                            sync_catalog)
+
+from .ZenodoTest import recorded_requests
+
+pytest.importorskip('httpx')
+
+
+RECORD_COUNT = 30
+
+
+def test_sync_catalog(tmp_path, https_server):
+    serve_community(https_server)
+    with ZenodoCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        records = sync_catalog(catalog, 'worms', https_server.url,
+                verify=https_server.ssl_context)
+        assert len(records) == RECORD_COUNT
+        saved = list(catalog.records(https_server.url))
+    assert sorted(r.record_id for r in saved) == sorted(str(i) for i in record_ids())
+    record = next(r for r in saved if r.record_id == '1002')
+    assert record.title == 'Record 1002'
+    assert record.version == 'v2'
+    assert record.concept_id == '2'
+    assert record.files == [RecordFile('1002.wcon', 4, 'md5:abcd',
+                                       f'{https_server.url}/files/1002.wcon')]
+
+
+def test_sync_catalog_fetches_missing_files(tmp_path, https_server):
+    serve_community(https_server)
+    with ZenodoCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        sync_catalog(catalog, 'worms', https_server.url, verify=https_server.ssl_context)
+        assert [f.name for f in catalog.record_files(1003, https_server.url)] == \
+                ['1003.wcon']
+    detail_requests = [r for r in recorded_requests(https_server)
+                       if r['path'] == '/api/records/1003']
+    assert len(detail_requests) == 1
+
+
+def test_sync_catalog_replaces_records(tmp_path):
+    with ZenodoCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        catalog.save_records([CatalogRecord('1', None, None, None,
+            [RecordFile('a'), RecordFile('b')])])
+        catalog.save_records([CatalogRecord('1', None, None, None, [RecordFile('c')])])
+        assert catalog.record_files(1) == [RecordFile('c')]
+
+
+def test_record_files_not_cataloged(tmp_path):
+    with ZenodoCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        assert catalog.record_files(1) is None
+
+
+def test_record_files_base_url(tmp_path):
+    with ZenodoCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        catalog.save_records([CatalogRecord('1', None, None, None, [RecordFile('a')])],
+                'https://zenodo.example.org')
+        assert catalog.record_files(1) is None
+        assert catalog.record_files(1, 'https://zenodo.example.org') == [RecordFile('a')]
+
+
+def test_loader_lists_files_from_catalog(tmp_path):
+    catalog_path = str(tmp_path / 'catalog.sqlite')
+    with ZenodoCatalog(catalog_path) as catalog:
+        catalog.save_records([CatalogRecord('4074963', None, None, None,
+            [RecordFile('a.tar.gz', 4, None, None)])], 'https://zenodo.example.org')
+
+    cut = ZenodoRecordDirLoader(str(tmp_path / 'loader'), no_network)
+    ob = record_data_source(catalog_path)
+    assert list(cut._record_files(ob, '4074963', 'https://zenodo.example.org')) == \
+            ['a.tar.gz']
+
+
+def test_loader_lists_files_from_api_if_none_cataloged(tmp_path):
+    catalog_path = str(tmp_path / 'catalog.sqlite')
+    with ZenodoCatalog(catalog_path) as catalog:
+        catalog.save_records([CatalogRecord('4074963', None, None, None, [])],
+                'https://zenodo.example.org')
+
+    cut = ZenodoRecordDirLoader(str(tmp_path / 'loader'), no_network)
+    ob = record_data_source(catalog_path)
+    with pytest.raises(AssertionError, match='network'):
+        cut._record_files(ob, '4074963', 'https://zenodo.example.org')
+
+
+def test_loader_offline_lists_files_from_catalog(tmp_path):
+    catalog_path = str(tmp_path / 'catalog.sqlite')
+    with ZenodoCatalog(catalog_path) as catalog:
+        catalog.save_records([CatalogRecord('4074963', None, None, None,
+            [RecordFile('a.tar.gz')])], 'https://zenodo.example.org')
+    recorddir = tmp_path / 'loader' / '4074963'
+    recorddir.mkdir(parents=True)
+    (recorddir / 'a.tar.gz').write_bytes(b'blah')
+
+    cut = ZenodoRecordDirLoader(str(tmp_path / 'loader'), offline=True)
+    assert cut.load(record_data_source(catalog_path)) == str(recorddir)
+
+
+def test_catalog_in_owm_directory(tmp_path):
+    with ZenodoCatalog(str(tmp_path / CATALOG_FILE_NAME)) as catalog:
+        catalog.save_records([CatalogRecord('4074963', None, None, None,
+            [RecordFile('a.tar.gz')])], 'https://zenodo.example.org')
+    cut = ZenodoRecordDirLoader(str(tmp_path / 'loader'))
+    ob = record_data_source(None)
+    ob.conf = {'owm.directory': str(tmp_path)}
+    assert cut._catalog_record_files(ob, '4074963', 'https://zenodo.example.org') == \
+            [RecordFile('a.tar.gz')]
+
+
+def test_command_sync_and_list_files(tmp_path, https_server, monkeypatch):
+    serve_community(https_server)
+    parent = Mock()
+    parent.owmdir = str(tmp_path / '.owm')
+    cmd = ZenodoCommand(parent)
+
+    def sync_with_test_cert(*args, **kwargs):
+        return sync_catalog(*args, verify=https_server.ssl_context, **kwargs)
+    monkeypatch.setattr('owmeta_movement.command.sync_catalog', sync_with_test_cert)
+    records = list(cmd.sync_catalog('worms', https_server.url))
+    assert len(records) == RECORD_COUNT
+
+    assert isfile(p(parent.owmdir, CATALOG_FILE_NAME))
+    assert cmd.list_files(1010, https_server.url,
+            session_provider='tests.ZenodoCatalogTest:no_network') == ['1010.wcon']
+
+
+def no_network():
+    raise AssertionError('Attempted to use the network')
+
+
+def record_data_source(catalog_path):
+    ob = Mock()
+    ob.zenodo_base_url.return_value = 'https://zenodo.example.org'
+    ob.zenodo_id.return_value = 4074963
+    ob.zenodo_file_name.return_value = None
+    ob.conf = {CATALOG_CONF_KEY: catalog_path}
+    return ob
+
+
+def record_ids():
+    return range(1000, 1000 + RECORD_COUNT)
+
+
+def record_hit(base_url, record_id):
+    hit = {'id': record_id,
+           'conceptrecid': str(record_id - 1000),
+           'metadata': {'title': f'Record {record_id}', 'version': 'v2'}}
+    # One record doesn't list its files in search results
+    if record_id != 1003:
+        hit['files'] = [{'key': f'{record_id}.wcon',
+                         'size': 4,
+                         'checksum': 'md5:abcd',
+                         'links': {'self': f'{base_url}/files/{record_id}.wcon'}}]
+    return hit
+
+
+def serve_community(server):
+    def handler(server_data):
+        class handler_class(server_data.basic_handler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == '/api/communities/worms/records':
+                    query = parse_qs(url.query)
+                    page = int(query['page'][0])
+                    size = int(query['size'][0])
+                    ids = list(record_ids())[(page - 1) * size:page * size]
+                    body = {'hits': {'total': RECORD_COUNT,
+                                     'hits': [record_hit(server_data.url, i)
+                                              for i in ids]}}
+                elif url.path == '/api/records/1003':
+                    body = dict(record_hit(server_data.url, 1002), id=1003)
+                    body['files'] = [{'key': '1003.wcon', 'size': 4}]
+                else:
+                    self.handle_request(404)
+                    return
+                self.handle_request(200)
+                self.wfile.write(json.dumps(body).encode())
+        return handler_class
+    server.make_server(handler)
+    server.restart()
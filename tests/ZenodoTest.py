@@ -1,11 +1,17 @@
+import hashlib
+import io
+import json
 import os
 from os.path import join as p
 from unittest.mock import Mock
 import shutil
+import threading
+import time
 import pytest
 
 from owmeta_core.datasource_loader import LoadFailed
-from owmeta_movement.zenodo import ZenodoRecordDirLoader
+from owmeta_movement import zenodo
+from owmeta_movement.zenodo import ZenodoRecordDirLoader, RecordFile, list_record_file_info
 import requests
 
 
@@ -140,6 +146,373 @@ def test_load_some_files(tmp_path, https_server):
         cut.load(ob)
 
 
+def test_load_file_verified(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    dsdir = cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == b'blah'
+    assert os.listdir(dsdir) == ['a.tar.gz']
+
+
+def test_load_file_checksum_mismatch(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'},
+            checksums={'a.tar.gz': 'md5:' + md5(b'bla')})
+    with pytest.raises(LoadFailed, match='a.tar.gz'):
+        cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    assert os.listdir(p(cut.base_directory, '4074963')) == []
+
+
+def test_load_file_replaces_truncated(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    os.makedirs(p(cut.base_directory, '4074963'))
+    with open(p(cut.base_directory, '4074963', 'a.tar.gz'), 'wb') as f:
+        f.write(b'bl')
+    dsdir = cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == b'blah'
+
+
+def test_load_existing_file_verified_once(tmp_path, https_server, monkeypatch):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    os.makedirs(p(cut.base_directory, '4074963'))
+    with open(p(cut.base_directory, '4074963', 'a.tar.gz'), 'wb') as f:
+        f.write(b'blah')
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    cut.load(ob)
+    assert not [r for r in recorded_requests(https_server) if 'files' in r['path']]
+
+    def fail(*args):
+        raise AssertionError('File was hashed again')
+    monkeypatch.setattr(zenodo, '_hash_file', fail)
+    cut.load(ob)
+
+
+def test_load_verified_file_skips_record(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    cut.load(ob)
+    assert recorded_requests(https_server)
+    cut.load(ob)
+    assert recorded_requests(https_server) == []
+
+
+def test_load_all_files_verified(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah', 'b.tar.gz': b'bleh'})
+    dsdir = cut.load(record_data_source(https_server.url, None))
+    assert sorted(os.listdir(dsdir)) == ['a.tar.gz', 'b.tar.gz']
+
+
+def test_load_file_resumed(tmp_path, https_server):
+    data = os.urandom(100000)
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': data}, fail_after=30000,
+            failures=2)
+    dsdir = cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == data
+    assert os.listdir(dsdir) == ['a.tar.gz']
+    ranges = [r['headers'].get('range') for r in recorded_requests(https_server)
+              if 'files' in r['path']]
+    assert ranges == [None, 'bytes=30000-', 'bytes=60000-']
+
+
+def test_load_file_resumed_without_sizes_in_responses(tmp_path, https_server):
+    '''
+    The size listed for the file is what's expected after resuming, rather than what was
+    received before
+    '''
+    data = os.urandom(1000)
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': data}, fail_after=300,
+            sizes=False)
+    dsdir = cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == data
+    ranges = [r['headers'].get('range') for r in recorded_requests(https_server)
+              if 'files' in r['path']]
+    assert ranges == [None, 'bytes=300-']
+
+
+def test_load_file_resumed_by_later_load(tmp_path, https_server):
+    data = os.urandom(100000)
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': data}, fail_after=30000)
+    cut.download_attempts = 1
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    with pytest.raises(LoadFailed):
+        cut.load(ob)
+    assert not os.path.exists(p(cut.base_directory, '4074963', 'a.tar.gz'))
+    assert recorded_requests(https_server)
+
+    dsdir = cut.load(ob)
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == data
+    ranges = [r['headers'].get('range') for r in recorded_requests(https_server)
+              if 'files' in r['path']]
+    assert ranges == ['bytes=30000-']
+
+
+def test_load_file_ranges_unsupported(tmp_path, https_server):
+    data = os.urandom(100000)
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': data}, fail_after=30000,
+            ranges=False)
+    dsdir = cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == data
+
+
+def test_load_file_too_many_failures(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': os.urandom(1000)},
+            fail_after=10, failures=10)
+    with pytest.raises(LoadFailed, match='attempts'):
+        cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+
+
+def test_load_all_files_reports_failures(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah', 'b.tar.gz': b'bleh',
+                                                'c.tar.gz': b'bluh'},
+            checksums={'a.tar.gz': 'md5:' + md5(b'blah'),
+                       'b.tar.gz': 'md5:' + md5(b'bla'),
+                       'c.tar.gz': 'md5:' + md5(b'bluh')})
+    with pytest.raises(LoadFailed, match=r'1 of 3 files \(b.tar.gz: .*Loaded: a.tar.gz, c.tar.gz'):
+        cut.load(record_data_source(https_server.url, None))
+    assert sorted(os.listdir(p(cut.base_directory, '4074963'))) == ['a.tar.gz', 'c.tar.gz']
+
+
+def test_load_all_files_connections_per_host(tmp_path):
+    files = {f'{i}.tar.gz': os.urandom(100) for i in range(6)}
+    session = ConcurrencyTrackingSession(files)
+    cut = ZenodoRecordDirLoader(tmp_path, lambda: session, max_workers=4,
+            max_connections_per_host=2)
+    cut.load(record_data_source('https://zenodo.example.org', None))
+    assert session.max_active == 2
+    for name, data in files.items():
+        with open(p(tmp_path, '4074963', name), 'rb') as f:
+            assert f.read() == data
+
+
+def test_load_file_retries_unavailable(tmp_path, http_server):
+    cut = serve_record(http_server, tmp_path, {'a.tar.gz': b'blah'}, unavailable=2)
+    dsdir = cut.load(record_data_source(http_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == b'blah'
+    file_requests = [r for r in recorded_requests(http_server) if 'files' in r['path']]
+    assert len(file_requests) == 3
+
+
+def test_default_session_per_thread_shared_pool(tmp_path):
+    cut = ZenodoRecordDirLoader(tmp_path)
+    session = cut._session_provider()
+    assert cut._session_provider() is session
+    other_thread_sessions = []
+    thread = threading.Thread(
+            target=lambda: other_thread_sessions.append(cut._session_provider()))
+    thread.start()
+    thread.join()
+    other_session = other_thread_sessions[0]
+    assert other_session is not session
+    assert (other_session.get_adapter('https://zenodo.org') is
+            session.get_adapter('https://zenodo.org'))
+
+
+def test_load_all_files_from_api(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah', 'b.tar.gz': b'bleh'})
+    cut.load(record_data_source(https_server.url, None))
+    paths = [r['path'] for r in recorded_requests(https_server)]
+    assert '/record/4074963' not in paths
+    assert '/api/records/4074963/files/a.tar.gz/content' in paths
+
+
+def test_load_all_files_from_record_page(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah', 'b.tar.gz': b'bleh'},
+            api=False)
+    dsdir = cut.load(record_data_source(https_server.url, None))
+    assert sorted(os.listdir(dsdir)) == ['a.tar.gz', 'b.tar.gz']
+    paths = [r['path'] for r in recorded_requests(https_server)]
+    assert '/record/4074963' in paths
+
+
+def test_load_file_wrong_size_replaced(tmp_path, https_server, monkeypatch):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    os.makedirs(p(cut.base_directory, '4074963'))
+    with open(p(cut.base_directory, '4074963', 'a.tar.gz'), 'wb') as f:
+        f.write(b'bl')
+
+    def fail(*args):
+        raise AssertionError('File of the wrong size was hashed')
+    monkeypatch.setattr(zenodo, '_hash_file', fail)
+    dsdir = cut.load(record_data_source(https_server.url, 'a.tar.gz'))
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == b'blah'
+
+
+def test_list_record_file_info(https_server, tmp_path):
+    serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    session = requests.Session()
+    https_server.trust_server(session)
+    assert list(list_record_file_info(4074963, session=session,
+            zenodo_base_url=https_server.url)) == [
+        RecordFile('a.tar.gz', 4, 'md5:' + md5(b'blah'),
+            f'{https_server.url}/api/records/4074963/files/a.tar.gz/content')]
+
+
+def test_list_record_file_info_html_fallback(https_server):
+    recorddir = p(https_server.base_directory, 'record')
+    os.mkdir(recorddir)
+    shutil.copyfile(p('tests', 'testdata', 'zenodo_record_20210122.html'),
+                    p(recorddir, '4074963'))
+    session = requests.Session()
+    https_server.trust_server(session)
+    files = list(list_record_file_info(4074963, session=session,
+            zenodo_base_url=https_server.url))
+    assert files[0] == RecordFile('CeMEE_MWT_founders.tar.gz',
+            checksum='md5:f9057f352e15bc597b578a912c913b91')
+    assert len(files) == 4
+
+
+def test_can_load_cached(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    assert cut.can_load(ob)
+    assert cut.can_load(ob)
+    assert head_requests(https_server) == 1
+
+    session = requests.Session()
+    https_server.trust_server(session)
+    other = ZenodoRecordDirLoader(tmp_path, lambda: session)
+    assert other.can_load(ob)
+    assert head_requests(https_server) == 0
+
+
+def test_can_load_not_found_cached(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    ob = record_data_source(https_server.url, 'b.tar.gz')
+    assert not cut.can_load(ob)
+    assert not cut.can_load(ob)
+    assert head_requests(https_server) == 1
+
+
+def test_can_load_cache_expires(tmp_path, https_server, monkeypatch):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    now = time.time()
+    monkeypatch.setattr(zenodo.time, 'time', lambda: now)
+    assert cut.can_load(ob)
+    now += cut.can_load_ttl + 1
+    assert cut.can_load(ob)
+    assert head_requests(https_server) == 2
+
+
+def test_can_load_cache_disabled(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'}, can_load_ttl=0)
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    assert cut.can_load(ob)
+    assert cut.can_load(ob)
+    assert head_requests(https_server) == 2
+
+
+def test_can_load_verified_file_without_network(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'}, can_load_ttl=0)
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    cut.load(ob)
+    assert recorded_requests(https_server)
+    assert cut.can_load(ob)
+    assert recorded_requests(https_server) == []
+
+
+def test_can_load_verified_record_without_network(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah', 'b.tar.gz': b'bleh'},
+            can_load_ttl=0)
+    ob = record_data_source(https_server.url, None)
+    cut.load(ob)
+    assert recorded_requests(https_server)
+    assert cut.can_load(ob)
+    assert recorded_requests(https_server) == []
+
+
+def test_can_load_changed_file_checked(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'}, can_load_ttl=0)
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    dsdir = cut.load(ob)
+    with open(p(dsdir, 'a.tar.gz'), 'wb') as f:
+        f.write(b'changed')
+    assert recorded_requests(https_server)
+    cut.can_load(ob)
+    assert head_requests(https_server) == 1
+
+
+@pytest.fixture
+def offline_env(monkeypatch):
+    monkeypatch.setenv(zenodo.OFFLINE_ENV_VAR, '1')
+
+
+def no_network():
+    raise AssertionError('Attempted to use the network while offline')
+
+
+def test_offline_load_downloaded_file(tmp_path, https_server, monkeypatch):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    cut.load(ob)
+
+    monkeypatch.setenv(zenodo.OFFLINE_ENV_VAR, '1')
+    offline = ZenodoRecordDirLoader(tmp_path, no_network)
+    assert offline.can_load(ob)
+    dsdir = offline.load(ob)
+    with open(p(dsdir, 'a.tar.gz'), 'rb') as f:
+        assert f.read() == b'blah'
+
+
+def test_offline_load_downloaded_record(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah', 'b.tar.gz': b'bleh'})
+    ob = record_data_source(https_server.url, None)
+    cut.load(ob)
+
+    offline = ZenodoRecordDirLoader(tmp_path, no_network, offline=True)
+    assert offline.can_load(ob)
+    assert sorted(os.listdir(offline.load(ob))) == ['a.tar.gz', 'b.tar.gz']
+
+
+def test_offline_missing_file(tmp_path, offline_env):
+    cut = ZenodoRecordDirLoader(tmp_path, no_network)
+    ob = record_data_source('https://zenodo.example.org', 'a.tar.gz')
+    assert not cut.can_load(ob)
+    with pytest.raises(LoadFailed, match='Offline.*a.tar.gz'):
+        cut.load(ob)
+
+
+def test_offline_record_not_listed(tmp_path, offline_env):
+    cut = ZenodoRecordDirLoader(tmp_path, no_network)
+    ob = record_data_source('https://zenodo.example.org', None)
+    assert not cut.can_load(ob)
+    with pytest.raises(LoadFailed, match='Offline.*not been listed'):
+        cut.load(ob)
+
+
+def test_offline_from_conf(tmp_path):
+    cut = ZenodoRecordDirLoader(tmp_path, no_network)
+    ob = record_data_source('https://zenodo.example.org', 'a.tar.gz')
+    ob.conf = {zenodo.OFFLINE_CONF_KEY: True}
+    assert not cut.can_load(ob)
+
+
+def test_offline_env_overrides_conf(tmp_path, monkeypatch):
+    monkeypatch.setenv(zenodo.OFFLINE_ENV_VAR, 'false')
+    cut = ZenodoRecordDirLoader(tmp_path, offline=True)
+    ob = record_data_source('https://zenodo.example.org', 'a.tar.gz')
+    ob.conf = {zenodo.OFFLINE_CONF_KEY: True}
+    assert not cut._offline(ob)
+
+
+def test_offline_changed_file(tmp_path, https_server):
+    cut = serve_record(https_server, tmp_path, {'a.tar.gz': b'blah'})
+    ob = record_data_source(https_server.url, 'a.tar.gz')
+    dsdir = cut.load(ob)
+    with open(p(dsdir, 'a.tar.gz'), 'wb') as f:
+        f.write(b'changed')
+
+    offline = ZenodoRecordDirLoader(tmp_path, no_network, offline=True)
+    with pytest.raises(LoadFailed, match='checksum'):
+        offline.load(ob)
+
+
 @pytest.mark.inttest
 def test_load_real():
     '''
@@ -152,3 +525,194 @@ def zenodo_dir_loader(tmp_path, https_server):
     session = requests.Session()
     https_server.trust_server(session)
     return ZenodoRecordDirLoader(tmp_path, lambda: session), https_server
+
+
+RECORDED_REQUESTS_MARKER = '/recorded-requests-marker'
+
+
+def recorded_requests(server):
+    '''
+    Requests recorded by `server` since the last call
+
+    Requests are recorded by the server process, so they may not have arrived yet. The
+    server handles one request at a time, so once a marker request sent after the others
+    arrives, all of them have
+    '''
+    session = requests.Session()
+    server.trust_server(session)
+    session.get(server.url + RECORDED_REQUESTS_MARKER)
+    res = []
+    while True:
+        request = server.requests.get(timeout=10)
+        if request['path'] == RECORDED_REQUESTS_MARKER:
+            return res
+        res.append(request)
+
+
+def head_requests(server):
+    return len([r for r in recorded_requests(server)
+                if r['method'] == 'HEAD' and r['path'] != '/'])
+
+
+def serve_record(server, tmp_path, files, checksums=None, fail_after=None,
+        failures=1, ranges=True, unavailable=0, api=True, sizes=True,
+        **loader_kwargs):
+    '''
+    Serve a Zenodo record page listing `files`, and the files themselves. Returns a
+    loader for the record, created with `loader_kwargs`
+
+    If `fail_after` is given, the first `failures` responses for each file are cut off
+    after that many bytes. Range requests are honored if `ranges` is true. The first
+    `unavailable` requests for each file get a 503 response. The record is only
+    available from the Zenodo API if `api` is true. File sizes are only sent in
+    responses if `sizes` is true
+    '''
+    page = record_page(files, checksums)
+    remaining_failures = {name: failures if fail_after is not None else 0
+                          for name in files}
+    remaining_unavailable = {name: unavailable for name in files}
+
+    def handler(server_data):
+        class handler_class(server_data.basic_handler):
+            def do_HEAD(self):
+                if (self.path.endswith('4074963') or
+                        file_name_from_url(self.path) in files):
+                    self.handle_request(200)
+                else:
+                    self.handle_request(404)
+
+            def do_GET(self):
+                if self.path == '/api/records/4074963':
+                    if api:
+                        self.handle_request(200)
+                        self.wfile.write(record_json(server_data.url, files, checksums))
+                    else:
+                        self.handle_request(404)
+                    return
+                if self.path.endswith('4074963'):
+                    self.handle_request(200)
+                    self.wfile.write(page)
+                    return
+                self.queue_reuqest()
+                name = file_name_from_url(self.path)
+                if name not in files:
+                    self.send_error(404)
+                    return
+                if remaining_unavailable[name] > 0:
+                    remaining_unavailable[name] -= 1
+                    self.send_error(503)
+                    return
+                data = files[name]
+                range_header = self.headers.get('Range')
+                start = 0
+                if ranges and range_header:
+                    start = int(range_header[len('bytes='):-1])
+                    self.send_response(206)
+                    total = len(data) if sizes else '*'
+                    self.send_header('Content-Range',
+                            f'bytes {start}-{len(data) - 1}/{total}')
+                else:
+                    self.send_response(200)
+                if sizes:
+                    self.send_header('Content-Length', str(len(data) - start))
+                self.send_header('ETag', '"v1"')
+                self.end_headers()
+                if remaining_failures[name] > 0:
+                    remaining_failures[name] -= 1
+                    self.wfile.write(data[start:start + fail_after])
+                else:
+                    self.wfile.write(data[start:])
+        return handler_class
+    server.make_server(handler)
+    server.restart()
+    if server.scheme == 'https':
+        session = requests.Session()
+        server.trust_server(session)
+        loader_kwargs.setdefault('session_provider', lambda: session)
+    loader_kwargs.setdefault('backoff_factor', 0)
+    return ZenodoRecordDirLoader(tmp_path, **loader_kwargs)
+
+
+def record_page(files, checksums=None):
+    if checksums is None:
+        checksums = {name: 'md5:' + md5(data) for name, data in files.items()}
+    rows = []
+    for name in files:
+        rows.append(f'''<tr><td>
+            <a class="filename" href="/record/4074963/files/{name}?download=1">{name}</a>
+            <br/><small class="text-muted nowrap">{checksums[name]}</small>
+            </td></tr>''')
+    return ('<html><body><table>' + ''.join(rows) + '</table></body></html>').encode()
+
+
+def record_json(base_url, files, checksums=None):
+    if checksums is None:
+        checksums = {name: 'md5:' + md5(data) for name, data in files.items()}
+    return json.dumps({'id': 4074963, 'files': [
+        {'key': name,
+         'size': len(data),
+         'checksum': checksums[name],
+         'links': {'self': f'{base_url}/api/records/4074963/files/{name}/content'}}
+        for name, data in files.items()]}).encode()
+
+
+def file_name_from_url(url):
+    name = url.split('/files/')[-1].split('?')[0]
+    if name.endswith('/content'):
+        name = name[:-len('/content')]
+    return name
+
+
+def record_data_source(base_url, file_name):
+    ob = Mock()
+    ob.zenodo_base_url.return_value = base_url
+    ob.zenodo_id.return_value = 4074963
+    ob.zenodo_file_name.return_value = file_name
+    return ob
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+class ConcurrencyTrackingSession:
+    '''
+    Stands in for a `requests.Session`, recording how many file downloads are in
+    progress at once
+    '''
+    def __init__(self, files):
+        self.files = files
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        if url.endswith('/api/records/4074963'):
+            return FakeResponse(record_json('https://zenodo.example.org', self.files))
+        return FakeResponse(self.files[file_name_from_url(url)], self)
+
+
+class FakeResponse:
+    def __init__(self, data, session=None):
+        self.status_code = 200
+        self.headers = {'Content-Length': str(len(data))}
+        self.raw = io.BytesIO(data)
+        self.content = data
+        self.session = session
+
+    def json(self):
+        return json.loads(self.content)
+
+    def __enter__(self):
+        if self.session:
+            with self.session.lock:
+                self.session.active += 1
+                self.session.max_active = max(self.session.max_active,
+                                              self.session.active)
+            time.sleep(0.1)
+        return self
+
+    def __exit__(self, *args):
+        if self.session:
+            with self.session.lock:
+                self.session.active -= 1